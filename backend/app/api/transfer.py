@@ -0,0 +1,325 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.deps import get_current_user
+from app.db.models import Tag, Todo, TodoStatus, todo_tags
+from app.db.sharding import shards
+from app.services.embeddings import vector_index
+from app.services.ranking import key_between
+from app.services.todo import TodoService, normalize_tag_names, retry_rank_conflicts
+
+# Rows fetched per server-side cursor round trip while exporting
+EXPORT_CHUNK_SIZE = 1000
+# Rows inserted per executemany batch (and transaction) while importing
+IMPORT_BATCH_SIZE = 1000
+# Maximum number of row errors reported back by an import
+MAX_REPORTED_ERRORS = 100
+
+EXPORT_FIELDS = [
+    "id",
+    "title",
+    "description",
+    "status",
+    "priority",
+    "due_date",
+    "is_ai_generated",
+    "created_at",
+    "updated_at",
+    "completed_at",
+    "tags",
+]
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+router = APIRouter(prefix="/todos", tags=["todos"])
+
+
+def _serialize_value(value: Any) -> Any:
+    """Convert a column value to its JSON/CSV representation"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, TodoStatus):
+        return value.value
+    return value
+
+
+async def _export_rows(user_id: int) -> AsyncGenerator[List[Dict[str, Any]], None]:
+    """
+    Stream a user's todos from a server-side cursor, one chunk at a time.
+    Tags for each chunk are fetched with a single query.
+    """
+    columns = [getattr(Todo, field) for field in EXPORT_FIELDS if field != "tags"]
+    query = (
+        select(*columns)
+        .filter(Todo.user_id == user_id)
+        .order_by(Todo.id)
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+
+    async with shards.session(user_id) as session:
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            rows = [dict(row._mapping) for row in partition]
+
+            tags_by_todo: Dict[int, List[str]] = {}
+            tag_result = await session.execute(
+                select(todo_tags.c.todo_id, Tag.name)
+                .join(Tag, Tag.id == todo_tags.c.tag_id)
+                .filter(todo_tags.c.todo_id.in_([row["id"] for row in rows]))
+                .order_by(Tag.name)
+            )
+            for todo_id, name in tag_result:
+                tags_by_todo.setdefault(todo_id, []).append(name)
+
+            for row in rows:
+                row["tags"] = tags_by_todo.get(row["id"], [])
+            yield rows
+
+
+async def _export_ndjson(user_id: int) -> AsyncGenerator[str, None]:
+    """Export todos as newline-delimited JSON"""
+    async for rows in _export_rows(user_id):
+        yield "".join(
+            json.dumps({key: _serialize_value(value) for key, value in row.items()})
+            + "\n"
+            for row in rows
+        )
+
+
+async def _export_csv(user_id: int) -> AsyncGenerator[str, None]:
+    """Export todos as CSV with a header row; tags are comma-separated"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    async for rows in _export_rows(user_id):
+        for row in rows:
+            row["tags"] = ",".join(row["tags"])
+            writer.writerow([_serialize_value(row[field]) for field in EXPORT_FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+@router.get("/export")
+async def export_todos(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    user: dict = Depends(get_current_user),
+):
+    """Stream all todos of the current user as NDJSON or CSV"""
+    stream = (
+        _export_ndjson(user["id"]) if format == "ndjson" else _export_csv(user["id"])
+    )
+    return StreamingResponse(
+        stream,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="todos.{format}"'},
+    )
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncGenerator[str, None]:
+    """Split a byte stream into lines without buffering the whole body"""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8").rstrip("\r")
+
+
+async def _iter_ndjson_records(lines: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+    """Yield NDJSON records, one per non-blank line; decoded per row on import"""
+    async for line in lines:
+        if line.strip():
+            yield line
+
+
+async def _iter_csv_records(
+    lines: AsyncIterator[str],
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Parse CSV records using the first row as header"""
+    header: Optional[List[str]] = None
+    record = ""
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        # A quoted field may span several lines; wait until quotes balance
+        if record.count('"') % 2:
+            continue
+        if record.strip():
+            values = next(csv.reader([record]))
+            if header is None:
+                header = values
+            else:
+                yield dict(zip(header, values))
+        record = ""
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    """Parse an ISO 8601 datetime, treating blanks as missing"""
+    if value in (None, ""):
+        return None
+    return datetime.fromisoformat(str(value))
+
+
+def _parse_bool(value: Any) -> bool:
+    """Parse a JSON or CSV boolean"""
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes")
+
+
+def _parse_record(record: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Convert an imported NDJSON line or CSV record into todo column values"""
+    if isinstance(record, str):
+        record = json.loads(record)
+        if not isinstance(record, dict):
+            raise ValueError("Each line must be a JSON object")
+
+    title = record.get("title") or ""
+    description = record.get("description") or None
+    if not isinstance(title, str) or not isinstance(description, (str, type(None))):
+        raise ValueError("Title and description must be strings")
+    # Only a missing priority defaults; 0 or a blank is rejected as invalid
+    priority = record.get("priority")
+    priority = 1 if priority is None else int(priority)
+    TodoService.validate(title=title, priority=priority)
+
+    status = TodoStatus(str(record.get("status") or TodoStatus.PENDING.value).upper())
+    created_at = _parse_datetime(record.get("created_at")) or datetime.utcnow()
+    completed_at = _parse_datetime(record.get("completed_at"))
+    if status == TodoStatus.COMPLETED and completed_at is None:
+        completed_at = created_at
+
+    tags = record.get("tags") or []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    if not isinstance(tags, list) or not all(isinstance(name, str) for name in tags):
+        raise ValueError("Tags must be a list of strings or a comma-separated string")
+
+    return {
+        "title": title,
+        "description": description,
+        "status": status,
+        "priority": priority,
+        "due_date": _parse_datetime(record.get("due_date")),
+        "is_ai_generated": _parse_bool(record.get("is_ai_generated", False)),
+        "created_at": created_at,
+        "completed_at": completed_at if status == TodoStatus.COMPLETED else None,
+        "tags": normalize_tag_names(tags),
+    }
+
+
+async def _insert_batch(
+    session: AsyncSession, user_id: int, rows: List[Dict[str, Any]]
+) -> None:
+    """
+    Insert a batch of parsed rows with executemany, after the user's last
+    todo. The rows are left as they are, so that a conflicting batch can be
+    inserted again.
+    """
+    last_rank = await TodoService(session).get_last_rank(user_id)
+    values = []
+    for row in rows:
+        last_rank = key_between(last_rank, None)
+        value = {key: row[key] for key in row if key != "tags"}
+        value.update(rank=last_rank, user_id=user_id)
+        values.append(value)
+    row_tags = [row["tags"] for row in rows]
+
+    # Core executemany with RETURNING is batched into multi-row INSERTs on
+    # both SQLite and Postgres. Rows are matched back to their IDs by rank,
+    # which is unique within the batch, so RETURNING order does not matter.
+    table = Todo.__table__
+    result = await session.execute(
+        insert(table).returning(table.c.id, table.c.rank), values
+    )
+    ids_by_rank = {rank: todo_id for todo_id, rank in result.all()}
+    todo_ids = [ids_by_rank[row["rank"]] for row in values]
+
+    tag_names = sorted({name for names in row_tags for name in names})
+    if tag_names:
+        tags = await TodoService(session).get_or_create_tags(user_id, tag_names)
+        await session.flush()
+        tag_ids = {tag.name: tag.id for tag in tags}
+        await session.execute(
+            insert(todo_tags),
+            [
+                {"todo_id": todo_id, "tag_id": tag_ids[name]}
+                for todo_id, names in zip(todo_ids, row_tags)
+                for name in names
+            ],
+        )
+
+    await session.commit()
+    session.expunge_all()
+    # Imported todos are embedded when the user's vector index is next loaded
+    vector_index.invalidate(user_id)
+
+
+@router.post("/import")
+async def import_todos(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    user: dict = Depends(get_current_user),
+):
+    """
+    Import todos from an NDJSON or CSV request body.
+    The body is parsed incrementally and rows are inserted in batches;
+    invalid rows are skipped and reported.
+    """
+    user_id = user["id"]
+    lines = _iter_lines(request.stream())
+    records = (
+        _iter_ndjson_records(lines) if format == "ndjson" else _iter_csv_records(lines)
+    )
+
+    imported = 0
+    errors: List[Dict[str, Any]] = []
+    error_count = 0
+    batch: List[Dict[str, Any]] = []
+
+    async with shards.session(user_id) as session:
+        row_number = 0
+        try:
+            async for record in records:
+                row_number += 1
+                try:
+                    batch.append(_parse_record(record))
+                except (TypeError, ValueError) as e:
+                    error_count += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({"row": row_number, "error": str(e)})
+                    continue
+
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    await retry_rank_conflicts(
+                        session, lambda: _insert_batch(session, user_id, batch)
+                    )
+                    imported += len(batch)
+                    batch = []
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise HTTPException(
+                status_code=400,
+                detail=(
+                    f"Malformed input after row {row_number}: {e}. "
+                    f"{imported} rows imported."
+                ),
+            )
+
+        if batch:
+            await retry_rank_conflicts(
+                session, lambda: _insert_batch(session, user_id, batch)
+            )
+            imported += len(batch)
+
+    return {"imported": imported, "failed": error_count, "errors": errors}
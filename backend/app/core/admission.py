@@ -0,0 +1,193 @@
+"""
+Admission control: shed low-priority requests early while the app is saturated.
+
+Saturation is the highest of three ratios to their configured limits:
+requests in flight, event loop lag (a moving average of how late a task
+sleeping for a fixed interval wakes up), and how long the oldest pending
+database connection checkout has been waiting. The last reflects the
+queue as it is now rather than waits that already ended, so shedding
+stops as soon as the queue drains. As saturation rises, new requests are
+rejected with 503 and Retry-After, by class: AI suggestions at half the
+limit, writes at 80% and reads at the limit itself. Rejecting early and
+cheaply keeps the admitted requests within their latency, where queueing
+everything would make all of them slow.
+
+The class of a GraphQL POST comes from its body, which is only read
+while something is being shed. /ready reports the same state, so the
+orchestrator stops routing traffic to a saturated instance.
+"""
+import asyncio
+import re
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import (
+    ADMISSION_PRESSURE,
+    EVENT_LOOP_LAG,
+    HTTP_REQUESTS_IN_FLIGHT,
+    REQUESTS_SHED,
+)
+
+# Saturation at which each class of request is shed
+SHED_AT = {"ai": 0.5, "write": 0.8, "read": 1.0}
+# Never shed: probes and scrapes must answer while the app is saturated
+EXEMPT_PATHS = {"/health", "/ready", "/metrics"}
+
+AI_FIELDS = re.compile(rb"\b(generateTodoSuggestion|enqueueTodoSuggestion)\b")
+MUTATION = re.compile(rb"\bmutation\b")
+SHED_BODY = b'{"detail": "Server is overloaded, retry later"}'
+
+LOOP_LAG_INTERVAL_SECONDS = 0.05
+# Weight of each new loop lag sample in the moving average
+LOOP_LAG_WEIGHT = 0.2
+
+
+class AdmissionController:
+    """Saturation signals of this process and the shedding decision"""
+
+    def __init__(self):
+        self.in_flight = 0
+        # Moving average, in seconds
+        self.loop_lag = 0.0
+        # Start times of the connection checkouts in progress, oldest first
+        self.pool_waiters: Dict[object, float] = {}
+        self._monitor: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Start measuring event loop lag"""
+        if self._monitor is None:
+            self._monitor = asyncio.create_task(self._measure_loop_lag())
+
+    async def stop(self) -> None:
+        if self._monitor:
+            self._monitor.cancel()
+            self._monitor = None
+
+    async def _measure_loop_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+            lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL_SECONDS)
+            self.loop_lag += LOOP_LAG_WEIGHT * (lag - self.loop_lag)
+
+    def pool_wait(self) -> float:
+        """Seconds the oldest connection checkout in progress has been waiting"""
+        for started in self.pool_waiters.values():
+            return time.perf_counter() - started
+        return 0.0
+
+    def pressure(self) -> float:
+        """Saturation as a fraction of the configured limits; reads are shed at 1"""
+        return max(
+            self.in_flight / settings.ADMISSION_MAX_IN_FLIGHT,
+            self.loop_lag * 1000 / settings.ADMISSION_LOOP_LAG_MS,
+            self.pool_wait() * 1000 / settings.ADMISSION_POOL_WAIT_MS,
+        )
+
+    def state(self) -> Dict[str, Any]:
+        """Saturation signals and the classes being shed, for /ready"""
+        pressure = self.pressure()
+        return {
+            "ready": pressure < SHED_AT["read"],
+            "pressure": round(pressure, 3),
+            "in_flight": self.in_flight,
+            "event_loop_lag_ms": round(self.loop_lag * 1000, 1),
+            "pool_wait_ms": round(self.pool_wait() * 1000, 1),
+            "shedding": [name for name, level in SHED_AT.items() if pressure >= level],
+        }
+
+
+admission = AdmissionController()
+
+ADMISSION_PRESSURE.set_function(admission.pressure)
+EVENT_LOOP_LAG.set_function(lambda: admission.loop_lag)
+HTTP_REQUESTS_IN_FLIGHT.set_function(lambda: admission.in_flight)
+
+
+async def _classify(scope: dict, receive: Callable) -> Tuple[Callable, str]:
+    """
+    The request's class, and a receive callable for the app; a GraphQL POST
+    body is read to classify it and then replayed
+    """
+    if scope["method"] in ("GET", "HEAD"):
+        return receive, "read"
+    if scope["path"] != f"{settings.API_V1_STR}{settings.GRAPHQL_PATH}":
+        return receive, "write"
+
+    messages = []
+    body = b""
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    replay = iter(messages)
+
+    async def replay_receive() -> dict:
+        return next(replay, None) or await receive()
+
+    if AI_FIELDS.search(body):
+        return replay_receive, "ai"
+    return replay_receive, "write" if MUTATION.search(body) else "read"
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting or shedding each request by its class and the
+    current saturation
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if (
+            scope["type"] not in ("http", "websocket")
+            or not settings.ADMISSION_CONTROL
+            or scope["path"] in EXEMPT_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        pressure = admission.pressure()
+        if scope["type"] == "websocket":
+            # Subscriptions stream AI suggestions; refuse new ones first.
+            # Open ones are long-lived, so they do not count as in flight.
+            if pressure >= SHED_AT["ai"]:
+                REQUESTS_SHED.labels("ai").inc()
+                await receive()
+                await send({"type": "websocket.close", "code": 1013})
+                return
+            await self.app(scope, receive, send)
+            return
+
+        if pressure >= SHED_AT["ai"]:
+            receive, request_class = await _classify(scope, receive)
+            if pressure >= SHED_AT[request_class]:
+                REQUESTS_SHED.labels(request_class).inc()
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": 503,
+                        "headers": [
+                            (b"content-type", b"application/json"),
+                            (
+                                b"retry-after",
+                                str(settings.ADMISSION_RETRY_AFTER_SECONDS).encode(),
+                            ),
+                        ],
+                    }
+                )
+                await send({"type": "http.response.body", "body": SHED_BODY})
+                return
+
+        admission.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.in_flight -= 1
@@ -1,18 +1,19 @@
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Literal, Optional, Union
 
 from pydantic import PostgresDsn, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from dotenv import load_dotenv
+
 load_dotenv()
 
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "Todo AI"
     API_V1_STR: str = "/api/v1"
-    
+
     # CORS Configuration
     BACKEND_CORS_ORIGINS: List[str] = ["http://localhost:3000", "http://localhost:8000"]
-    
+
     @field_validator("BACKEND_CORS_ORIGINS", mode="before")
     def assemble_cors_origins(cls, v: Union[str, List[str]]) -> Union[List[str], str]:
         if isinstance(v, str) and not v.startswith("["):
@@ -32,7 +33,7 @@ class Settings(BaseSettings):
     def assemble_db_connection(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
         if isinstance(v, str):
             return v
-        
+
         return PostgresDsn.build(
             scheme="postgresql+asyncpg",
             username=values.data.get("POSTGRES_USER"),
@@ -40,21 +41,120 @@ class Settings(BaseSettings):
             host=values.data.get("POSTGRES_SERVER"),
             path=f"{values.data.get('POSTGRES_DB') or ''}",
         )
-    
+
     # Fallback to SQLite for local development
     USE_SQLITE: bool = False
     SQLITE_DB_FILE: str = "app.db"
-    
+
+    # Hash sharding by user (see app.db.sharding): shard names and their
+    # database URLs as a JSON object; empty for the one database above.
+    # The shard map file pins users to shards and marks users being moved;
+    # processes reload it when it changes, checking at most this often.
+    DATABASE_SHARDS: Dict[str, str] = {}
+    SHARD_MAP_FILE: str = "shard_map.json"
+    SHARD_MAP_RELOAD_SECONDS: float = 1.0
+
     # OpenAI configuration
     OPENAI_API_KEY: str
     OPENAI_MODEL: str = "gpt-3.5-turbo"
     OPENAI_TIMEOUT: int = 60
+    # Point the OpenAI client at a compatible endpoint, e.g. a local fake
+    OPENAI_BASE_URL: Optional[str] = None
+    # The OpenAI SDK is imported on first use; preload it in the background
+    # after startup so the first suggestion does not pay for it
+    OPENAI_PRELOAD: bool = True
+
+    # LLM resilience: hedge after this many ms without a response (0 disables);
+    # an attempt failing with a timeout, connection error or 5xx is retried once
+    LLM_HEDGE_DELAY_MS: int = 0
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    LLM_CIRCUIT_RESET_SECONDS: float = 30.0
+
+    # Prompt context for AI suggestions
+    PROMPT_CONTEXT_TOKEN_BUDGET: int = 300
+    PROMPT_CONTEXT_MAX_TODOS: int = 5
+    PROMPT_CONTEXT_CANDIDATES: int = 50
+    PROMPT_DESCRIPTION_MAX_TOKENS: int = 40
+    PROMPT_WEIGHT_RECENCY: float = 1.0
+    PROMPT_WEIGHT_PENDING: float = 1.0
+    PROMPT_WEIGHT_PRIORITY: float = 0.5
+
+    # Background AI suggestion jobs
+    SUGGESTION_WORKERS: int = 4
+    SUGGESTION_QUEUE_SIZE: int = 100
+    SUGGESTION_JOB_TTL_SECONDS: int = 600
+
+    # Where suggestions come from: the LLM (with the local engine as fallback
+    # while the circuit is open), the local engine only, or the local engine
+    # first with the LLM refining suggestions it is not confident about
+    SUGGESTION_ROUTING: Literal["llm", "local", "local_first"] = "llm"
+    LOCAL_SUGGESTION_HISTORY: int = 100
+    LOCAL_SUGGESTION_MIN_CONFIDENCE: float = 0.8
+
+    # Related todos: local embedder and the in-memory per-user vector indexes
+    EMBEDDER: str = "hashing"
+    EMBEDDING_DIMENSION: int = 128
+    VECTOR_INDEX_MAX_USERS: int = 100
+    # Reload a user's index after this long, to pick up other workers' writes
+    VECTOR_INDEX_TTL_SECONDS: int = 300
+    RELATED_TODOS_MIN_SCORE: float = 0.1
+
+    # Manual ordering: rebalance a user's rank keys once one grows this long
+    TODO_RANK_REBALANCE_LENGTH: int = 32
+
+    # Due date reminders (see app.services.reminders): sent this long before a
+    # pending todo is due, for the todos due within the look-ahead window,
+    # which is reloaded every REMINDER_REFRESH_SECONDS (keep it shorter than
+    # the window)
+    REMINDERS_ENABLED: bool = True
+    REMINDER_LEAD_MINUTES: int = 15
+    REMINDER_WINDOW_MINUTES: int = 60
+    REMINDER_REFRESH_SECONDS: int = 300
+
+    # Archival of completed todos into archived_todos
+    ARCHIVE_AFTER_DAYS: int = 30
+    ARCHIVE_BATCH_SIZE: int = 500
+    # Run the archival job in the app every N seconds (0 disables it)
+    ARCHIVE_INTERVAL_SECONDS: int = 0
 
     # GraphQL configuration
     GRAPHQL_PATH: str = "/graphql"
     GRAPHQL_SUBSCRIPTION_PATH: str = "/graphql/ws"
+    # Parsed and validated GraphQL documents kept per process
+    GRAPHQL_DOCUMENT_CACHE_SIZE: int = 256
+
+    # Per-request profiling (see app.core.profiling): requests with an
+    # X-Profile header signed with the secret, plus a random fraction of all
+    PROFILE_SECRET: Optional[str] = None
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_DIR: str = "profiles"
+    PROFILE_INTERVAL_MS: float = 1.0
+    # Warn about statements slower than this, and about a resolver running
+    # the same statement this many times in one operation (N+1 queries)
+    SLOW_QUERY_MS: float = 100.0
+    REPEATED_QUERY_THRESHOLD: int = 10
+
+    # Admission control (see app.core.admission): shed AI suggestions, then
+    # writes, then reads with 503 as requests in flight, event loop lag or
+    # connection pool waits approach these limits
+    ADMISSION_CONTROL: bool = True
+    ADMISSION_MAX_IN_FLIGHT: int = 50
+    ADMISSION_LOOP_LAG_MS: float = 200.0
+    ADMISSION_POOL_WAIT_MS: float = 200.0
+    ADMISSION_RETRY_AFTER_SECONDS: int = 1
+
+    # Production server (python -m app.server): worker processes (0 for one
+    # per available CPU), and how long shutdown waits for subscriptions to
+    # drain and then for requests to finish
+    SERVER_WORKERS: int = 0
+    SERVER_GRACEFUL_TIMEOUT_SECONDS: int = 30
+    # Run the periodic jobs (archival, loading the reminder window, pruning
+    # suggestion jobs) in this process; app.server leaves them to its first worker
+    PERIODIC_JOBS: bool = True
 
-    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", case_sensitive=True)
+    model_config = SettingsConfigDict(
+        env_file=".env", env_file_encoding="utf-8", case_sensitive=True
+    )
 
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
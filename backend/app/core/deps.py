@@ -3,14 +3,26 @@ from typing import AsyncGenerator, Optional
 from fastapi import Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.session import SessionLocal
+from app.db.sharding import shards
 
 
-async def get_db() -> AsyncGenerator[AsyncSession, None]:
+# For possible future authentication
+async def get_current_user():
     """
-    Dependency for getting async SQLAlchemy session
+    Stub for future authentication implementation
+    Currently returns a default user
     """
-    session = SessionLocal()
+    # This is a placeholder for future authentication
+    return {"id": 1, "username": "default_user"}
+
+
+async def get_db(
+    user: dict = Depends(get_current_user),
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency for getting async SQLAlchemy session on the user's shard
+    """
+    session = shards.session(user["id"])
     try:
         yield session
     finally:
@@ -19,12 +31,14 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
 
 class DatabaseDependency:
     """Class-based dependency that can be used in GraphQL resolvers"""
-    
+
     def __init__(self):
         self.db: Optional[AsyncSession] = None
-    
-    async def __call__(self) -> AsyncGenerator[AsyncSession, None]:
-        session = SessionLocal()
+
+    async def __call__(
+        self, user: dict = Depends(get_current_user)
+    ) -> AsyncGenerator[AsyncSession, None]:
+        session = shards.session(user["id"])
         self.db = session
         try:
             yield self.db
@@ -37,16 +51,6 @@ class DatabaseDependency:
 db_dependency = DatabaseDependency()
 
 
-# For possible future authentication
-async def get_current_user():
-    """
-    Stub for future authentication implementation
-    Currently returns a default user
-    """
-    # This is a placeholder for future authentication
-    return {"id": 1, "username": "default_user"}
-
-
 # Health check dependency
 async def check_health() -> bool:
     """
@@ -54,4 +58,4 @@ async def check_health() -> bool:
     """
     # We could add more comprehensive health checks here
     # For example, checking database connectivity
-    return True
\ No newline at end of file
+    return True
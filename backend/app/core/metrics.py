@@ -0,0 +1,307 @@
+"""
+In-process metrics, exposed in the Prometheus text format at /metrics.
+
+Updates are plain attribute and list arithmetic with no locking: the app
+runs on a single event loop thread. Labeled metrics keep one series per
+label values, created on first use.
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, Generic, List, Optional, Sequence, Tuple, TypeVar
+
+# Every metric created, in creation order, for rendering
+REGISTRY: List["Metric"] = []
+
+# Latency buckets in seconds for requests, resolvers and LLM calls
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+# Finer latency buckets in seconds for single queries and pool checkouts
+DB_BUCKETS = [
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    1,
+]
+
+SeriesT = TypeVar("SeriesT")
+
+
+class Metric(Generic[SeriesT]):
+    """A named metric with one series per combination of label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names: Tuple[str, ...] = tuple(labels)
+        self.series: Dict[Tuple[str, ...], SeriesT] = {}
+        REGISTRY.append(self)
+
+    def _new_series(self) -> SeriesT:
+        raise NotImplementedError
+
+    def labels(self, *values: str) -> SeriesT:
+        """The series for label values, in the order the labels were declared"""
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = self._new_series()
+        return series
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """(suffix, labels, value) of every sample, for rendering"""
+        raise NotImplementedError
+
+
+class CounterSeries:
+    """A monotonically increasing value"""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(Metric[CounterSeries]):
+    """Counts events, e.g. errors"""
+
+    kind = "counter"
+
+    def _new_series(self) -> CounterSeries:
+        return CounterSeries()
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increment the unlabeled series"""
+        self.labels().inc(amount)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        return [
+            ("", dict(zip(self.label_names, values)), series.value)
+            for values, series in self.series.items()
+        ]
+
+
+class Gauge(Metric[None]):
+    """
+    A value read when metrics are rendered, so it costs nothing to keep up
+    to date. The function is set by the module that owns the value.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        function: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, description)
+        self.function = function
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.function = function
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        return [("", {}, float(self.function()))] if self.function else []
+
+
+class HistogramSeries:
+    """Counts of observations per bucket, plus their sum and count"""
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        # One slot per bound plus the +Inf overflow bucket
+        self.counts: List[int] = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Record a single observation: a binary search and three additions"""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        """Cumulative bucket counts keyed by upper bound, plus sum and count"""
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.bounds + [float("inf")], self.counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+class Histogram(Metric[HistogramSeries]):
+    """Histogram over fixed bucket upper bounds"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: Sequence[float],
+        labels: Sequence[str] = (),
+    ):
+        super().__init__(name, description, labels)
+        self.bounds: List[float] = sorted(buckets)
+
+    def _new_series(self) -> HistogramSeries:
+        return HistogramSeries(self.bounds)
+
+    def observe(self, value: float) -> None:
+        """Record an observation in the unlabeled series"""
+        self.labels().observe(value)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Snapshot of the unlabeled series"""
+        return self.labels().snapshot()
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples = []
+        for values, series in self.series.items():
+            labels = dict(zip(self.label_names, values))
+            for bound, count in series.snapshot()["buckets"].items():
+                samples.append(
+                    ("_bucket", dict(labels, le=_format_value(bound)), count)
+                )
+            samples.append(("_sum", labels, series.sum))
+            samples.append(("_count", labels, series.count))
+        return samples
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else f"{int(value)}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        samples = metric.samples()
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric.name} {_escape(metric.description)}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in samples:
+            label_text = ",".join(
+                f'{key}="{_escape(str(val))}"' for key, val in labels.items()
+            )
+            name = (
+                f"{metric.name}{suffix}{{{label_text}}}"
+                if label_text
+                else f"{metric.name}{suffix}"
+            )
+            lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# GraphQL
+GRAPHQL_REQUEST_DURATION = Histogram(
+    "graphql_request_duration_seconds",
+    "Time to parse, validate and execute a GraphQL operation",
+    LATENCY_BUCKETS,
+    labels=["type"],
+)
+GRAPHQL_REQUEST_ERRORS = Counter(
+    "graphql_request_errors_total",
+    "GraphQL operations whose result had errors",
+    labels=["type"],
+)
+GRAPHQL_RESOLVER_DURATION = Histogram(
+    "graphql_resolver_duration_seconds",
+    "Time spent in root query and mutation resolvers",
+    LATENCY_BUCKETS,
+    labels=["field"],
+)
+
+# Database
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Time to execute a SQL statement, by its leading keyword",
+    DB_BUCKETS,
+    labels=["operation"],
+)
+DB_QUERY_ERRORS = Counter(
+    "db_query_errors_total",
+    "SQL statements that raised an error, by their leading keyword",
+    labels=["operation"],
+)
+DB_POOL_CHECKOUT_DURATION = Histogram(
+    "db_pool_checkout_seconds",
+    "Time to get a connection from the pool, including waiting and connecting",
+    DB_BUCKETS,
+)
+DB_POOL_SIZE = Gauge("db_pool_size", "Connections the pool keeps open")
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently in use")
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections open beyond the pool size")
+
+# LLM
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds",
+    "Time to get a todo suggestion from the LLM, by outcome (OK or an error code)",
+    LATENCY_BUCKETS,
+    labels=["outcome"],
+)
+# Tokens in whole suggestion prompts, of which the todo context is at most
+# PROMPT_CONTEXT_TOKEN_BUDGET
+PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens",
+    "Tokens in a suggestion prompt, system and user messages together",
+    buckets=[100, 200, 250, 300, 350, 400, 500, 600, 800, 1200, 1600],
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens billed by the LLM API, by type (prompt or completion)",
+    labels=["type"],
+)
+
+# Background suggestion jobs
+SUGGESTION_QUEUE_DEPTH = Gauge(
+    "suggestion_queue_depth",
+    "Suggestion jobs waiting for a worker, across processes, as last counted",
+)
+
+# Pub/sub
+PUBSUB_CHANNELS = Gauge("pubsub_channels", "Open pub/sub channels")
+PUBSUB_SUBSCRIBERS = Gauge(
+    "pubsub_subscribers", "Active pub/sub subscriptions across channels"
+)
+
+# Due date reminders
+REMINDERS_SCHEDULED = Gauge(
+    "reminders_scheduled", "Reminders scheduled within the look-ahead window"
+)
+REMINDERS_SENT = Counter(
+    "reminders_sent_total", "Due date reminders published to subscribers"
+)
+
+# Admission control
+ADMISSION_PRESSURE = Gauge(
+    "admission_pressure",
+    "Saturation as a fraction of the admission limits; reads are shed at 1",
+)
+EVENT_LOOP_LAG = Gauge(
+    "event_loop_lag_seconds", "Moving average of how late the event loop runs timers"
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Admitted HTTP requests not yet finished"
+)
+REQUESTS_SHED = Counter(
+    "http_requests_shed_total",
+    "Requests rejected with 503 by admission control, by class (ai, write or read)",
+    labels=["class"],
+)
@@ -0,0 +1,321 @@
+"""
+Opt-in profiling of single requests, and checks on the SQL they run.
+
+A request is profiled when it carries an X-Profile header signed with
+PROFILE_SECRET, or when it is picked at PROFILE_SAMPLE_RATE. While it runs,
+a SIGPROF timer samples the event loop's stack every PROFILE_INTERVAL_MS of
+CPU time, keeping only the samples taken while the request's own code was
+running, and every SQL statement it executes is recorded with its duration
+and the root resolver that issued it. The samples are written to
+PROFILE_DIR as folded stacks, the input format of flamegraph.pl and
+speedscope, with the statements in a JSON file next to them.
+
+The statements of every GraphQL operation, profiled or not, are checked
+when it completes: a statement slower than SLOW_QUERY_MS, or a resolver
+running the same statement shape REPEATED_QUERY_THRESHOLD times (an N+1),
+logs a warning naming the resolver.
+
+Print a header for a signed request with:
+
+    curl -H "$(python -m app.core.profiling)" ...
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import signal
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from types import CodeType
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+PROFILE_HEADER = "X-Profile"
+# Signed headers are accepted for this long after they were signed
+SIGNATURE_MAX_AGE_SECONDS = 300
+STDLIB_DIR = os.path.dirname(os.__file__).replace("\\", "/") + "/"
+
+# (resolver, statement, seconds) of each executed statement
+QueryLog = List[Tuple[Optional[str], str, float]]
+
+# Statements executed in the current operation or profiled request, if recorded
+query_log: ContextVar[Optional[QueryLog]] = ContextVar("query_log", default=None)
+# Root resolver currently running, set by the resolver timers
+current_resolver: ContextVar[Optional[str]] = ContextVar(
+    "current_resolver", default=None
+)
+
+
+@dataclass
+class RequestProfile:
+    """Stack samples and SQL statements of one profiled request"""
+
+    method: str
+    path: str
+    reason: str
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    operation: Optional[str] = None
+    duration: float = 0.0
+    # Folded stack (root first, frames joined by ";") -> samples
+    samples: Counter = field(default_factory=Counter)
+    queries: QueryLog = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar(
+    "current_profile", default=None
+)
+
+
+def sign_profile_request(secret: str, timestamp: Optional[int] = None) -> str:
+    """X-Profile header value: a timestamp and its HMAC-SHA256 under the secret"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(
+        secret.encode(), str(timestamp).encode(), hashlib.sha256
+    ).hexdigest()
+    return f"{timestamp}:{digest}"
+
+
+def _valid_signature(value: str) -> bool:
+    timestamp, _, digest = value.partition(":")
+    if not settings.PROFILE_SECRET or not timestamp.isdigit():
+        return False
+    if abs(time.time() - int(timestamp)) > SIGNATURE_MAX_AGE_SECONDS:
+        return False
+    expected = sign_profile_request(settings.PROFILE_SECRET, int(timestamp)).partition(
+        ":"
+    )[2]
+    return hmac.compare_digest(expected, digest)
+
+
+def profile_reason(header: Optional[str]) -> Optional[str]:
+    """Why a request should be profiled ("signed" or "sampled"), or None"""
+    if header is not None and _valid_signature(header):
+        return "signed"
+    if (
+        settings.PROFILE_SAMPLE_RATE > 0
+        and random.random() < settings.PROFILE_SAMPLE_RATE
+    ):
+        return "sampled"
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _frame_label(code: CodeType) -> str:
+    """Function name and location of a code object, as a flamegraph frame"""
+    name = getattr(code, "co_qualname", code.co_name)
+    path = code.co_filename.replace("\\", "/")
+    # Shorten to the module path, e.g. sqlalchemy/orm/session.py
+    for prefix in ("/site-packages/", "/backend/", STDLIB_DIR):
+        if prefix in path:
+            path = path.rsplit(prefix, 1)[1]
+            break
+    return f"{name} ({path}:{code.co_firstlineno})".replace(";", ",")
+
+
+class StackSampler:
+    """
+    A SIGPROF interval timer, running while any profiled request is in
+    flight. The handler runs on the main thread in the context of whatever
+    code was interrupted, so a sample belongs to the request whose
+    current_profile it sees; samples of other requests and of the idle loop
+    are dropped.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.installed = False
+
+    @property
+    def available(self) -> bool:
+        """Signals are delivered to the main thread only, where uvicorn runs the loop"""
+        return (
+            hasattr(signal, "setitimer")
+            and threading.current_thread() is threading.main_thread()
+        )
+
+    def start(self) -> bool:
+        """Start sampling for one more request; False if sampling is unavailable here"""
+        if not self.available:
+            return False
+        if not self.installed:
+            # Left installed: it ignores signals outside profiled requests
+            signal.signal(signal.SIGPROF, self._sample)
+            self.installed = True
+        if self.active == 0:
+            interval = settings.PROFILE_INTERVAL_MS / 1000
+            signal.setitimer(signal.ITIMER_PROF, interval, interval)
+        self.active += 1
+        return True
+
+    def stop(self) -> None:
+        self.active -= 1
+        if self.active == 0:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+
+    @staticmethod
+    def _sample(signum: int, frame: Any) -> None:
+        profile = current_profile.get()
+        if profile is None:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        profile.samples[";".join(reversed(stack))] += 1
+
+
+sampler = StackSampler()
+
+
+@lru_cache(maxsize=1024)
+def statement_shape(statement: str) -> str:
+    """
+    A statement with its placeholders, IN lists and numbers collapsed, for
+    spotting repeats
+    """
+    shape = re.sub(r"\$\d+(::\w+)?|\b\d+(\.\d+)?\b", "?", statement)
+    shape = re.sub(r"\?(\s*,\s*\?)+", "?", shape)
+    return " ".join(shape.split())
+
+
+def _shorten(statement: str, length: int = 200) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + "..."
+
+
+def check_queries(queries: QueryLog, operation: Optional[str]) -> List[str]:
+    """
+    Log a warning for each slow statement and each statement shape a
+    resolver repeated
+    """
+
+    def where(resolver: Optional[str]) -> str:
+        return (resolver or "unknown resolver") + (
+            f" (operation {operation})" if operation else ""
+        )
+
+    warnings = []
+    repeats: Dict[Tuple[Optional[str], str], int] = Counter()
+    for resolver, statement, seconds in queries:
+        if seconds * 1000 >= settings.SLOW_QUERY_MS:
+            warnings.append(
+                f"Slow query in {where(resolver)}: "
+                f"{seconds * 1000:.0f} ms: {_shorten(statement)}"
+            )
+        repeats[resolver, statement_shape(statement)] += 1
+    for (resolver, shape), count in repeats.items():
+        if count >= settings.REPEATED_QUERY_THRESHOLD:
+            warnings.append(
+                f"Repeated query in {where(resolver)}: "
+                f"ran {count} times, possible N+1: {_shorten(shape)}"
+            )
+    for warning in warnings:
+        print(f"Warning: {warning}")
+    return warnings
+
+
+def write_profile(profile: RequestProfile) -> str:
+    """
+    Write the folded stacks and the statement log; returns the path without
+    extension
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    name = (
+        re.sub(r"[^A-Za-z0-9]+", "-", profile.operation or profile.path).strip("-")
+        or "root"
+    )
+    base = os.path.join(
+        settings.PROFILE_DIR,
+        f"{profile.started_at:%Y%m%d-%H%M%S}-{name}-{random.getrandbits(32):08x}",
+    )
+    with open(f"{base}.folded", "w") as f:
+        for stack, count in profile.samples.most_common():
+            f.write(f"{stack} {count}\n")
+    with open(f"{base}.json", "w") as f:
+        json.dump(
+            {
+                "method": profile.method,
+                "path": profile.path,
+                "operation": profile.operation,
+                "reason": profile.reason,
+                "started_at": profile.started_at.isoformat(),
+                "duration_ms": round(profile.duration * 1000, 3),
+                "sample_interval_ms": settings.PROFILE_INTERVAL_MS,
+                "samples": sum(profile.samples.values()),
+                "queries": [
+                    {
+                        "resolver": resolver,
+                        "statement": statement,
+                        "duration_ms": round(seconds * 1000, 3),
+                    }
+                    for resolver, statement, seconds in profile.queries
+                ],
+                "warnings": profile.warnings,
+            },
+            f,
+            indent=2,
+        )
+    return base
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the HTTP requests picked by profile_reason.
+    Other requests pass straight through.
+    """
+
+    def __init__(self, app: Callable[..., Awaitable[None]]):
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not (
+            settings.PROFILE_SECRET or settings.PROFILE_SAMPLE_RATE > 0
+        ):
+            await self.app(scope, receive, send)
+            return
+        header = next(
+            (
+                value.decode("latin-1")
+                for key, value in scope["headers"]
+                if key == b"x-profile"
+            ),
+            None,
+        )
+        reason = profile_reason(header)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], reason)
+        profile_token = current_profile.set(profile)
+        log_token = query_log.set(profile.queries)
+        sampling = sampler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.duration = time.perf_counter() - started
+            if sampling:
+                sampler.stop()
+            query_log.reset(log_token)
+            current_profile.reset(profile_token)
+            path = await asyncio.get_running_loop().run_in_executor(
+                None, write_profile, profile
+            )
+            print(f"Profiled {profile.method} {profile.path} ({reason}): {path}.folded")
+
+
+if __name__ == "__main__":
+    if not settings.PROFILE_SECRET:
+        raise SystemExit("PROFILE_SECRET is not set")
+    print(f"{PROFILE_HEADER}: {sign_profile_request(settings.PROFILE_SECRET)}")
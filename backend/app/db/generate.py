@@ -0,0 +1,423 @@
+"""
+Synthetic users and todos for load testing.
+
+Creates N users with M todos each, with realistic spreads of status,
+priority, due dates, description lengths and timestamps. The data depends
+only on --seed and --as-of, so two runs with the same arguments produce
+the same rows (ids may differ when batches are written concurrently).
+
+Rows are generated in worker processes, a batch of users at a time, and
+written by concurrent writers: executemany on SQLite, COPY on Postgres.
+Run it against a migrated database:
+
+    python -m app.db.generate --users 10000 --todos-per-user 1000 --seed 42
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Awaitable, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, insert, select
+
+from app.core.config import settings
+from app.db.models import Todo, TodoStatus, User
+from app.db.session import engine
+from app.services.ranking import spaced_keys
+
+# Column order of generated todo rows
+TODO_COLUMNS = (
+    "user_id",
+    "title",
+    "description",
+    "status",
+    "priority",
+    "due_date",
+    "is_ai_generated",
+    "created_at",
+    "updated_at",
+    "completed_at",
+    "rank",
+)
+
+INSERT_TODO_SQL = (
+    f"INSERT INTO {Todo.__tablename__} ({', '.join(TODO_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in TODO_COLUMNS)})"
+)
+
+# Shared by all generated users; the password is "password123"
+HASHED_PASSWORD = "$2b$12$CwY2zJvXjRgRA4/g1rCmNuJbVgveTGVZ84hG3Nn4axbUXHxPFqj2u"
+
+VERBS = (
+    "Review",
+    "Draft",
+    "Update",
+    "Fix",
+    "Plan",
+    "Schedule",
+    "Call",
+    "Email",
+    "Prepare",
+    "Book",
+    "Buy",
+    "Pay",
+    "Clean",
+    "Organize",
+    "Research",
+    "Submit",
+    "Follow up on",
+    "Renew",
+)
+OBJECTS = (
+    "project proposal",
+    "pull requests",
+    "documentation",
+    "team meeting",
+    "quarterly report",
+    "budget",
+    "client feedback",
+    "release notes",
+    "dentist appointment",
+    "groceries",
+    "electricity bill",
+    "car insurance",
+    "flight tickets",
+    "birthday gift",
+    "garage",
+    "onboarding checklist",
+    "design review",
+    "invoice",
+    "tax return",
+    "roadmap",
+)
+WORDS = (
+    "the",
+    "and",
+    "for",
+    "with",
+    "before",
+    "after",
+    "next",
+    "week",
+    "team",
+    "client",
+    "check",
+    "draft",
+    "final",
+    "notes",
+    "update",
+    "review",
+    "send",
+    "details",
+    "meeting",
+    "budget",
+    "deadline",
+    "priority",
+    "follow",
+    "up",
+    "list",
+    "items",
+    "plan",
+    "confirm",
+    "schedule",
+    "changes",
+    "feedback",
+    "numbers",
+    "share",
+    "summary",
+    "agenda",
+    "call",
+)
+
+# Priorities 1-3, most todos being low priority
+PRIORITY_WEIGHTS = (55, 30, 15)
+
+
+def generate_todo_rows(
+    seed: int, as_of: datetime, users: Sequence[Tuple[int, int]], todos_per_user: int
+) -> List[tuple]:
+    """
+    Generate the todos of (user index, user id) pairs as tuples in
+    TODO_COLUMNS order. Each user's todos depend only on the seed, as_of
+    and the user's index.
+    """
+    rows = []
+    for user_index, user_id in users:
+        rng = random.Random(f"{seed}:{user_index}")
+        account_days = rng.uniform(30, 730)
+        # A few chores each user repeats, so history has recurring titles
+        chores = [f"{rng.choice(VERBS)} {rng.choice(OBJECTS)}" for _ in range(3)]
+
+        todos = []
+        for _ in range(todos_per_user):
+            # Skewed toward recent activity
+            created_at = as_of - timedelta(days=account_days * rng.random() ** 2)
+            if rng.random() < 0.1:
+                title = rng.choice(chores)
+            else:
+                title = f"{rng.choice(VERBS)} {rng.choice(OBJECTS)}"
+
+            description = None
+            if rng.random() < 0.65:
+                length = min(200, max(1, int(rng.lognormvariate(2.2, 0.8))))
+                description = " ".join(rng.choices(WORDS, k=length)).capitalize()
+
+            due_date = None
+            if rng.random() < 0.55:
+                due_date = created_at + timedelta(days=rng.lognormvariate(1.5, 1.0))
+
+            # Older todos are more likely to be done
+            age_days = (as_of - created_at).total_seconds() / 86400
+            completed_at = None
+            if rng.random() < (0.85 if age_days > 14 else 0.4):
+                completed_at = min(
+                    as_of, created_at + timedelta(hours=rng.lognormvariate(3.0, 1.5))
+                )
+            updated_at = completed_at or min(
+                as_of, created_at + timedelta(minutes=rng.expovariate(1 / 30))
+            )
+
+            todos.append(
+                (
+                    user_id,
+                    title,
+                    description,
+                    TodoStatus.COMPLETED if completed_at else TodoStatus.PENDING,
+                    rng.choices((1, 2, 3), weights=PRIORITY_WEIGHTS)[0],
+                    due_date,
+                    rng.random() < 0.08,
+                    created_at,
+                    updated_at,
+                    completed_at,
+                )
+            )
+
+        # Ranks follow the default order: priority, then newest first
+        todos.sort(key=lambda todo: (-todo[4], -todo[7].timestamp()))
+        rows += [todo + (rank,) for todo, rank in zip(todos, spaced_keys(len(todos)))]
+    return rows
+
+
+def _driver_value(value: Any, dialect: str) -> Any:
+    """A column value in the form the database driver takes directly"""
+    if isinstance(value, TodoStatus):
+        return value.name
+    if isinstance(value, datetime):
+        if dialect == "postgresql":
+            return value.replace(tzinfo=timezone.utc)
+        # SQLAlchemy's storage format for SQLite DateTime columns
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    return value
+
+
+def generate_driver_rows(
+    seed: int,
+    as_of: datetime,
+    todos_per_user: int,
+    dialect: str,
+    users: Sequence[Tuple[int, int]],
+) -> List[tuple]:
+    """
+    generate_todo_rows, with values already converted for the driver so the
+    writers skip SQLAlchemy's per-value bind processing
+    """
+    return [
+        tuple(_driver_value(value, dialect) for value in row)
+        for row in generate_todo_rows(seed, as_of, users, todos_per_user)
+    ]
+
+
+async def write_rows(rows: List[tuple]) -> None:
+    """
+    Write a batch of driver rows in one transaction: COPY on Postgres,
+    executemany otherwise
+    """
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                Todo.__tablename__, records=rows, columns=TODO_COLUMNS
+            )
+        else:
+            # A crash mid-load loses the load anyway; skip the fsyncs
+            await conn.exec_driver_sql("PRAGMA synchronous = OFF")
+            await conn.exec_driver_sql(INSERT_TODO_SQL, rows)
+
+
+async def create_users(
+    prefix: str, count: int, seed: int, as_of: datetime
+) -> List[int]:
+    """Insert the generated users; returns their ids in user index order"""
+    rng = random.Random(f"{seed}:users")
+    usernames = [f"{prefix}_{index:07d}" for index in range(count)]
+    async with engine.begin() as conn:
+        existing = (
+            await conn.execute(
+                select(func.count()).where(
+                    User.username.like(f"{prefix}\\_%", escape="\\")
+                )
+            )
+        ).scalar()
+        if existing:
+            raise SystemExit(
+                f"{existing} users named {prefix}_* already exist; "
+                "use a fresh database or another --prefix"
+            )
+        for start in range(0, count, 10_000):
+            await conn.execute(
+                insert(User.__table__),
+                [
+                    {
+                        "username": username,
+                        "email": f"{username}@example.com",
+                        "hashed_password": HASHED_PASSWORD,
+                        "created_at": as_of - timedelta(days=rng.uniform(30, 730)),
+                    }
+                    for username in usernames[start : start + 10_000]
+                ],
+            )
+        result = await conn.execute(
+            select(User.username, User.id).where(
+                User.username.like(f"{prefix}\\_%", escape="\\")
+            )
+        )
+        ids = dict(result.all())
+    return [ids[username] for username in usernames]
+
+
+def _chunks(
+    user_ids: List[int], users_per_batch: int
+) -> Iterator[List[Tuple[int, int]]]:
+    """(user index, user id) pairs, users_per_batch at a time"""
+    indexed = list(enumerate(user_ids))
+    for start in range(0, len(indexed), users_per_batch):
+        yield indexed[start : start + users_per_batch]
+
+
+async def load_todos(
+    generate: Callable[[List[Tuple[int, int]]], List[tuple]],
+    chunks: Iterator[List[Tuple[int, int]]],
+    write: Callable[[List[tuple]], Awaitable[None]],
+    workers: int,
+    concurrency: int,
+    progress: Optional[Callable[[int], None]] = None,
+) -> None:
+    """
+    Generate batches in a process pool and write them with concurrent
+    writers, keeping a bounded number of batches in memory
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+
+    async def produce(pool: ProcessPoolExecutor) -> None:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(loop.run_in_executor(pool, generate, chunk))
+            if len(pending) >= workers * 2:
+                await queue.put(await pending.popleft())
+        while pending:
+            await queue.put(await pending.popleft())
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def consume() -> None:
+        while True:
+            rows = await queue.get()
+            if rows is None:
+                return
+            await write(rows)
+            if progress:
+                progress(len(rows))
+
+    # Spawned rather than forked: the writers' driver threads must not be
+    # copied into the workers
+    with ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        await asyncio.gather(produce(pool), *(consume() for _ in range(concurrency)))
+
+
+async def generate(args: argparse.Namespace) -> None:
+    """Create the users, then their todos"""
+    if settings.DATABASE_SHARDS:
+        # User IDs come from one database's sequence, and rows go to that database
+        raise SystemExit(
+            "app.db.generate writes to one database; unset DATABASE_SHARDS"
+        )
+    as_of = args.as_of or datetime.utcnow().replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    # SQLite allows one writer at a time
+    concurrency = 1 if engine.dialect.name == "sqlite" else args.concurrency
+
+    started = time.perf_counter()
+    user_ids = await create_users(args.prefix, args.users, args.seed, as_of)
+    print(f"Created {len(user_ids)} users in {time.perf_counter() - started:.1f}s")
+
+    total = args.users * args.todos_per_user
+    written = 0
+    reported = 0
+
+    def progress(rows: int) -> None:
+        nonlocal written, reported
+        written += rows
+        if written - reported >= total / 10 or written == total:
+            reported = written
+            elapsed = time.perf_counter() - started
+            print(f"  {written:,}/{total:,} todos, {written / elapsed:,.0f} rows/s")
+
+    await load_todos(
+        partial(
+            generate_driver_rows,
+            args.seed,
+            as_of,
+            args.todos_per_user,
+            engine.dialect.name,
+        ),
+        _chunks(user_ids, max(1, args.batch_size // max(1, args.todos_per_user))),
+        write_rows,
+        workers=args.workers,
+        concurrency=concurrency,
+        progress=progress,
+    )
+    await engine.dispose()
+    print(f"Generated {total:,} todos in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic users and todos for load testing"
+    )
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--todos-per-user", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--as-of",
+        type=datetime.fromisoformat,
+        default=None,
+        help=(
+            "Timestamps are generated relative to this UTC time "
+            "(default: today at midnight)"
+        ),
+    )
+    parser.add_argument(
+        "--prefix", default="loadtest", help="Username prefix of generated users"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=10_000, help="Todos per batch and transaction"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Generator processes"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="Concurrent writers (1 on SQLite)"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(generate(args))
@@ -0,0 +1,351 @@
+"""
+Versioned schema migrations, recorded in the schema_version table.
+
+Migrations are applied once per deployment by a dedicated command, before
+any app process starts:
+
+    python -m app.db.migrations [--seed]
+
+App startup only checks the recorded version. An empty database is
+created from the current models and stamped with the latest version; an
+existing one gets each newer migration, in order, in one transaction.
+With DATABASE_SHARDS, every shard is migrated, one after the other.
+"""
+import argparse
+import asyncio
+from dataclasses import dataclass
+from itertools import groupby
+from typing import Callable, List, Optional
+
+from sqlalchemy import (
+    Connection,
+    MetaData,
+    String,
+    bindparam,
+    func,
+    inspect,
+    insert,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.exc import DBAPIError
+
+from app.db.models import (
+    ArchivedTodo,
+    SuggestionJobRecord,
+    Tag,
+    Todo,
+    TodoEmbedding,
+    User,
+    schema_version,
+    todo_tags,
+)
+from app.db.session import Base
+from app.db.sharding import shards
+from app.services.ranking import key_between, spaced_keys
+
+# Key for the Postgres advisory lock that serializes concurrent migration runs
+MIGRATION_LOCK_KEY = 7_215_001
+
+
+class SchemaVersionError(RuntimeError):
+    """The database schema is older than the code expects"""
+
+
+@dataclass
+class Migration:
+    """A schema change; apply runs inside the migration transaction"""
+
+    version: int
+    name: str
+    apply: Optional[Callable[[Connection], None]] = None
+
+
+def _add_tags_ordering_archive_and_embeddings(conn: Connection) -> None:
+    """
+    Bring a database created by the initial schema up to date: new tables,
+    the todos.rank column with ranks in the default priority order, and the
+    indexes added since
+    """
+    Base.metadata.create_all(
+        conn,
+        tables=[
+            Tag.__table__,
+            todo_tags,
+            ArchivedTodo.__table__,
+            TodoEmbedding.__table__,
+        ],
+    )
+
+    todos = Todo.__table__
+    columns = {column["name"] for column in inspect(conn).get_columns("todos")}
+    if "rank" not in columns:
+        # Added as nullable: SQLite cannot add a NOT NULL column without a
+        # default. Migration 6 makes it NOT NULL.
+        conn.execute(
+            text(
+                "ALTER TABLE todos ADD COLUMN "
+                f"{conn.dialect.identifier_preparer.quote('rank')} "
+                f"{String(255).compile(dialect=conn.dialect)}"
+            )
+        )
+        rows = conn.execute(
+            select(todos.c.id, todos.c.user_id).order_by(
+                todos.c.user_id,
+                todos.c.priority.desc(),
+                todos.c.created_at.desc(),
+                todos.c.id,
+            )
+        ).all()
+        ranks = []
+        for _, user_rows in groupby(rows, key=lambda row: row.user_id):
+            ids = [row.id for row in user_rows]
+            ranks += [
+                {"todo_id": todo_id, "rank": rank}
+                for todo_id, rank in zip(ids, spaced_keys(len(ids)))
+            ]
+        if ranks:
+            conn.execute(
+                update(todos)
+                .where(todos.c.id == bindparam("todo_id"))
+                .values(rank=bindparam("rank")),
+                ranks,
+            )
+
+    for index in list(todos.indexes) + list(todo_tags.indexes):
+        index.create(conn, checkfirst=True)
+
+
+def _add_due_date_index(conn: Connection) -> None:
+    """Index todos by status and due date, for the reminder scheduler"""
+    for index in Todo.__table__.indexes:
+        if index.name == "ix_todos_status_due_date":
+            index.create(conn, checkfirst=True)
+
+
+def _add_suggestion_jobs(conn: Connection) -> None:
+    """Store suggestion jobs in the database, for every app process to see"""
+    SuggestionJobRecord.__table__.create(conn, checkfirst=True)
+
+
+def _make_ranks_unique(conn: Connection) -> None:
+    """
+    Make rank keys unique per user: re-key the todos of users with
+    duplicate keys, keeping their order, then replace the rank index with a
+    unique one
+    """
+    todos = Todo.__table__
+    duplicated = (
+        conn.execute(
+            select(todos.c.user_id)
+            .group_by(todos.c.user_id, todos.c.rank)
+            .having(func.count() > 1)
+            .distinct()
+        )
+        .scalars()
+        .all()
+    )
+    for user_id in duplicated:
+        ids = (
+            conn.execute(
+                select(todos.c.id)
+                .filter(todos.c.user_id == user_id)
+                .order_by(todos.c.rank, todos.c.id)
+            )
+            .scalars()
+            .all()
+        )
+        conn.execute(
+            update(todos)
+            .where(todos.c.id == bindparam("todo_id"))
+            .values(rank=bindparam("rank")),
+            [
+                {"todo_id": todo_id, "rank": rank}
+                for todo_id, rank in zip(ids, spaced_keys(len(ids)))
+            ],
+        )
+
+    conn.execute(text("DROP INDEX IF EXISTS ix_todos_user_id_rank"))
+    for index in todos.indexes:
+        if index.name == "ix_todos_user_id_rank":
+            index.create(conn)
+
+
+def _make_rank_not_null(conn: Connection) -> None:
+    """
+    Make todos.rank NOT NULL, as in the models. Postgres alters the column;
+    SQLite cannot, so the table is rebuilt from the model as the SQLite
+    documentation describes: create, copy, drop, rename, index.
+    """
+    todos = Todo.__table__
+    quote = conn.dialect.identifier_preparer.quote
+
+    # Todos left without a key go to the end of their user's order
+    unranked = conn.execute(
+        select(todos.c.id, todos.c.user_id)
+        .filter(todos.c.rank.is_(None))
+        .order_by(todos.c.user_id, todos.c.created_at, todos.c.id)
+    ).all()
+    ranks = []
+    for user_id, user_rows in groupby(unranked, key=lambda row: row.user_id):
+        last_rank = conn.execute(
+            select(func.max(todos.c.rank)).filter(todos.c.user_id == user_id)
+        ).scalar()
+        for row in user_rows:
+            last_rank = key_between(last_rank, None)
+            ranks.append({"todo_id": row.id, "rank": last_rank})
+    if ranks:
+        conn.execute(
+            update(todos)
+            .where(todos.c.id == bindparam("todo_id"))
+            .values(rank=bindparam("rank")),
+            ranks,
+        )
+
+    if conn.dialect.name != "sqlite":
+        conn.execute(
+            text(f"ALTER TABLE todos ALTER COLUMN {quote('rank')} SET NOT NULL")
+        )
+        return
+
+    # With foreign keys enforced, dropping todos would delete their tag links
+    if conn.execute(text("PRAGMA foreign_keys")).scalar():
+        raise RuntimeError("Rebuilding the todos table needs SQLite foreign keys off")
+    metadata = MetaData()
+    User.__table__.to_metadata(metadata)
+    rebuilt = todos.to_metadata(metadata, name="todos_rebuilt")
+    # Index names are per database; they are created once the table is renamed
+    rebuilt.indexes.clear()
+    rebuilt.create(conn)
+    columns = ", ".join(quote(column.name) for column in todos.columns)
+    conn.execute(
+        text(f"INSERT INTO todos_rebuilt ({columns}) SELECT {columns} FROM todos")
+    )
+    conn.execute(text("DROP TABLE todos"))
+    conn.execute(text("ALTER TABLE todos_rebuilt RENAME TO todos"))
+    for index in todos.indexes:
+        index.create(conn)
+
+
+MIGRATIONS: List[Migration] = [
+    # Stamped onto databases created before migrations were versioned
+    Migration(1, "initial schema"),
+    Migration(
+        2,
+        "tags, manual ordering, archive and embeddings",
+        _add_tags_ordering_archive_and_embeddings,
+    ),
+    Migration(3, "due date index", _add_due_date_index),
+    Migration(4, "suggestion jobs", _add_suggestion_jobs),
+    Migration(5, "unique rank keys", _make_ranks_unique),
+    Migration(6, "todos.rank not null", _make_rank_not_null),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def _record(conn: Connection, migrations: List[Migration]) -> None:
+    """Record migrations as applied"""
+    conn.execute(
+        insert(schema_version),
+        [
+            {"version": migration.version, "name": migration.name}
+            for migration in migrations
+        ],
+    )
+
+
+def _migrate(conn: Connection) -> int:
+    """Apply pending migrations on a connection in a transaction"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY}
+        )
+
+    inspector = inspect(conn)
+    if not inspector.has_table("todos"):
+        print("Creating schema from the models")
+        Base.metadata.create_all(conn)
+        _record(conn, MIGRATIONS)
+        return SCHEMA_VERSION
+
+    if not inspector.has_table("schema_version"):
+        schema_version.create(conn)
+        _record(conn, MIGRATIONS[:1])
+
+    current = conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        print(f"Applying migration {migration.version}: {migration.name}")
+        if migration.apply:
+            migration.apply(conn)
+        _record(conn, [migration])
+    return SCHEMA_VERSION
+
+
+async def migrate() -> int:
+    """Bring the schema of every shard up to date; returns the new version"""
+    for name, shard_engine in shards.engines.items():
+        if shards.sharded:
+            print(f"Migrating shard {name}")
+        async with shard_engine.begin() as conn:
+            version = await conn.run_sync(_migrate)
+    return version
+
+
+async def get_schema_version() -> Optional[int]:
+    """
+    The lowest schema version recorded across the shards, or None if one
+    was never migrated
+    """
+    versions = []
+    for shard_engine in shards.engines.values():
+        async with shard_engine.connect() as conn:
+            try:
+                versions.append(
+                    (
+                        await conn.execute(select(func.max(schema_version.c.version)))
+                    ).scalar()
+                )
+            except DBAPIError:
+                return None
+    return None if None in versions else min(versions)
+
+
+async def check_schema_version() -> None:
+    """Fail fast if the database has not been migrated to this code's version"""
+    version = await get_schema_version()
+    if version is None or version < SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"Database schema is at version {version}, expected {SCHEMA_VERSION}. "
+            "Run `python -m app.db.migrations` first."
+        )
+
+
+async def main(seed: bool) -> None:
+    """Migrate, then optionally seed, on one event loop"""
+    version = await migrate()
+    print(f"Database schema is at version {version}.")
+    if seed:
+        from app.db.seed import seed_database
+
+        await seed_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    parser.add_argument(
+        "--seed", action="store_true", help="Also add the demo user and sample todos"
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="Only check that the schema is up to date"
+    )
+    args = parser.parse_args()
+
+    if args.check:
+        asyncio.run(check_schema_version())
+        print(f"Database schema is up to date (version {SCHEMA_VERSION}).")
+    else:
+        asyncio.run(main(args.seed))
@@ -2,21 +2,37 @@ from datetime import datetime
 from enum import Enum as PyEnum
 from typing import Optional
 
-from sqlalchemy import Boolean, Column, DateTime, Enum, ForeignKey, Integer, String, Text
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    JSON,
+    LargeBinary,
+    String,
+    Table,
+    Text,
+    UniqueConstraint,
+)
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 
 from app.db.session import Base
 
 
 class TodoStatus(str, PyEnum):
     """Todo status enumeration"""
+
     PENDING = "PENDING"
     COMPLETED = "COMPLETED"
 
 
 class User(Base):
     """User model for future authentication"""
+
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -25,14 +41,64 @@ class User(Base):
     hashed_password = Column(String(255), nullable=False)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    updated_at = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
 
     todos = relationship("Todo", back_populates="user", cascade="all, delete-orphan")
 
 
+# Association table between todos and tags. The composite primary key serves
+# todo -> tags lookups; the reverse index serves tag -> todos filtering.
+todo_tags = Table(
+    "todo_tags",
+    Base.metadata,
+    Column(
+        "todo_id", Integer, ForeignKey("todos.id", ondelete="CASCADE"), primary_key=True
+    ),
+    Column(
+        "tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True
+    ),
+    Index("ix_todo_tags_tag_id_todo_id", "tag_id", "todo_id"),
+)
+
+
+# Applied schema migrations, see app.db.migrations
+schema_version = Table(
+    "schema_version",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+class Tag(Base):
+    """Tag model for categorizing todos"""
+
+    __tablename__ = "tags"
+    __table_args__ = (UniqueConstraint("user_id", "name", name="uq_tags_user_id_name"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    name = Column(String(50), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    todos = relationship("Todo", secondary=todo_tags, back_populates="tags")
+
+
 class Todo(Base):
     """Todo model for storing task items"""
+
     __tablename__ = "todos"
+    __table_args__ = (
+        # Unique, so that concurrent writes cannot give two todos the same key
+        Index("ix_todos_user_id_rank", "user_id", "rank", unique=True),
+        Index("ix_todos_status_completed_at", "status", "completed_at"),
+        Index("ix_todos_user_id_created_at", "user_id", "created_at"),
+        # Range scans of pending todos by due date, for reminders
+        Index("ix_todos_status_due_date", "status", "due_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False)
@@ -43,10 +109,22 @@ class Todo(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     is_ai_generated = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    updated_at = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
     completed_at = Column(DateTime(timezone=True), nullable=True)
+    # Lexicographic key for manual ordering, see app.services.ranking
+    rank = Column(String(255), nullable=False)
 
     user = relationship("User", back_populates="todos")
+    # Loaded with one batched IN query per result set rather than per todo
+    tags = relationship(
+        "Tag",
+        secondary=todo_tags,
+        back_populates="todos",
+        lazy="selectin",
+        order_by="Tag.name",
+    )
 
     def mark_completed(self) -> None:
         """Mark todo as completed and set completed timestamp"""
@@ -68,4 +146,74 @@ class Todo(Base):
         """Check if todo is overdue"""
         if not self.due_date:
             return False
-        return not self.is_completed and self.due_date < datetime.utcnow()
\ No newline at end of file
+        return not self.is_completed and self.due_date < datetime.utcnow()
+
+
+class ArchivedTodo(Base):
+    """Completed todo moved out of the todos table by the archival job"""
+
+    __tablename__ = "archived_todos"
+    __table_args__ = (
+        Index("ix_archived_todos_user_id_completed_at", "user_id", "completed_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    # ID the todo had in the todos table
+    todo_id = Column(Integer, nullable=False)
+    title = Column(String(255), nullable=False)
+    description = Column(Text, nullable=True)
+    priority = Column(Integer, default=1, nullable=False)
+    due_date = Column(DateTime(timezone=True), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    is_ai_generated = Column(Boolean, default=False)
+    # Tag names at archival time
+    tags = Column(JSON, nullable=False, default=list)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TodoEmbedding(Base):
+    """Embedding vector of a todo's text, see app.services.embeddings"""
+
+    __tablename__ = "todo_embeddings"
+
+    todo_id = Column(
+        Integer, ForeignKey("todos.id", ondelete="CASCADE"), primary_key=True
+    )
+    # Name of the embedder that produced the vector
+    model = Column(String(50), nullable=False)
+    # float16 array of the embedder's dimension
+    vector = Column(LargeBinary, nullable=False)
+    updated_at = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
+class SuggestionJobRecord(Base):
+    """Background suggestion job, shared by the app processes; see app.services.jobs"""
+
+    __tablename__ = "suggestion_jobs"
+    __table_args__ = (
+        # At most one queued or running job per user, whichever process queues it
+        Index(
+            "ix_suggestion_jobs_active_user_id",
+            "user_id",
+            unique=True,
+            sqlite_where=text("status IN ('QUEUED', 'RUNNING')"),
+            postgresql_where=text("status IN ('QUEUED', 'RUNNING')"),
+        ),
+        Index("ix_suggestion_jobs_status_created_at", "status", "created_at"),
+    )
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # A JobStatus value
+    status = Column(String(20), nullable=False)
+    suggestion = Column(Text, nullable=True)
+    # A SuggestionErrorCode value and message, for failed jobs
+    error_code = Column(String(50), nullable=True)
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
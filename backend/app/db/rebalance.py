@@ -0,0 +1,417 @@
+"""
+Move users' rows between shards, online, in batches.
+
+Moving a user marks them as moving in the shard map. Once every process
+has reloaded the map, the user's writes are refused while their reads
+are still served. After the writes in flight had time to finish, the
+user's rows are copied to the destination, --batch-size todos per
+transaction, and the copy is checked. Then the shard map points at the
+destination, where writes resume, and the rows left on the source are
+deleted, again in batches. Todos and tags get new IDs on the
+destination, since each database allocates its own; suggestion jobs are
+short-lived and not copied. A move that fails leaves the user where they
+were, still marked as moving; running it again starts over. Run one of
+these commands at a time.
+
+Adding a shard without sending anyone to it before their rows are there:
+
+    # 1. With the current DATABASE_SHARDS, pin the users the new ring reassigns
+    python -m app.db.rebalance pin --new-shard s2
+    # 2. Add s2 to DATABASE_SHARDS, migrate, and restart the app with it
+    # 3. Move the pinned users to the shards the ring gives them
+    python -m app.db.rebalance rebalance
+
+Or move a single user:
+
+    python -m app.db.rebalance move --user 42 --to s1
+"""
+import argparse
+import asyncio
+from collections import Counter
+from typing import Dict, List
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.core.config import settings
+from app.db.models import (
+    ArchivedTodo,
+    SuggestionJobRecord,
+    Tag,
+    Todo,
+    TodoEmbedding,
+    User,
+    todo_tags,
+)
+from app.db.sharding import HashRing, ShardMap, shards
+
+todos = Todo.__table__
+tags = Tag.__table__
+embeddings = TodoEmbedding.__table__
+archived_todos = ArchivedTodo.__table__
+suggestion_jobs = SuggestionJobRecord.__table__
+users = User.__table__
+
+
+def _without_id(row) -> dict:
+    """A row's values for an insert that allocates a new ID"""
+    values = dict(row._mapping)
+    del values["id"]
+    return values
+
+
+async def _count_rows(conn: AsyncConnection, user_id: int) -> Dict[str, int]:
+    """Rows of a user per table, to check a copy"""
+    counts = {}
+    for name, table in (
+        ("todos", todos),
+        ("tags", tags),
+        ("archived todos", archived_todos),
+    ):
+        counts[name] = (
+            await conn.execute(
+                select(func.count())
+                .select_from(table)
+                .where(table.c.user_id == user_id)
+            )
+        ).scalar()
+    return counts
+
+
+async def purge_user(target: AsyncEngine, user_id: int, batch_size: int) -> int:
+    """Delete a user's rows from a shard in batches; returns the todos deleted"""
+    deleted = 0
+    while True:
+        async with target.begin() as conn:
+            todo_ids = (
+                (
+                    await conn.execute(
+                        select(todos.c.id)
+                        .where(todos.c.user_id == user_id)
+                        .limit(batch_size)
+                    )
+                )
+                .scalars()
+                .all()
+            )
+            if not todo_ids:
+                break
+            await conn.execute(
+                delete(todo_tags).where(todo_tags.c.todo_id.in_(todo_ids))
+            )
+            await conn.execute(
+                delete(embeddings).where(embeddings.c.todo_id.in_(todo_ids))
+            )
+            await conn.execute(delete(todos).where(todos.c.id.in_(todo_ids)))
+        deleted += len(todo_ids)
+
+    while True:
+        async with target.begin() as conn:
+            archived_ids = (
+                (
+                    await conn.execute(
+                        select(archived_todos.c.id)
+                        .where(archived_todos.c.user_id == user_id)
+                        .limit(batch_size)
+                    )
+                )
+                .scalars()
+                .all()
+            )
+            if not archived_ids:
+                break
+            await conn.execute(
+                delete(archived_todos).where(archived_todos.c.id.in_(archived_ids))
+            )
+
+    async with target.begin() as conn:
+        await conn.execute(delete(tags).where(tags.c.user_id == user_id))
+        await conn.execute(
+            delete(suggestion_jobs).where(suggestion_jobs.c.user_id == user_id)
+        )
+        await conn.execute(delete(users).where(users.c.id == user_id))
+    return deleted
+
+
+async def copy_user(
+    source: AsyncEngine, target: AsyncEngine, user_id: int, batch_size: int
+) -> Counter:
+    """
+    Copy a user's rows from one shard to another, which must hold none of
+    them, a batch of todos per transaction; returns the rows copied
+    """
+    copied: Counter = Counter()
+    async with source.connect() as src, target.begin() as dst:
+        user = (await src.execute(select(users).where(users.c.id == user_id))).first()
+        if user:
+            # The user keeps their ID: it is what places them on a shard
+            await dst.execute(insert(users), [dict(user._mapping)])
+            if dst.dialect.name == "postgresql":
+                # An explicit ID does not advance the sequence; without this
+                # the destination's next new user could be given the same ID
+                await dst.execute(
+                    text(
+                        "SELECT setval('users_id_seq', "
+                        "GREATEST(:user_id, (SELECT last_value FROM users_id_seq)))"
+                    ),
+                    {"user_id": user_id},
+                )
+        tag_rows = (
+            await src.execute(
+                select(tags).where(tags.c.user_id == user_id).order_by(tags.c.id)
+            )
+        ).all()
+        tag_ids: Dict[int, int] = {}
+        if tag_rows:
+            result = await dst.execute(
+                insert(tags).returning(tags.c.id, sort_by_parameter_order=True),
+                [_without_id(row) for row in tag_rows],
+            )
+            tag_ids = dict(zip((row.id for row in tag_rows), result.scalars().all()))
+        copied["tags"] = len(tag_ids)
+
+    last_id = 0
+    while True:
+        async with source.connect() as src, target.begin() as dst:
+            rows = (
+                await src.execute(
+                    select(todos)
+                    .where(todos.c.user_id == user_id, todos.c.id > last_id)
+                    .order_by(todos.c.id)
+                    .limit(batch_size)
+                )
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            result = await dst.execute(
+                insert(todos).returning(todos.c.id, sort_by_parameter_order=True),
+                [_without_id(row) for row in rows],
+            )
+            todo_ids = dict(zip((row.id for row in rows), result.scalars().all()))
+
+            links = (
+                await src.execute(
+                    select(todo_tags).where(todo_tags.c.todo_id.in_(todo_ids))
+                )
+            ).all()
+            if links:
+                await dst.execute(
+                    insert(todo_tags),
+                    [
+                        {
+                            "todo_id": todo_ids[link.todo_id],
+                            "tag_id": tag_ids[link.tag_id],
+                        }
+                        for link in links
+                    ],
+                )
+            vectors = (
+                await src.execute(
+                    select(embeddings).where(embeddings.c.todo_id.in_(todo_ids))
+                )
+            ).all()
+            if vectors:
+                await dst.execute(
+                    insert(embeddings),
+                    [
+                        dict(vector._mapping, todo_id=todo_ids[vector.todo_id])
+                        for vector in vectors
+                    ],
+                )
+        copied["todos"] += len(rows)
+        print(f"  copied {copied['todos']:,} todos")
+
+    last_id = 0
+    while True:
+        async with source.connect() as src, target.begin() as dst:
+            rows = (
+                await src.execute(
+                    select(archived_todos)
+                    .where(
+                        archived_todos.c.user_id == user_id,
+                        archived_todos.c.id > last_id,
+                    )
+                    .order_by(archived_todos.c.id)
+                    .limit(batch_size)
+                )
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            await dst.execute(
+                insert(archived_todos), [_without_id(row) for row in rows]
+            )
+        copied["archived todos"] += len(rows)
+    return copied
+
+
+async def _wait_for_processes(grace_seconds: float) -> None:
+    """
+    Give every process time to reload the shard map and finish the writes
+    in flight
+    """
+    await asyncio.sleep(settings.SHARD_MAP_RELOAD_SECONDS + grace_seconds)
+
+
+async def move_user(
+    user_id: int, destination: str, batch_size: int, grace_seconds: float
+) -> None:
+    """Move a user's rows to a shard and point the shard map at it"""
+    if destination not in shards.engines:
+        raise SystemExit(
+            f"Unknown shard {destination}; shards are {', '.join(shards.engines)}"
+        )
+    shard_map = ShardMap.load(shards.map_file)
+    source = shard_map.users.get(user_id) or shards.ring.get(user_id)
+
+    if source != destination:
+        print(f"Moving user {user_id} from {source} to {destination}")
+        shard_map.moving[user_id] = destination
+        shard_map.save(shards.map_file)
+        await _wait_for_processes(grace_seconds)
+
+        # Leftovers of an earlier attempt
+        await purge_user(shards.engines[destination], user_id, batch_size)
+        copied = await copy_user(
+            shards.engines[source], shards.engines[destination], user_id, batch_size
+        )
+        async with shards.engines[source].connect() as src, shards.engines[
+            destination
+        ].connect() as dst:
+            expected, actual = await _count_rows(src, user_id), await _count_rows(
+                dst, user_id
+            )
+        if expected != actual:
+            raise SystemExit(
+                f"Copy of user {user_id} is incomplete: {actual} of {expected}; "
+                "run again"
+            )
+
+        # Reads and writes go to the destination from here on
+        if shards.ring.get(user_id) == destination:
+            shard_map.users.pop(user_id, None)
+        else:
+            shard_map.users[user_id] = destination
+        shard_map.save(shards.map_file)
+        await _wait_for_processes(grace_seconds)
+        print(
+            "  copied "
+            + ", ".join(f"{count:,} {name}" for name, count in copied.items())
+        )
+    elif user_id not in shard_map.moving:
+        print(f"User {user_id} is on {destination} already")
+        return
+
+    # Also finishes a move that failed after the shard map was switched
+    for name, shard_engine in shards.engines.items():
+        if name != destination:
+            deleted = await purge_user(shard_engine, user_id, batch_size)
+            if deleted:
+                print(f"  deleted {deleted:,} todos from {name}")
+    shard_map = ShardMap.load(shards.map_file)
+    shard_map.moving.pop(user_id, None)
+    shard_map.save(shards.map_file)
+    print(f"Moved user {user_id} to {destination}")
+
+
+async def pin_users(new_shards: List[str]) -> int:
+    """
+    Pin every user that a ring with new_shards added would place on another
+    shard to their current shard; returns the users pinned
+    """
+    new_ring = HashRing(list(shards.engines) + new_shards)
+    shard_map = ShardMap.load(shards.map_file)
+    pinned = 0
+    for name, shard_engine in shards.engines.items():
+        async with shard_engine.connect() as conn:
+            user_ids = (
+                (await conn.execute(select(users.c.id).union(select(todos.c.user_id))))
+                .scalars()
+                .all()
+            )
+        for user_id in user_ids:
+            current = shard_map.users.get(user_id) or shards.ring.get(user_id)
+            # Rows of users that live elsewhere are leftovers of a failed move
+            if (
+                current == name
+                and new_ring.get(user_id) != name
+                and user_id not in shard_map.users
+            ):
+                shard_map.users[user_id] = name
+                pinned += 1
+    shard_map.save(shards.map_file)
+    return pinned
+
+
+async def rebalance(batch_size: int, grace_seconds: float) -> int:
+    """
+    Move each pinned user to the shard the ring gives them; returns the
+    users moved
+    """
+    shard_map = ShardMap.load(shards.map_file)
+    moves = [
+        (user_id, shards.ring.get(user_id))
+        for user_id, shard in sorted(shard_map.users.items())
+        if shard != shards.ring.get(user_id)
+    ]
+    for user_id, destination in moves:
+        await move_user(user_id, destination, batch_size, grace_seconds)
+    return len(moves)
+
+
+async def main(args: argparse.Namespace) -> None:
+    if not shards.sharded:
+        raise SystemExit("DATABASE_SHARDS is not set")
+    try:
+        if args.command == "move":
+            await move_user(args.user, args.to, args.batch_size, args.grace)
+        elif args.command == "pin":
+            pinned = await pin_users(args.new_shard)
+            print(f"Pinned {pinned} users to their current shards in {shards.map_file}")
+        else:
+            moved = await rebalance(args.batch_size, args.grace)
+            print(f"Moved {moved} users.")
+    finally:
+        for shard_engine in shards.engines.values():
+            await shard_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move users' rows between shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    move = commands.add_parser("move", help="Move one user to a shard")
+    move.add_argument("--user", type=int, required=True)
+    move.add_argument("--to", required=True, help="Destination shard")
+
+    pin = commands.add_parser(
+        "pin", help="Pin the users that adding shards would reassign"
+    )
+    pin.add_argument(
+        "--new-shard",
+        action="append",
+        required=True,
+        help="Name of a shard to be added",
+    )
+
+    rebalance_parser = commands.add_parser(
+        "rebalance", help="Move pinned users to the shards the ring gives them"
+    )
+
+    for command in (move, rebalance_parser):
+        command.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Todos copied or deleted per transaction",
+        )
+        command.add_argument(
+            "--grace",
+            type=float,
+            default=5.0,
+            help="Seconds allowed for writes in flight after a shard map change",
+        )
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -3,12 +3,14 @@ import asyncio
 from datetime import datetime, timedelta
 from typing import List
 
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.db.models import Todo, TodoStatus, User
-from app.db.session import SessionLocal, initialize_database
+from app.core.deps import get_current_user
+from app.db.models import Todo, TodoEmbedding, TodoStatus, User, todo_tags
+from app.db.sharding import shards
+from app.services.ranking import spaced_keys
 
 # Sample todo data
 SAMPLE_TODOS = [
@@ -68,15 +70,30 @@ async def create_default_user(session: AsyncSession) -> User:
     return user
 
 
-async def create_sample_todos(session: AsyncSession, user_id: int) -> List[Todo]:
-    """Create sample todo items for the user"""
+async def create_sample_todos(
+    session: AsyncSession, user_id: int, force: bool = False
+) -> List[Todo]:
+    """Create sample todo items for the user, replacing any existing ones if forced"""
     result = await session.execute(select(Todo).filter(Todo.user_id == user_id))
     existing_todos = result.scalars().all()
 
+    if existing_todos and force:
+        todo_ids = [todo.id for todo in existing_todos]
+        await session.execute(
+            delete(todo_tags).where(todo_tags.c.todo_id.in_(todo_ids))
+        )
+        await session.execute(
+            delete(TodoEmbedding).where(TodoEmbedding.todo_id.in_(todo_ids))
+        )
+        await session.execute(delete(Todo).where(Todo.id.in_(todo_ids)))
+        await session.commit()
+        print(f"Deleted {len(todo_ids)} existing todos for user_id: {user_id}")
+        existing_todos = []
+
     if not existing_todos:
         todos = []
-        for todo_data in SAMPLE_TODOS:
-            todo = Todo(user_id=user_id, **todo_data)
+        for todo_data, rank in zip(SAMPLE_TODOS, spaced_keys(len(SAMPLE_TODOS))):
+            todo = Todo(user_id=user_id, rank=rank, **todo_data)
             session.add(todo)
             todos.append(todo)
 
@@ -85,18 +102,18 @@ async def create_sample_todos(session: AsyncSession, user_id: int) -> List[Todo]
             await session.refresh(todo)
         print(f"Created {len(todos)} sample todos for user_id: {user_id}")
         return todos
-    
+
     print(f"Found {len(existing_todos)} existing todos. Skipping seed.")
     return existing_todos
 
 
-async def seed_database() -> None:
-    """Initialize and seed the database with sample data"""
-    await initialize_database()
-    
-    async with SessionLocal() as session:
+async def seed_database(force: bool = False) -> None:
+    """Seed a migrated database with sample data"""
+    # The demo user is the one get_current_user returns; seed its shard
+    user_id = (await get_current_user())["id"]
+    async with shards.session(user_id) as session:
         user = await create_default_user(session)
-        await create_sample_todos(session, user.id)
+        await create_sample_todos(session, user.id, force=force)
 
 
 if __name__ == "__main__":
@@ -106,5 +123,6 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    asyncio.run(seed_database())
-    print("Database seeding completed.")
\ No newline at end of file
+    # For production-scale data, see app.db.generate
+    asyncio.run(seed_database(force=args.force))
+    print("Database seeding completed.")
@@ -1,6 +1,9 @@
 import contextlib
+from functools import lru_cache
+from time import perf_counter
 from typing import AsyncGenerator
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import (
     AsyncConnection,
     AsyncEngine,
@@ -9,36 +12,108 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from app.core.admission import admission
 from app.core.config import settings
+from app.core.metrics import (
+    DB_POOL_CHECKOUT_DURATION,
+    DB_QUERY_DURATION,
+    DB_QUERY_ERRORS,
+)
+from app.core.profiling import current_resolver, query_log
 
 # SQLAlchemy Base class for declarative models
 Base = declarative_base()
 
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    The default async pool, timing how long each checkout takes for metrics
+    and admission control
+    """
+
+    def connect(self):
+        waiter = object()
+        started = admission.pool_waiters[waiter] = perf_counter()
+        try:
+            return super().connect()
+        finally:
+            del admission.pool_waiters[waiter]
+            DB_POOL_CHECKOUT_DURATION.observe(perf_counter() - started)
+
+
+@lru_cache(maxsize=1024)
+def _statement_operation(statement: str) -> str:
+    """
+    Leading keyword of a SQL statement, e.g. SELECT; statements repeat, so
+    this is cached
+    """
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = perf_counter()
+
+
+def _observe_query(conn, cursor, statement, parameters, context, executemany):
+    duration = perf_counter() - context.query_started
+    DB_QUERY_DURATION.labels(_statement_operation(statement)).observe(duration)
+    queries = query_log.get()
+    if queries is not None:
+        queries.append((current_resolver.get(), statement, duration))
+
+
+def _count_query_error(exception_context):
+    if exception_context.statement:
+        DB_QUERY_ERRORS.labels(_statement_operation(exception_context.statement)).inc()
+
+
+def create_db_engine(url: str) -> AsyncEngine:
+    """An async engine for a database URL, with timed checkouts and query metrics"""
+    if url.startswith("sqlite"):
+        new_engine = create_async_engine(
+            url,
+            connect_args={"check_same_thread": False},
+            echo=False,
+            poolclass=TimedQueuePool,
+        )
+    else:
+        new_engine = create_async_engine(
+            url,
+            echo=False,
+            future=True,
+            pool_pre_ping=True,
+            poolclass=TimedQueuePool,
+        )
+    event.listen(new_engine.sync_engine, "before_cursor_execute", _start_query_timer)
+    event.listen(new_engine.sync_engine, "after_cursor_execute", _observe_query)
+    event.listen(new_engine.sync_engine, "handle_error", _count_query_error)
+    return new_engine
+
+
 # Create async engine
 if settings.USE_SQLITE:
     SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///./{settings.SQLITE_DB_FILE}"
-    engine = create_async_engine(
-        SQLALCHEMY_DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        echo=False,
-    )
 else:
-    engine = create_async_engine(
-        str(settings.SQLALCHEMY_DATABASE_URI),
-        echo=False,
-        future=True,
-        pool_pre_ping=True,
+    SQLALCHEMY_DATABASE_URL = str(settings.SQLALCHEMY_DATABASE_URI)
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+
+
+def create_sessionmaker(bind: AsyncEngine) -> async_sessionmaker:
+    """Session factory for an engine"""
+    return async_sessionmaker(
+        bind,
+        class_=AsyncSession,
+        expire_on_commit=False,
+        autocommit=False,
+        autoflush=False,
     )
 
+
 # Create async session factory
-SessionLocal = async_sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-    autocommit=False,
-    autoflush=False,
-)
+SessionLocal = create_sessionmaker(engine)
 
 
 # Context manager for getting a connection to use in initialization scripts
@@ -49,12 +124,3 @@ async def get_connection() -> AsyncGenerator[AsyncConnection, None]:
     """
     async with engine.begin() as connection:
         yield connection
-
-
-# Initialize the database tables
-async def initialize_database() -> None:
-    """
-    Create all tables in the database
-    """
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
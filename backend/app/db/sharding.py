@@ -0,0 +1,217 @@
+"""
+Hash sharding of user data across databases, keyed by user ID.
+
+With DATABASE_SHARDS set, each user's rows (the user, todos, tags,
+archived todos and embeddings) live in one of the named databases. A
+user's shard is the first one at or after the user's hash on a
+consistent hash ring of the shard names, so adding a shard reassigns
+about 1/N of the users rather than nearly all of them. The shard map
+file (SHARD_MAP_FILE) overrides the ring for pinned users, which is how
+users stay put while a shard is added until app.db.rebalance has moved
+them. It also lists the users being moved: their sessions refuse writes
+until the move is done, so the copy stays consistent, while their reads
+are still served. Processes reload the file when it changes.
+
+Without DATABASE_SHARDS there is a single shard, "default", on the
+app's database, and routing costs nothing. Every request's queries are
+scoped to one user, so get_context and get_db open the session on that
+user's shard; jobs covering all users (migrations, archival, reminders)
+go through the shards in turn.
+
+    DATABASE_SHARDS='{"s0": "sqlite+aiosqlite:///./s0.db",
+                      "s1": "sqlite+aiosqlite:///./s1.db"}'
+"""
+import bisect
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import ORMExecuteState, Session
+
+from app.core.config import settings
+from app.core.metrics import DB_POOL_CHECKED_OUT, DB_POOL_OVERFLOW, DB_POOL_SIZE
+from app.db.session import SessionLocal, create_db_engine, create_sessionmaker, engine
+
+DEFAULT_SHARD = "default"
+# Points per shard on the hash ring; more points even out the users per shard
+VIRTUAL_NODES = 64
+
+
+class UserMovingError(RuntimeError):
+    """A write to a user's data while it is being moved to another shard"""
+
+
+def _hash(key: str) -> int:
+    """Position of a key on the ring; the same in every process, unlike hash()"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring of shard names"""
+
+    def __init__(self, names: Iterable[str], virtual_nodes: int = VIRTUAL_NODES):
+        points = sorted(
+            (_hash(f"{name}:{index}"), name)
+            for name in names
+            for index in range(virtual_nodes)
+        )
+        self.hashes = [point for point, _ in points]
+        self.names = [name for _, name in points]
+
+    def get(self, user_id: int) -> str:
+        """The shard of a user"""
+        index = bisect.bisect_left(self.hashes, _hash(str(user_id)))
+        return self.names[index % len(self.names)]
+
+
+@dataclass
+class ShardMap:
+    """Contents of the shard map file"""
+
+    # User ID -> shard, for users not on the shard the ring gives them
+    users: Dict[int, str] = field(default_factory=dict)
+    # User ID -> destination shard, for users being moved
+    moving: Dict[int, str] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: str) -> "ShardMap":
+        """Read a shard map file; a missing file is an empty map"""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        return cls(
+            users={
+                int(user_id): shard for user_id, shard in data.get("users", {}).items()
+            },
+            moving={
+                int(user_id): shard for user_id, shard in data.get("moving", {}).items()
+            },
+        )
+
+    def save(self, path: str) -> None:
+        """Replace the file in one step, so that readers never see it half written"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(
+                {
+                    "users": {
+                        str(user_id): shard
+                        for user_id, shard in sorted(self.users.items())
+                    },
+                    "moving": {
+                        str(user_id): shard
+                        for user_id, shard in sorted(self.moving.items())
+                    },
+                },
+                f,
+                indent=2,
+            )
+        os.replace(temp_path, path)
+
+
+def _refuse_statement(orm_execute_state: ORMExecuteState) -> None:
+    user_id = orm_execute_state.session.info.get("moving_user")
+    if user_id is not None and not orm_execute_state.is_select:
+        raise UserMovingError(
+            f"User {user_id} is being moved to another shard; retry shortly"
+        )
+
+
+def _refuse_flush(session: Session, flush_context: object, instances: object) -> None:
+    user_id = session.info.get("moving_user")
+    if user_id is not None and (session.new or session.dirty or session.deleted):
+        raise UserMovingError(
+            f"User {user_id} is being moved to another shard; retry shortly"
+        )
+
+
+class ShardRouter:
+    """The shards' engines and session factories, and the shard of each user"""
+
+    def __init__(self, urls: Dict[str, str], map_file: str, reload_seconds: float):
+        self.sharded = bool(urls)
+        if self.sharded:
+            self.engines: Dict[str, AsyncEngine] = {
+                name: create_db_engine(url) for name, url in urls.items()
+            }
+            self.sessionmakers: Dict[str, async_sessionmaker] = {
+                name: create_sessionmaker(shard_engine)
+                for name, shard_engine in self.engines.items()
+            }
+            event.listen(Session, "do_orm_execute", _refuse_statement)
+            event.listen(Session, "before_flush", _refuse_flush)
+        else:
+            self.engines = {DEFAULT_SHARD: engine}
+            self.sessionmakers = {DEFAULT_SHARD: SessionLocal}
+        self.ring = HashRing(self.engines)
+        self.map_file = map_file
+        self.reload_seconds = reload_seconds
+        self.map = ShardMap()
+        self._map_mtime: Optional[int] = None
+        self._checked_at = float("-inf")
+        # Called with each user whose shard changed, to drop what was cached
+        # from the old one
+        self.move_listeners: List[Callable[[int], None]] = []
+
+    def shard_map(self) -> ShardMap:
+        """The shard map, reloaded if the file changed since it was last checked"""
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_seconds:
+            return self.map
+        self._checked_at = now
+        try:
+            mtime: Optional[int] = os.stat(self.map_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._map_mtime:
+            previous = self.map
+            self.map = ShardMap.load(self.map_file)
+            self._map_mtime = mtime
+            for user_id in set(previous.users) | set(self.map.users):
+                before = previous.users.get(user_id) or self.ring.get(user_id)
+                if (self.map.users.get(user_id) or self.ring.get(user_id)) != before:
+                    for listener in self.move_listeners:
+                        listener(user_id)
+        return self.map
+
+    def shard_for(self, user_id: int) -> str:
+        """Name of the shard holding a user's data"""
+        if not self.sharded:
+            return DEFAULT_SHARD
+        return self.shard_map().users.get(user_id) or self.ring.get(user_id)
+
+    def session(self, user_id: int) -> AsyncSession:
+        """
+        A new session on a user's shard. While the user is being moved, it
+        refuses writes until the shard map points at the destination.
+        """
+        shard = self.shard_for(user_id)
+        session = self.sessionmakers[shard]()
+        if self.map.moving.get(user_id, shard) != shard:
+            session.info["moving_user"] = user_id
+        return session
+
+    def moving_users(self) -> List[int]:
+        """Users being moved, whose rows background jobs must leave alone"""
+        return list(self.shard_map().moving) if self.sharded else []
+
+
+# Shared router for the application process
+shards = ShardRouter(
+    settings.DATABASE_SHARDS, settings.SHARD_MAP_FILE, settings.SHARD_MAP_RELOAD_SECONDS
+)
+
+DB_POOL_SIZE.set_function(lambda: sum(e.pool.size() for e in shards.engines.values()))
+DB_POOL_CHECKED_OUT.set_function(
+    lambda: sum(e.pool.checkedout() for e in shards.engines.values())
+)
+DB_POOL_OVERFLOW.set_function(
+    lambda: sum(max(0, e.pool.overflow()) for e in shards.engines.values())
+)
@@ -1,93 +1,182 @@
 import asyncio
-from typing import AsyncGenerator, Dict, Set
+import json
+import socket
+from contextlib import contextmanager
+from typing import AsyncGenerator, Dict, Iterator, Optional
+
+from app.core.metrics import PUBSUB_CHANNELS, PUBSUB_SUBSCRIBERS
+
+# Longest relayed message, in bytes
+RELAY_LINE_LIMIT = 2**20
+
 
 class PubSubManager:
     """
     Simple Pub/Sub manager for async events and real-time streaming
     Enables token streaming for AI-generated todo suggestions
+
+    Under app.server, messages go through the server's broker, which passes
+    them on to every worker process, so that a subscriber sees what any
+    worker publishes; otherwise they stay in this process.
     """
 
     def __init__(self):
-        # Store active channels as {channel_id: Queue}
-        self.channels: Dict[str, asyncio.Queue] = {}
-        # Store active subscriptions as {channel_id: set(subscription_ids)}
-        self.subscribers: Dict[str, Set[int]] = {}
+        # Queues of the active subscriptions as {channel_id: {subscription_id: Queue}};
+        # each subscriber reads its own, so every one of them sees every message
+        self.channels: Dict[str, Dict[int, asyncio.Queue]] = {}
         # Counter for generating unique subscription IDs
         self.next_sub_id: int = 1
+        # Set while shutting down: new subscriptions end immediately
+        self.draining = False
+        # Socket to app.server's broker, set in its workers before the app starts
+        self.relay: Optional[socket.socket] = None
+        self._relay_writer: Optional[asyncio.StreamWriter] = None
+        self._relay_task: Optional[asyncio.Task] = None
+
+    @property
+    def shared(self) -> bool:
+        """Whether messages also reach the subscribers of other processes"""
+        return self._relay_writer is not None
+
+    async def start(self) -> None:
+        """Connect to the broker, if this process has one"""
+        if self.relay is not None and self._relay_task is None:
+            reader, self._relay_writer = await asyncio.open_connection(
+                sock=self.relay, limit=RELAY_LINE_LIMIT
+            )
+            self._relay_task = asyncio.create_task(self._read_relay(reader))
+
+    async def stop(self) -> None:
+        if self._relay_task is not None:
+            self._relay_task.cancel()
+            self._relay_task = None
+        if self._relay_writer is not None:
+            self._relay_writer.close()
+            self._relay_writer = None
+
+    def publish_nowait(self, channel_id: str, message: Optional[str]) -> None:
+        """Publish a message without waiting for it to be sent to the broker"""
+        if self._relay_writer is not None:
+            # Delivered here too once the broker passes it back, in the same
+            # order as in every other process
+            self._relay_writer.write(json.dumps([channel_id, message]).encode() + b"\n")
+        else:
+            self._deliver(channel_id, message)
 
-    async def publish(self, channel_id: str, message: str) -> bool:
+    async def publish(self, channel_id: str, message: Optional[str]) -> bool:
         """
-        Publish a message to a channel
-        Creates the channel if it doesn't exist
+        Publish a message to every current subscriber of a channel
+        Without subscribers the message is dropped; returns whether it was
+        relayed or anyone in this process was subscribed
         """
-        if channel_id not in self.channels:
-            self.channels[channel_id] = asyncio.Queue()
-            self.subscribers[channel_id] = set()
-        
-        await self.channels[channel_id].put(message)
-        return True
+        if self._relay_writer is not None:
+            self.publish_nowait(channel_id, message)
+            await self._relay_writer.drain()
+            return True
+        return self._deliver(channel_id, message)
 
-    async def subscribe(self, channel_id: str) -> AsyncGenerator[str, None]:
+    @contextmanager
+    def subscription(self, channel_id: str) -> Iterator["asyncio.Queue[Optional[str]]"]:
         """
-        Subscribe to a channel and yield messages as they arrive
-        Creates the channel if it doesn't exist
+        Receive a channel's messages in a queue while the block runs, ending
+        with None when the channel is closed. Subscribing before reading the
+        state the messages update means no update is missed in between.
         """
-        # Create channel if it doesn't exist
-        if channel_id not in self.channels:
-            self.channels[channel_id] = asyncio.Queue()
-            self.subscribers[channel_id] = set()
-        
         # Generate a unique subscription ID
         sub_id = self._get_next_sub_id()
-        self.subscribers[channel_id].add(sub_id)
-        
+        queue: asyncio.Queue = asyncio.Queue()
+        self.channels.setdefault(channel_id, {})[sub_id] = queue
+        if self.draining:
+            queue.put_nowait(None)
+
         try:
+            yield queue
+        finally:
+            # Clean up the subscription, and the channel with its last subscriber
+            queues = self.channels.get(channel_id)
+            if queues is not None:
+                queues.pop(sub_id, None)
+                if not queues:
+                    del self.channels[channel_id]
+
+    async def subscribe(self, channel_id: str) -> AsyncGenerator[str, None]:
+        """
+        Subscribe to a channel and yield the messages published from now on
+        Ends when the channel is closed
+        """
+        with self.subscription(channel_id) as queue:
             # Continue yielding messages until channel is closed
             while True:
-                message = await self.channels[channel_id].get()
-                
+                message = await queue.get()
+
                 # Special EOF marker
                 if message is None:
                     break
-                    
+
                 yield message
-                
-                # Mark the task as done
-                self.channels[channel_id].task_done()
-        finally:
-            # Clean up subscription when generator is closed
-            if channel_id in self.subscribers and sub_id in self.subscribers[channel_id]:
-                self.subscribers[channel_id].remove(sub_id)
-                
-            # Remove channel if no more subscribers
-            await self._cleanup_channel(channel_id)
 
     async def close_channel(self, channel_id: str) -> bool:
         """
         Close a channel and signal end to all subscribers
         """
-        if channel_id not in self.channels:
-            return False
-            
-        # Put None as an EOF marker for all active subscribers
-        for _ in range(len(self.subscribers.get(channel_id, set()))):
-            await self.channels[channel_id].put(None)
-            
-        # Cleanup will happen when subscribers process the EOF
-        return True
+        # None is the EOF marker
+        return await self.publish(channel_id, None)
 
-    async def _cleanup_channel(self, channel_id: str) -> None:
+    async def drain(self, timeout: float) -> int:
         """
-        Remove a channel if it has no subscribers
+        End every subscription in this process, so that clients see their
+        streams complete and can resubscribe to another server, and wait up
+        to timeout for them to finish. Returns the number of subscriptions
+        still open.
         """
-        if channel_id in self.subscribers and not self.subscribers[channel_id]:
-            # No more subscribers, clean up
-            if channel_id in self.channels:
-                del self.channels[channel_id]
-            del self.subscribers[channel_id]
+        self.draining = True
+        for channel_id in list(self.channels):
+            self._deliver(channel_id, None)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.subscriber_count() and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        return self.subscriber_count()
+
+    def subscriber_count(self) -> int:
+        """Active subscriptions across channels"""
+        return sum(len(queues) for queues in self.channels.values())
+
+    def has_subscribers(self, channel_id: str) -> bool:
+        """Check whether a channel has active subscribers in this process"""
+        return bool(self.channels.get(channel_id))
+
+    def _deliver(self, channel_id: str, message: Optional[str]) -> bool:
+        """Hand a message to this process's subscribers of a channel"""
+        queues = self.channels.get(channel_id)
+        if not queues:
+            return False
+
+        for queue in queues.values():
+            queue.put_nowait(message)
+        return True
+
+    async def _read_relay(self, reader: asyncio.StreamReader) -> None:
+        """Deliver the messages the broker passes on, from every worker"""
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            channel_id, message = json.loads(line)
+            self._deliver(channel_id, message)
+        # The server is going away; keep publishing within this process
+        print("Pub/Sub broker connection closed")
+        self._relay_writer = None
 
     def _get_next_sub_id(self) -> int:
         """Get next unique subscription ID"""
         sub_id = self.next_sub_id
         self.next_sub_id += 1
-        return sub_id
\ No newline at end of file
+        return sub_id
+
+
+# Shared instance for the application process
+pubsub = PubSubManager()
+
+PUBSUB_CHANNELS.set_function(lambda: len(pubsub.channels))
+PUBSUB_SUBSCRIBERS.set_function(pubsub.subscriber_count)
@@ -0,0 +1,124 @@
+"""
+Schema and field extensions for caching, metrics and query checks.
+
+graphql-core runs every schema extension that has a resolve method as a
+middleware around each field, including the many plain attribute fields of
+a todo list, so none of these extensions has one. Resolver timings come
+from a field extension added to the root fields only.
+"""
+from time import perf_counter
+from typing import Any, Callable, Iterator
+
+import strawberry.extensions
+from strawberry.extensions import FieldExtension, SchemaExtension
+
+from app.core.metrics import (
+    GRAPHQL_REQUEST_DURATION,
+    GRAPHQL_REQUEST_ERRORS,
+    GRAPHQL_RESOLVER_DURATION,
+)
+from app.core.profiling import (
+    QueryLog,
+    check_queries,
+    current_profile,
+    current_resolver,
+    query_log,
+)
+
+
+class ParserCache(strawberry.extensions.ParserCache):
+    """Strawberry's ParserCache, without the per-field middleware"""
+
+    resolve = None
+
+
+class ValidationCache(strawberry.extensions.ValidationCache):
+    """Strawberry's ValidationCache, without the per-field middleware"""
+
+    resolve = None
+
+
+class MetricsExtension(SchemaExtension):
+    """Times each operation, by operation type, and counts those with errors"""
+
+    resolve = None
+
+    def on_operation(self) -> Iterator[None]:
+        started = perf_counter()
+        yield
+        context = self.execution_context
+        if context.graphql_document is None:
+            operation_type = "invalid"
+        else:
+            try:
+                operation_type = context.operation_type.value
+            except RuntimeError:
+                operation_type = "invalid"
+        GRAPHQL_REQUEST_DURATION.labels(operation_type).observe(
+            perf_counter() - started
+        )
+        if context.errors or (context.result and context.result.errors):
+            GRAPHQL_REQUEST_ERRORS.labels(operation_type).inc()
+
+
+class QueryCheckExtension(SchemaExtension):
+    """
+    Records the SQL statements of each operation, warns about slow and
+    repeated ones, and hands them to the request's profile if it has one
+    """
+
+    resolve = None
+
+    def on_operation(self) -> Iterator[None]:
+        queries: QueryLog = []
+        token = query_log.set(queries)
+        try:
+            yield
+        finally:
+            query_log.reset(token)
+        operation = self.execution_context.operation_name
+        warnings = check_queries(queries, operation)
+        profile = current_profile.get()
+        if profile is not None:
+            profile.operation = operation
+            profile.queries.extend(queries)
+            profile.warnings.extend(warnings)
+
+
+class ResolverTimer(FieldExtension):
+    """Times a field's resolver, and marks it as the one running for query checks"""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.series = GRAPHQL_RESOLVER_DURATION.labels(field)
+
+    def resolve(
+        self, next_: Callable[..., Any], source: Any, info: Any, **kwargs: Any
+    ) -> Any:
+        token = current_resolver.set(self.field)
+        started = perf_counter()
+        try:
+            return next_(source, info, **kwargs)
+        finally:
+            self.series.observe(perf_counter() - started)
+            current_resolver.reset(token)
+
+    async def resolve_async(
+        self, next_: Callable[..., Any], source: Any, info: Any, **kwargs: Any
+    ) -> Any:
+        token = current_resolver.set(self.field)
+        started = perf_counter()
+        try:
+            return await next_(source, info, **kwargs)
+        finally:
+            self.series.observe(perf_counter() - started)
+            current_resolver.reset(token)
+
+
+def time_resolvers(*types: type) -> None:
+    """Add a ResolverTimer to every field of root types, before the schema is built"""
+    for type_ in types:
+        for field in type_.__strawberry_definition__.fields:
+            field.extensions.append(
+                ResolverTimer(f"{type_.__name__}.{field.python_name}")
+            )
@@ -4,21 +4,45 @@ import strawberry
 from sqlalchemy.ext.asyncio import AsyncSession
 from strawberry.types import Info
 
+from app.core.config import settings
 from app.core.deps import db_dependency
 from app.db.models import TodoStatus as DBTodoStatus
+from app.events.pubsub import pubsub
+from app.graphql.extensions import (
+    MetricsExtension,
+    ParserCache,
+    QueryCheckExtension,
+    ValidationCache,
+    time_resolvers,
+)
 from app.graphql.types import (
+    ArchivedTodo,
     CreateTodoInput,
     CreateTodoPayload,
     DeleteTodoPayload,
+    MoveTodoPayload,
+    SuggestionError,
+    SuggestionJob,
+    SuggestionJobPayload,
+    Tag,
+    TagMatch,
     ToggleTodoStatusPayload,
     Todo,
+    TodoOrder,
+    TodoReminder,
     TodoStatus,
     TodoStreamToken,
     TodoSuggestionPayload,
+    UnarchiveTodoPayload,
     UpdateTodoInput,
     UpdateTodoPayload,
 )
-from app.services.llm import LLMService
+from app.services.archive import ArchiveService
+from app.services.embeddings import EmbeddingService
+from app.services.jobs import job_channel, suggestion_jobs
+from app.services.llm import SuggestionRouter, build_suggestion_request
+from app.services.reminders import reminder_channel
+from app.services.resilience import Deadline
 from app.services.todo import TodoService
 
 
@@ -28,6 +52,18 @@ async def get_db_from_info(info: Info) -> AsyncSession:
     return db
 
 
+def get_deadline_from_info(info: Info) -> Optional[Deadline]:
+    """
+    Build a deadline from the caller's X-Request-Timeout-Ms header, so that
+    upstream work stops once the caller has given up
+    """
+    value = info.context["request"].headers.get("x-request-timeout-ms")
+    try:
+        return Deadline(int(value) / 1000) if value else None
+    except ValueError:
+        return None
+
+
 async def get_user_id_from_info(info: Info) -> int:
     """Extract user ID from GraphQL context (for future auth)"""
     # This is a placeholder for future authentication
@@ -39,38 +75,99 @@ async def get_user_id_from_info(info: Info) -> int:
 class Query:
     @strawberry.field
     async def todos(
-        self, 
-        info: Info, 
-        include_completed: bool = True, 
-        limit: int = 100, 
-        offset: int = 0
+        self,
+        info: Info,
+        include_completed: bool = True,
+        limit: int = 100,
+        offset: int = 0,
+        tags: Optional[List[str]] = None,
+        match: TagMatch = TagMatch.ALL,
+        order: TodoOrder = TodoOrder.PRIORITY,
     ) -> List[Todo]:
-        """Get all todos for the current user"""
+        """Get all todos for the current user, optionally filtered by tags"""
         db = await get_db_from_info(info)
         user_id = await get_user_id_from_info(info)
-        
+
         todo_service = TodoService(db)
         db_todos = await todo_service.get_todos(
             user_id=user_id,
             include_completed=include_completed,
             limit=limit,
             skip=offset,
+            tags=tags,
+            match_all=match == TagMatch.ALL,
+            manual_order=order == TodoOrder.MANUAL,
         )
-        
+
+        return [Todo.from_db_model(todo) for todo in db_todos]
+
+    @strawberry.field
+    async def related_todos(self, info: Info, id: int, k: int = 10) -> List[Todo]:
+        """Get the todos most similar in meaning to a todo, most similar first"""
+        db = await get_db_from_info(info)
+        user_id = await get_user_id_from_info(info)
+
+        embedding_service = EmbeddingService(db)
+        db_todos = await embedding_service.related_todos(
+            todo_id=id, user_id=user_id, k=min(max(k, 0), 100)
+        )
+
         return [Todo.from_db_model(todo) for todo in db_todos]
 
+    @strawberry.field
+    async def tags(self, info: Info) -> List[Tag]:
+        """Get all tags for the current user"""
+        db = await get_db_from_info(info)
+        user_id = await get_user_id_from_info(info)
+
+        todo_service = TodoService(db)
+        db_tags = await todo_service.get_tags(user_id=user_id)
+
+        return [Tag.from_db_model(tag) for tag in db_tags]
+
+    @strawberry.field
+    async def archived_todos(
+        self, info: Info, limit: int = 100, offset: int = 0
+    ) -> List[ArchivedTodo]:
+        """Get archived todos for the current user"""
+        db = await get_db_from_info(info)
+        user_id = await get_user_id_from_info(info)
+
+        archive_service = ArchiveService(db)
+        db_archived = await archive_service.get_archived_todos(
+            user_id=user_id, skip=offset, limit=limit
+        )
+
+        return [ArchivedTodo.from_db_model(archived) for archived in db_archived]
+
+    @strawberry.field
+    async def suggestion_job(self, info: Info, id: str) -> Optional[SuggestionJob]:
+        """Get a background suggestion job by ID"""
+        user_id = await get_user_id_from_info(info)
+
+        job = await suggestion_jobs.get(id, user_id)
+        if not job:
+            return None
+
+        return SuggestionJob.from_job(job)
+
+    @strawberry.field
+    def suggestion_queue_depth(self) -> int:
+        """Number of suggestion jobs waiting for a worker in the serving process"""
+        return suggestion_jobs.depth
+
     @strawberry.field
     async def todo(self, info: Info, id: int) -> Optional[Todo]:
         """Get a specific todo by ID"""
         db = await get_db_from_info(info)
         user_id = await get_user_id_from_info(info)
-        
+
         todo_service = TodoService(db)
         db_todo = await todo_service.get_todo_by_id(todo_id=id, user_id=user_id)
-        
+
         if not db_todo:
             return None
-            
+
         return Todo.from_db_model(db_todo)
 
 
@@ -83,7 +180,7 @@ class Mutation:
         """Create a new todo"""
         db = await get_db_from_info(info)
         user_id = await get_user_id_from_info(info)
-        
+
         todo_service = TodoService(db)
         db_todo = await todo_service.create_todo(
             user_id=user_id,
@@ -92,10 +189,11 @@ class Mutation:
             priority=input.priority,
             due_date=input.due_date,
             is_ai_generated=input.is_ai_generated,
+            tags=input.tags,
         )
-        
+
         # Don't close the session - let the middleware handle it
-        
+
         return CreateTodoPayload(todo=Todo.from_db_model(db_todo))
 
     @strawberry.mutation
@@ -105,10 +203,10 @@ class Mutation:
         """Update an existing todo"""
         db = await get_db_from_info(info)
         user_id = await get_user_id_from_info(info)
-        
+
         todo_service = TodoService(db)
         db_status = input.status.to_db_status() if input.status else None
-        
+
         db_todo = await todo_service.update_todo(
             todo_id=input.id,
             user_id=user_id,
@@ -117,59 +215,117 @@ class Mutation:
             status=db_status,
             priority=input.priority,
             due_date=input.due_date,
+            tags=input.tags,
         )
-        
+
         if not db_todo:
             return UpdateTodoPayload(todo=None)
-            
+
         return UpdateTodoPayload(todo=Todo.from_db_model(db_todo))
 
     @strawberry.mutation
-    async def toggle_todo_status(
-        self, info: Info, id: int
-    ) -> ToggleTodoStatusPayload:
+    async def toggle_todo_status(self, info: Info, id: int) -> ToggleTodoStatusPayload:
         """Toggle the completion status of a todo"""
         db = await get_db_from_info(info)
         user_id = await get_user_id_from_info(info)
-        
+
         todo_service = TodoService(db)
         db_todo = await todo_service.toggle_todo_status(todo_id=id, user_id=user_id)
-        
+
         if not db_todo:
             return ToggleTodoStatusPayload(todo=None)
-            
+
         return ToggleTodoStatusPayload(todo=Todo.from_db_model(db_todo))
 
+    @strawberry.mutation
+    async def move_todo(
+        self,
+        info: Info,
+        id: int,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> MoveTodoPayload:
+        """Move a todo between the todos `before` and `after` in the manual order"""
+        db = await get_db_from_info(info)
+        user_id = await get_user_id_from_info(info)
+
+        todo_service = TodoService(db)
+        db_todo = await todo_service.move_todo(
+            todo_id=id, user_id=user_id, before_id=before, after_id=after
+        )
+
+        if not db_todo:
+            return MoveTodoPayload(todo=None)
+
+        return MoveTodoPayload(todo=Todo.from_db_model(db_todo))
+
+    @strawberry.mutation
+    async def unarchive_todo(self, info: Info, id: int) -> UnarchiveTodoPayload:
+        """Restore an archived todo into the active list"""
+        db = await get_db_from_info(info)
+        user_id = await get_user_id_from_info(info)
+
+        archive_service = ArchiveService(db)
+        db_todo = await archive_service.unarchive_todo(archived_id=id, user_id=user_id)
+
+        if not db_todo:
+            return UnarchiveTodoPayload(todo=None)
+
+        return UnarchiveTodoPayload(todo=Todo.from_db_model(db_todo))
+
     @strawberry.mutation
     async def delete_todo(self, info: Info, id: int) -> DeleteTodoPayload:
         """Delete a todo"""
         db = await get_db_from_info(info)
         user_id = await get_user_id_from_info(info)
-        
+
         todo_service = TodoService(db)
         success = await todo_service.delete_todo(todo_id=id, user_id=user_id)
-        
+
         return DeleteTodoPayload(success=success, id=id if success else None)
-        
+
     @strawberry.mutation
     async def generate_todo_suggestion(self, info: Info) -> TodoSuggestionPayload:
         """Generate a todo suggestion based on existing todos"""
+        deadline = get_deadline_from_info(info)
         db = await get_db_from_info(info)
         user_id = await get_user_id_from_info(info)
-        
-        # Get existing todos to provide context for generation
-        todo_service = TodoService(db)
-        existing_todos = await todo_service.get_todos(user_id=user_id, limit=10)
-        
-        # Set up LLM service for generation
-        llm_service = LLMService()
-        
-        # Generate the suggestion (non-streaming)
-        suggestion = await llm_service.generate_todo_suggestion(existing_todos, user_id)
-        
-        # Don't close the session - let the middleware handle it
-        
-        return TodoSuggestionPayload(suggestion=suggestion)
+
+        # Get the user's recent todos and the ones that fit the prompt token budget
+        request = await build_suggestion_request(db, user_id)
+
+        # Release the connection before the slow LLM round trip
+        await db.close()
+
+        # Generate the suggestion (non-streaming) from the configured backend
+        result = await SuggestionRouter().suggest(request, deadline=deadline)
+
+        return TodoSuggestionPayload(
+            suggestion=result.suggestion, error=SuggestionError.from_error(result.error)
+        )
+
+    @strawberry.mutation
+    async def enqueue_todo_suggestion(self, info: Info) -> SuggestionJobPayload:
+        """
+        Queue a todo suggestion for background generation and return its job
+        right away. A user's pending job is returned instead of queueing another.
+        """
+        user_id = await get_user_id_from_info(info)
+
+        job = await suggestion_jobs.enqueue(user_id)
+
+        return SuggestionJobPayload(job=SuggestionJob.from_job(job))
+
+    @strawberry.mutation
+    async def cancel_suggestion_job(self, info: Info, id: str) -> SuggestionJobPayload:
+        """Cancel a queued or running suggestion job"""
+        user_id = await get_user_id_from_info(info)
+
+        job = await suggestion_jobs.cancel(id, user_id)
+        if not job:
+            return SuggestionJobPayload(job=None)
+
+        return SuggestionJobPayload(job=SuggestionJob.from_job(job))
 
 
 # Keep for backward compatibility but mark as deprecated
@@ -181,10 +337,51 @@ class Subscription:
         # This method won't be called anymore, but keep it for compatibility
         raise NotImplementedError("Streaming is no longer supported")
 
+    @strawberry.subscription
+    async def suggestion_job(
+        self, info: Info, id: str
+    ) -> AsyncGenerator[SuggestionJob, None]:
+        """Subscribe to status updates of a background suggestion job"""
+        user_id = await get_user_id_from_info(info)
+
+        # Subscribed before the job is read, so that no update is missed;
+        # the job may be running in another process
+        with pubsub.subscription(job_channel(id)) as updates:
+            job = await suggestion_jobs.get(id, user_id)
+            if not job:
+                return
+
+            yield SuggestionJob.from_job(job)
+            while not job.is_finished:
+                if await updates.get() is None:
+                    break
+                job = await suggestion_jobs.get(id, user_id)
+                if not job:
+                    break
+                yield SuggestionJob.from_job(job)
+
+    @strawberry.subscription
+    async def todo_reminders(self, info: Info) -> AsyncGenerator[TodoReminder, None]:
+        """Subscribe to reminders of pending todos shortly before they are due"""
+        user_id = await get_user_id_from_info(info)
+
+        async for message in pubsub.subscribe(reminder_channel(user_id)):
+            yield TodoReminder.from_message(message)
+
 
 # Create Strawberry schema
+time_resolvers(Query, Mutation)
+
 schema = strawberry.Schema(
     query=Query,
     mutation=Mutation,
     subscription=Subscription,
-)
\ No newline at end of file
+    extensions=[
+        # Clients send the same few documents over and over, so parse and
+        # validate each one once rather than on every request
+        ParserCache(maxsize=settings.GRAPHQL_DOCUMENT_CACHE_SIZE),
+        ValidationCache(maxsize=settings.GRAPHQL_DOCUMENT_CACHE_SIZE),
+        MetricsExtension,
+        QueryCheckExtension,
+    ],
+)
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from enum import Enum
 from typing import List, Optional
@@ -6,20 +7,22 @@ import strawberry
 from strawberry.types import Info
 
 from app.db.models import TodoStatus as DBTodoStatus
+from app.services.jobs import JobStatus
+from app.services.llm import SuggestionErrorCode as LLMSuggestionErrorCode
 
 
 @strawberry.enum
 class TodoStatus(Enum):
     PENDING = "PENDING"
     COMPLETED = "COMPLETED"
-    
+
     @classmethod
     def from_db_status(cls, db_status: DBTodoStatus) -> "TodoStatus":
         """Convert DB status to GraphQL enum"""
         if db_status == DBTodoStatus.PENDING:
             return TodoStatus.PENDING
         return TodoStatus.COMPLETED
-    
+
     def to_db_status(self) -> DBTodoStatus:
         """Convert GraphQL enum to DB status"""
         if self == TodoStatus.PENDING:
@@ -27,6 +30,29 @@ class TodoStatus(Enum):
         return DBTodoStatus.COMPLETED
 
 
+@strawberry.enum
+class TagMatch(Enum):
+    ALL = "ALL"
+    ANY = "ANY"
+
+
+@strawberry.enum
+class TodoOrder(Enum):
+    PRIORITY = "PRIORITY"
+    MANUAL = "MANUAL"
+
+
+@strawberry.type
+class Tag:
+    id: int
+    name: str
+
+    @classmethod
+    def from_db_model(cls, db_model) -> "Tag":
+        """Convert from DB model to GraphQL type"""
+        return cls(id=db_model.id, name=db_model.name)
+
+
 @strawberry.type
 class Todo:
     id: int
@@ -39,7 +65,9 @@ class Todo:
     created_at: datetime
     updated_at: datetime
     completed_at: Optional[datetime]
-    
+    rank: str
+    tags: List[Tag]
+
     @classmethod
     def from_db_model(cls, db_model) -> "Todo":
         """Convert from DB model to GraphQL type"""
@@ -54,6 +82,38 @@ class Todo:
             created_at=db_model.created_at,
             updated_at=db_model.updated_at,
             completed_at=db_model.completed_at,
+            rank=db_model.rank,
+            tags=[Tag.from_db_model(tag) for tag in db_model.tags],
+        )
+
+
+@strawberry.type
+class ArchivedTodo:
+    id: int
+    title: str
+    description: Optional[str]
+    priority: int
+    due_date: Optional[datetime]
+    is_ai_generated: bool
+    tags: List[str]
+    created_at: Optional[datetime]
+    completed_at: Optional[datetime]
+    archived_at: datetime
+
+    @classmethod
+    def from_db_model(cls, db_model) -> "ArchivedTodo":
+        """Convert from DB model to GraphQL type"""
+        return cls(
+            id=db_model.id,
+            title=db_model.title,
+            description=db_model.description,
+            priority=db_model.priority,
+            due_date=db_model.due_date,
+            is_ai_generated=db_model.is_ai_generated,
+            tags=list(db_model.tags or []),
+            created_at=db_model.created_at,
+            completed_at=db_model.completed_at,
+            archived_at=db_model.archived_at,
         )
 
 
@@ -64,6 +124,7 @@ class CreateTodoInput:
     priority: int = 1
     due_date: Optional[datetime] = None
     is_ai_generated: bool = False
+    tags: Optional[List[str]] = None
 
 
 @strawberry.input
@@ -74,6 +135,7 @@ class UpdateTodoInput:
     status: Optional[TodoStatus] = None
     priority: Optional[int] = None
     due_date: Optional[datetime] = None
+    tags: Optional[List[str]] = None
 
 
 @strawberry.type
@@ -86,6 +148,16 @@ class UpdateTodoPayload:
     todo: Optional[Todo]
 
 
+@strawberry.type
+class MoveTodoPayload:
+    todo: Optional[Todo]
+
+
+@strawberry.type
+class UnarchiveTodoPayload:
+    todo: Optional[Todo]
+
+
 @strawberry.type
 class DeleteTodoPayload:
     success: bool
@@ -97,11 +169,77 @@ class TodoStreamToken:
     token: str
 
 
+@strawberry.type
+class TodoReminder:
+    todo_id: int
+    title: str
+    due_date: datetime
+
+    @classmethod
+    def from_message(cls, message: str) -> "TodoReminder":
+        """Convert from a published reminder to GraphQL type"""
+        reminder = json.loads(message)
+        return cls(
+            todo_id=reminder["todo_id"],
+            title=reminder["title"],
+            due_date=datetime.fromisoformat(reminder["due_date"]),
+        )
+
+
+SuggestionErrorCode = strawberry.enum(
+    LLMSuggestionErrorCode, name="SuggestionErrorCode"
+)
+
+
+@strawberry.type
+class SuggestionError:
+    code: SuggestionErrorCode
+    message: str
+
+    @classmethod
+    def from_error(cls, error) -> Optional["SuggestionError"]:
+        """Convert from a service error to GraphQL type"""
+        if error is None:
+            return None
+        return cls(code=error.code, message=error.message)
+
+
 @strawberry.type
 class TodoSuggestionPayload:
-    suggestion: str
+    suggestion: Optional[str]
+    error: Optional[SuggestionError] = None
 
 
 @strawberry.type
 class ToggleTodoStatusPayload:
-    todo: Optional[Todo]
\ No newline at end of file
+    todo: Optional[Todo]
+
+
+SuggestionJobStatus = strawberry.enum(JobStatus, name="SuggestionJobStatus")
+
+
+@strawberry.type
+class SuggestionJob:
+    id: str
+    status: SuggestionJobStatus
+    suggestion: Optional[str]
+    error: Optional[SuggestionError]
+    created_at: datetime
+    finished_at: Optional[datetime]
+
+    @classmethod
+    def from_job(cls, job) -> "SuggestionJob":
+        """Convert from a queued job to GraphQL type"""
+        return cls(
+            id=job.id,
+            status=job.status,
+            suggestion=job.suggestion,
+            error=SuggestionError.from_error(job.error),
+            created_at=job.created_at,
+            finished_at=job.finished_at,
+        )
+
+
+@strawberry.type
+class SuggestionJobPayload:
+    job: Optional[SuggestionJob]
@@ -3,15 +3,26 @@ from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import Depends, FastAPI, Request, Response
+from starlette.requests import HTTPConnection
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from strawberry.fastapi import GraphQLRouter
 from strawberry.subscriptions import GRAPHQL_TRANSPORT_WS_PROTOCOL, GRAPHQL_WS_PROTOCOL
 
+from app.api.transfer import router as transfer_router
+from app.core.admission import AdmissionMiddleware, admission
 from app.core.config import settings
-from app.core.deps import check_health
-from app.db.seed import seed_database
-from app.db.session import SessionLocal, initialize_database
+from app.core.deps import check_health, get_current_user
+from app.core.metrics import render_metrics
+from app.core.profiling import ProfilingMiddleware
+from app.db.migrations import check_schema_version
+from app.db.sharding import shards
+from app.events.pubsub import pubsub
 from app.graphql.schema import schema
+from app.services.archive import archive_periodically
+from app.services.jobs import suggestion_jobs
+from app.services.llm import get_openai_client
+from app.services.reminders import due_reminders
 
 
 @asynccontextmanager
@@ -19,23 +30,52 @@ async def lifespan(app: FastAPI):
     """
     Startup and shutdown events for the FastAPI app
     """
-    # Initialize database on startup
-    await initialize_database()
-    
-    # Seed database with sample data
-    await seed_database()
-    
+    # Refuse to serve against an unmigrated schema; migrations and seeding
+    # run once per deployment via `python -m app.db.migrations [--seed]`
+    await check_schema_version()
+
+    # Connect to the other workers' pub/sub, under app.server
+    await pubsub.start()
+
+    # Measure event loop lag for admission control
+    await admission.start()
+
+    # Start the background suggestion workers
+    await suggestion_jobs.start(prune=settings.PERIODIC_JOBS)
+
+    # Send reminders of the todos coming due, or have the process that
+    # does take this one's todo changes into account
+    if settings.REMINDERS_ENABLED:
+        await due_reminders.start(load=settings.PERIODIC_JOBS)
+
+    # Periodically move old completed todos out of the todos table
+    archive_task = None
+    if settings.PERIODIC_JOBS and settings.ARCHIVE_INTERVAL_SECONDS > 0:
+        archive_task = asyncio.create_task(
+            archive_periodically(settings.ARCHIVE_INTERVAL_SECONDS)
+        )
+
+    # Import the OpenAI SDK off the event loop once the app can serve
+    if settings.OPENAI_PRELOAD and settings.SUGGESTION_ROUTING != "local":
+        asyncio.get_running_loop().run_in_executor(None, get_openai_client)
+
     yield
-    
-    # Cleanup on shutdown (if needed)
-    pass
+
+    # Cleanup on shutdown
+    if archive_task:
+        archive_task.cancel()
+    await due_reminders.stop()
+    await suggestion_jobs.stop()
+    await admission.stop()
+    await pubsub.stop()
 
 
 # Get context for GraphQL with a fresh database session
-async def get_context(request: Request):
-    """Get GraphQL context with database session"""
-    # Create a new session for each request
-    session = SessionLocal()
+async def get_context(request: HTTPConnection):
+    """Get GraphQL context with database session (HTTP or WebSocket)"""
+    # Create a new session for each request, on the user's shard
+    user = await get_current_user()
+    session = shards.session(user["id"])
     # Store the session on the request state for cleanup
     request.state.db_session = session
     return {"request": request, "db": session}
@@ -66,15 +106,19 @@ app = FastAPI(
 async def db_session_middleware(request: Request, call_next):
     """Ensure database sessions are properly closed"""
     response = await call_next(request)
-    
+
     # Check if this is a GraphQL request that created a session
     if hasattr(request.state, "db_session") and request.state.db_session:
         await request.state.db_session.close()
         request.state.db_session = None
-    
+
     return response
 
 
+# Shed AI suggestions, then writes, then reads with 503 while saturated;
+# inside CORS so that browsers can read the rejections
+app.add_middleware(AdmissionMiddleware)
+
 # Set up CORS
 app.add_middleware(
     CORSMiddleware,
@@ -84,10 +128,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profile requests that ask for it with a signed X-Profile header, or a
+# sampled fraction of them; see app.core.profiling. Outermost, so the
+# profile covers the whole request.
+app.add_middleware(ProfilingMiddleware)
+
 
 # Mount GraphQL router
 app.include_router(graphql_app, prefix=settings.API_V1_STR)
 
+# Mount streaming bulk export/import endpoints
+app.include_router(transfer_router, prefix=settings.API_V1_STR)
+
 
 # Health check endpoint
 @app.get("/health")
@@ -100,6 +152,26 @@ async def health_check(is_healthy: bool = Depends(check_health)):
     return {"status": "error"}
 
 
+# Readiness endpoint
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 503 while the app is saturated enough to shed reads,
+    so the orchestrator routes traffic elsewhere. /health stays a liveness check.
+    """
+    state = admission.state()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+
+# Metrics endpoint for Prometheus scraping
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Request, resolver, database, LLM and pub/sub metrics of this process
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 # Development server
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
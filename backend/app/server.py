@@ -0,0 +1,304 @@
+"""
+Production server: uvicorn in pre-forked worker processes.
+
+The parent migrates the database once (and seeds it with --seed), imports
+the app, binds the listening socket and forks the workers, which share the
+imported code and the socket. Each worker gives each engine a fresh
+connection pool, since connections must not cross a fork, and serves
+until SIGTERM or SIGINT.
+
+Requests go to whichever worker accepts them, so state that requests
+share is not kept per worker. Suggestion jobs live in the database, and
+the parent runs a broker that passes each pub/sub message a worker
+publishes on to every worker, so that a subscription served by one worker
+sees the job updates and reminders published by another. The periodic
+jobs (archival, loading the reminder window, pruning suggestion jobs) run
+in the first worker only (PERIODIC_JOBS); the others forward their todo
+changes to its reminder scheduler. On shutdown a worker stops accepting, ends its
+GraphQL subscriptions so that clients resubscribe to another server,
+then waits for the requests in progress. The parent replaces workers that
+die. POSIX only.
+
+    python -m app.server --host 0.0.0.0 --port 8000 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import random
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+import uvicorn
+
+from app.core.config import settings
+from app.db.sharding import shards
+
+# A worker exiting this soon after it started failed to start; replacing it would loop
+MIN_WORKER_UPTIME_SECONDS = 5
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on, capped by a cgroup v2 CPU quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+async def prepare(seed: bool) -> None:
+    """
+    Migrate, and optionally seed, for all workers; no connection is left
+    open across the fork
+    """
+    from app.db.migrations import main as migrate
+
+    await migrate(seed)
+    for shard_engine in shards.engines.values():
+        await shard_engine.dispose()
+
+
+class Broker:
+    """
+    Passes each line a worker sends on to every worker, from a thread of
+    the parent, over a socket pair per worker
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        # Our ends of the workers' socket pairs, and what was read of an unfinished line
+        self.connections: Dict[socket.socket, bytes] = {}
+        # Connections of new workers, registered by the broker thread
+        self.pending: List[socket.socket] = []
+        self.lock = threading.Lock()
+        self._wakeup, self._wakeup_writer = socket.socketpair()
+        self.selector.register(self._wakeup, selectors.EVENT_READ)
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def connect(self) -> socket.socket:
+        """The worker's end of a new connection, to be used after the fork"""
+        ours, theirs = socket.socketpair()
+        with self.lock:
+            self.pending.append(ours)
+        self._wakeup_writer.send(b"x")
+        return theirs
+
+    def close_in_worker(self) -> None:
+        """Close the parent's sockets, which a forked worker inherits"""
+        for sock in list(self.connections) + self.pending:
+            sock.close()
+        self._wakeup.close()
+        self._wakeup_writer.close()
+        self.selector.close()
+
+    def _run(self) -> None:
+        while True:
+            for key, _ in self.selector.select():
+                sock = key.fileobj
+                if sock is self._wakeup:
+                    sock.recv(4096)
+                    with self.lock:
+                        pending, self.pending = self.pending, []
+                    for connection in pending:
+                        self.connections[connection] = b""
+                        self.selector.register(connection, selectors.EVENT_READ)
+                    continue
+                try:
+                    data = sock.recv(65536)
+                except OSError:
+                    data = b""
+                if not data:
+                    # The worker exited
+                    self.selector.unregister(sock)
+                    del self.connections[sock]
+                    sock.close()
+                    continue
+                buffered, _, partial = (self.connections[sock] + data).rpartition(b"\n")
+                self.connections[sock] = partial
+                if buffered:
+                    self._send_all(buffered + b"\n")
+
+    def _send_all(self, lines: bytes) -> None:
+        for connection in list(self.connections):
+            try:
+                connection.sendall(lines)
+            except OSError:
+                # Unregistered once its end of file is read
+                pass
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn's server, ending GraphQL subscriptions before it closes connections"""
+
+    async def shutdown(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        from app.events.pubsub import pubsub
+
+        # Stop accepting first, so that clients resubscribe elsewhere
+        for server in self.servers:
+            server.close()
+        remaining = await pubsub.drain(self.config.timeout_graceful_shutdown or 0)
+        if remaining:
+            print(
+                f"Worker {os.getpid()}: {remaining} subscriptions did not drain in time"
+            )
+        await super().shutdown(sockets)
+
+
+def run_worker(
+    index: int,
+    sock: socket.socket,
+    broker: Broker,
+    relay: socket.socket,
+    args: argparse.Namespace,
+) -> None:
+    """Body of a forked worker; exits the process instead of returning"""
+    code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        broker.close_in_worker()
+        # Otherwise every worker draws the same random numbers
+        random.seed()
+        # Swap in new pools without closing the parent's connections
+        for shard_engine in shards.engines.values():
+            shard_engine.sync_engine.dispose(close=False)
+        if index > 0:
+            # Archival, the reminder window and job pruning need one worker only
+            settings.PERIODIC_JOBS = False
+
+        from app.events.pubsub import pubsub
+        from app.main import app
+
+        pubsub.relay = relay
+
+        config = uvicorn.Config(
+            app,
+            log_level=args.log_level,
+            timeout_graceful_shutdown=args.graceful_timeout,
+        )
+        DrainingServer(config).run(sockets=[sock])
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def serve(args: argparse.Namespace) -> int:
+    """Prepare once, fork the workers and supervise them; returns the exit status"""
+    asyncio.run(prepare(args.seed))
+
+    # Import the app and its dependencies once, for the workers to share.
+    # The OpenAI SDK module is preloaded too, but not its client, whose
+    # connections must belong to one process.
+    from app.main import app  # noqa: F401
+
+    if settings.SUGGESTION_ROUTING != "local":
+        import openai  # noqa: F401
+
+    sock = socket.create_server((args.host, args.port), backlog=2048)
+    sock.set_inheritable(True)
+    broker = Broker()
+    broker.start()
+
+    # pid -> (worker index, start time)
+    workers: Dict[int, Tuple[int, float]] = {}
+    stopping = False
+    status = 0
+
+    def spawn(index: int) -> None:
+        relay = broker.connect()
+        pid = os.fork()
+        if pid == 0:
+            run_worker(index, sock, broker, relay, args)
+        relay.close()
+        workers[pid] = (index, time.monotonic())
+
+    def signal_workers(signum: int) -> None:
+        for pid in workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(signum: Optional[int] = None, frame: object = None) -> None:
+        nonlocal stopping
+        if not stopping:
+            stopping = True
+            signal_workers(signal.SIGTERM)
+            # Draining and then finishing requests each get the graceful timeout
+            signal.alarm(args.graceful_timeout * 2 + 5)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGALRM, lambda signum, frame: signal_workers(signal.SIGKILL))
+
+    for index in range(args.workers):
+        spawn(index)
+    print(
+        f"Serving on http://{args.host}:{args.port} with {args.workers} workers "
+        f"(pid {os.getpid()})"
+    )
+
+    while workers:
+        try:
+            pid, wait_status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = workers.pop(pid)
+        if stopping:
+            continue
+        code = os.waitstatus_to_exitcode(wait_status)
+        if time.monotonic() - started < MIN_WORKER_UPTIME_SECONDS:
+            print(f"Worker {index} exited with {code} while starting; shutting down")
+            status = 1
+            stop()
+        else:
+            print(f"Worker {index} exited with {code}; replacing it")
+            spawn(index)
+    sock.close()
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the app from pre-forked uvicorn workers"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.SERVER_WORKERS or available_cpus(),
+        help="Worker processes (default: SERVER_WORKERS, or one per available CPU)",
+    )
+    parser.add_argument(
+        "--seed", action="store_true", help="Also add the demo user and sample todos"
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=settings.SERVER_GRACEFUL_TIMEOUT_SECONDS,
+        help="Seconds to drain subscriptions, and then to finish requests, on shutdown",
+    )
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    sys.exit(serve(args))
@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import ArchivedTodo, Todo, TodoStatus, todo_tags
+from app.db.sharding import shards
+from app.services.embeddings import EmbeddingService, vector_index
+from app.services.ranking import key_between
+from app.services.reminders import due_reminders
+from app.services.todo import TodoService, retry_rank_conflicts
+
+
+class ArchiveService:
+    """Service for moving completed todos out of the hot todos table"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def archive_completed(
+        self,
+        older_than_days: int,
+        batch_size: int = 500,
+        skip_users: Sequence[int] = (),
+    ) -> int:
+        """
+        Move todos completed more than older_than_days ago into archived_todos,
+        except those of skip_users. Each batch is copied and deleted in its own
+        transaction.
+        """
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        archived = 0
+
+        while True:
+            query = select(Todo).filter(
+                Todo.status == TodoStatus.COMPLETED, Todo.completed_at < cutoff
+            )
+            if skip_users:
+                query = query.filter(Todo.user_id.notin_(skip_users))
+            result = await self.db.execute(
+                query.order_by(Todo.completed_at).limit(batch_size)
+            )
+            todos = list(result.scalars().all())
+            if not todos:
+                break
+
+            todo_ids = [todo.id for todo in todos]
+            await self.db.execute(
+                insert(ArchivedTodo),
+                [
+                    {
+                        "todo_id": todo.id,
+                        "title": todo.title,
+                        "description": todo.description,
+                        "priority": todo.priority,
+                        "due_date": todo.due_date,
+                        "user_id": todo.user_id,
+                        "is_ai_generated": todo.is_ai_generated,
+                        "tags": [tag.name for tag in todo.tags],
+                        "created_at": todo.created_at,
+                        "updated_at": todo.updated_at,
+                        "completed_at": todo.completed_at,
+                    }
+                    for todo in todos
+                ],
+            )
+            await self.db.execute(
+                delete(todo_tags).where(todo_tags.c.todo_id.in_(todo_ids))
+            )
+            await EmbeddingService(self.db).delete(todo_ids)
+            await self.db.execute(
+                delete(Todo)
+                .where(Todo.id.in_(todo_ids))
+                .execution_options(synchronize_session=False)
+            )
+            await self.db.commit()
+            self.db.expunge_all()
+            for todo in todos:
+                vector_index.remove(todo.user_id, [todo.id])
+
+            archived += len(todos)
+            if len(todos) < batch_size:
+                break
+
+        return archived
+
+    async def get_archived_todos(
+        self, user_id: int, skip: int = 0, limit: int = 100
+    ) -> List[ArchivedTodo]:
+        """Get archived todos for a user, most recently completed first"""
+        query = (
+            select(ArchivedTodo)
+            .filter(ArchivedTodo.user_id == user_id)
+            .order_by(ArchivedTodo.completed_at.desc())
+            .offset(skip)
+            .limit(limit)
+        )
+        result = await self.db.execute(query)
+        return list(result.scalars().all())
+
+    async def unarchive_todo(self, archived_id: int, user_id: int) -> Optional[Todo]:
+        """
+        Move an archived todo back into the todos table.
+        It is reopened as pending, gets a new ID and goes to the end of the
+        manual order.
+        """
+
+        async def restore() -> Tuple[Optional[Todo], Optional[np.ndarray]]:
+            result = await self.db.execute(
+                select(ArchivedTodo).filter(
+                    ArchivedTodo.id == archived_id, ArchivedTodo.user_id == user_id
+                )
+            )
+            archived = result.scalars().first()
+            if not archived:
+                return None, None
+
+            todo_service = TodoService(self.db)
+            todo = Todo(
+                user_id=user_id,
+                title=archived.title,
+                description=archived.description,
+                status=TodoStatus.PENDING,
+                priority=archived.priority,
+                due_date=archived.due_date,
+                is_ai_generated=archived.is_ai_generated,
+                created_at=archived.created_at,
+                tags=await todo_service.get_or_create_tags(
+                    user_id, archived.tags or []
+                ),
+                rank=key_between(await todo_service.get_last_rank(user_id), None),
+            )
+            self.db.add(todo)
+            await self.db.delete(archived)
+            await self.db.flush()
+            vector = await EmbeddingService(self.db).stage(todo, created=True)
+            await self.db.commit()
+            return todo, vector
+
+        todo, vector = await retry_rank_conflicts(self.db, restore)
+        if not todo:
+            return None
+        await self.db.refresh(todo)
+        vector_index.upsert(user_id, todo.id, vector)
+        due_reminders.todo_changed(todo)
+        return todo
+
+
+async def run_archival(
+    older_than_days: Optional[int] = None, batch_size: Optional[int] = None
+) -> int:
+    """Archive completed todos on every shard using the configured age and batch size"""
+    archived = 0
+    for sessionmaker in shards.sessionmakers.values():
+        async with sessionmaker() as session:
+            archived += await ArchiveService(session).archive_completed(
+                older_than_days=(
+                    older_than_days
+                    if older_than_days is not None
+                    else settings.ARCHIVE_AFTER_DAYS
+                ),
+                batch_size=batch_size or settings.ARCHIVE_BATCH_SIZE,
+                # Their rows are being copied to another shard
+                skip_users=shards.moving_users(),
+            )
+    return archived
+
+
+async def archive_periodically(interval_seconds: int) -> None:
+    """Run the archival job forever, every interval_seconds"""
+    while True:
+        try:
+            archived = await run_archival()
+            if archived:
+                print(f"Archived {archived} completed todos")
+        except Exception as e:
+            print(f"Archival failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old completed todos")
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=None,
+        help="Archive todos completed more than N days ago",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="Number of todos moved per transaction",
+    )
+    args = parser.parse_args()
+
+    count = asyncio.run(run_archival(args.days, args.batch_size))
+    print(f"Archived {count} completed todos.")
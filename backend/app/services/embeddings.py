@@ -0,0 +1,395 @@
+"""
+Local text embeddings and per-user vector indexes for related todos.
+
+Vectors are stored as float16 in todo_embeddings. Each user's vectors are
+loaded once into an in-memory float32 matrix, kept up to date by
+TodoService, and searched with NumPy dot products.
+"""
+import asyncio
+import re
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import and_, delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import Todo, TodoEmbedding
+from app.db.sharding import shards
+from app.services.local_suggestions import STOP_WORDS
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Todos read, embedded and written per transaction when an index is
+# backfilled; each batch is embedded in a worker thread
+BACKFILL_BATCH_SIZE = 500
+
+
+class Embedder(ABC):
+    """Turns texts into unit-length vectors on the CPU"""
+
+    name: str
+    dimension: int
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed texts as a (len(texts), dimension) float32 array of unit vectors"""
+
+
+@lru_cache(maxsize=65536)
+def _hashed_feature(feature: str, dimension: int) -> Tuple[int, float]:
+    """Column and sign of a feature. crc32 is stable across processes, unlike hash()"""
+    value = zlib.crc32(feature.encode())
+    return value % dimension, 1.0 if value & 0x80000000 else -1.0
+
+
+class HashingEmbedder(Embedder):
+    """
+    Signed feature hashing of words, word bigrams and character trigrams.
+    Trigrams make inflections like "proposal" and "proposals" overlap.
+    """
+
+    def __init__(self, dimension: int = 128):
+        self.dimension = dimension
+        # Version 2 splits words on any Unicode letter or digit, not just
+        # ASCII ones; vectors of version 1 are re-embedded by the backfill
+        self.name = f"hashing-v2-{dimension}"
+
+    def features(self, text: str) -> List[Tuple[str, float]]:
+        """Weighted features of a text"""
+        words = [
+            word
+            for word in _WORD_PATTERN.findall(text.lower())
+            if word not in STOP_WORDS
+        ]
+        features = [(word, 1.0) for word in words]
+        features += [(f"{a} {b}", 0.5) for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [(f"#{padded[i:i + 3]}", 1.0) for i in range(len(padded) - 2)]
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed texts by summing signed, hashed feature weights"""
+        rows: List[int] = []
+        columns: List[int] = []
+        weights: List[float] = []
+        for row, text in enumerate(texts):
+            for feature, weight in self.features(text):
+                column, sign = _hashed_feature(feature, self.dimension)
+                rows.append(row)
+                columns.append(column)
+                weights.append(sign * weight)
+
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(vectors, (rows, columns), weights)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+# Embedders selectable with the EMBEDDER setting, by name
+EMBEDDERS = {"hashing": HashingEmbedder}
+
+
+@lru_cache(maxsize=1)
+def get_embedder() -> Embedder:
+    """The configured embedder"""
+    return EMBEDDERS[settings.EMBEDDER](dimension=settings.EMBEDDING_DIMENSION)
+
+
+def todo_text(title: str, description: Optional[str]) -> str:
+    """The text of a todo that gets embedded"""
+    return f"{title}\n{description}" if description else title
+
+
+def encode_vector(vector: np.ndarray) -> bytes:
+    """Pack a vector for the todo_embeddings table"""
+    return vector.astype(np.float16).tobytes()
+
+
+class UserVectorIndex:
+    """
+    One user's vectors as rows of a float32 matrix. Rows are appended in
+    amortized constant time and removed by moving the last row into the gap.
+    """
+
+    def __init__(
+        self,
+        dimension: int,
+        ids: Sequence[int] = (),
+        vectors: Optional[np.ndarray] = None,
+    ):
+        capacity = max(16, len(ids))
+        self.dimension = dimension
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self.size = len(ids)
+        if self.size:
+            self.ids[: self.size] = ids
+            self.vectors[: self.size] = vectors
+        self.positions: Dict[int, int] = {
+            int(todo_id): row for row, todo_id in enumerate(ids)
+        }
+        self.loaded_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def get(self, todo_id: int) -> Optional[np.ndarray]:
+        """The vector of a todo, if indexed"""
+        row = self.positions.get(todo_id)
+        return None if row is None else self.vectors[row]
+
+    def upsert(self, todo_id: int, vector: np.ndarray) -> None:
+        """Add or replace a todo's vector"""
+        row = self.positions.get(todo_id)
+        if row is None:
+            if self.size == len(self.ids):
+                self.ids = np.resize(self.ids, 2 * self.size)
+                self.vectors = np.resize(self.vectors, (2 * self.size, self.dimension))
+            row = self.size
+            self.size += 1
+            self.positions[todo_id] = row
+            self.ids[row] = todo_id
+        self.vectors[row] = vector
+
+    def remove(self, todo_id: int) -> None:
+        """Remove a todo's vector, if indexed"""
+        row = self.positions.pop(todo_id, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            moved = int(self.ids[last])
+            self.ids[row] = moved
+            self.vectors[row] = self.vectors[last]
+            self.positions[moved] = row
+        self.size = last
+
+    def search(
+        self, queries: np.ndarray, k: int, exclude: Iterable[int] = ()
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Top k todos by cosine similarity for each row of queries, best first.
+        All queries are scored against all vectors in one matrix product.
+        """
+        queries = np.atleast_2d(queries).astype(np.float32, copy=False)
+        if not self.size or k <= 0:
+            return [[] for _ in queries]
+
+        excluded = {int(todo_id) for todo_id in exclude}
+        scores = self.vectors[: self.size] @ queries.T
+        take = min(self.size, k + len(excluded))
+        results = []
+        for column in scores.T:
+            top = (
+                np.argpartition(column, -take)[-take:]
+                if take < self.size
+                else np.arange(self.size)
+            )
+            top = top[np.argsort(-column[top])]
+            matches = [
+                (int(self.ids[row]), float(column[row]))
+                for row in top
+                if int(self.ids[row]) not in excluded
+            ]
+            results.append(matches[:k])
+        return results
+
+
+class VectorIndex:
+    """
+    Per-user vector indexes, loaded lazily from todo_embeddings and kept for
+    the most recently used users
+    """
+
+    def __init__(self, max_users: int, ttl_seconds: float):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.indexes: "OrderedDict[int, UserVectorIndex]" = OrderedDict()
+        self.locks: Dict[int, asyncio.Lock] = {}
+
+    def _fresh(self, user_id: int) -> Optional[UserVectorIndex]:
+        """A user's loaded index, unless it has outlived the TTL"""
+        index = self.indexes.get(user_id)
+        if index is None or time.monotonic() - index.loaded_at > self.ttl_seconds:
+            return None
+        self.indexes.move_to_end(user_id)
+        return index
+
+    async def get(self, db: AsyncSession, user_id: int) -> UserVectorIndex:
+        """Get a user's index, loading it if needed"""
+        index = self._fresh(user_id)
+        if index is not None:
+            return index
+
+        lock = self.locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            index = self._fresh(user_id)
+            if index is None:
+                index = await EmbeddingService(db).load_index(user_id)
+                self.indexes[user_id] = index
+                self.indexes.move_to_end(user_id)
+                while len(self.indexes) > self.max_users:
+                    self.indexes.popitem(last=False)
+        self.locks.pop(user_id, None)
+        return index
+
+    def upsert(self, user_id: int, todo_id: int, vector: np.ndarray) -> None:
+        """Update a todo's vector in its user's index, if loaded"""
+        index = self.indexes.get(user_id)
+        if index is not None:
+            index.upsert(todo_id, vector)
+
+    def remove(self, user_id: int, todo_ids: Iterable[int]) -> None:
+        """Drop todos from their user's index, if loaded"""
+        index = self.indexes.get(user_id)
+        if index is not None:
+            for todo_id in todo_ids:
+                index.remove(todo_id)
+
+    def invalidate(self, user_id: int) -> None:
+        """Forget a user's index, e.g. after todos were written in bulk"""
+        self.indexes.pop(user_id, None)
+
+
+vector_index = VectorIndex(
+    max_users=settings.VECTOR_INDEX_MAX_USERS,
+    ttl_seconds=settings.VECTOR_INDEX_TTL_SECONDS,
+)
+# A moved user's todos have new IDs
+shards.move_listeners.append(vector_index.invalidate)
+
+
+class EmbeddingService:
+    """Service for storing todo embeddings and finding related todos"""
+
+    def __init__(self, db: AsyncSession, embedder: Optional[Embedder] = None):
+        self.db = db
+        self.embedder = embedder or get_embedder()
+
+    async def stage(self, todo: Todo, created: bool = False) -> np.ndarray:
+        """
+        Embed a flushed todo and add or update its todo_embeddings row in the
+        current transaction. Returns the vector for the in-memory index.
+        """
+        vector = self.embedder.embed([todo_text(todo.title, todo.description)])[0]
+        embedding = None if created else await self.db.get(TodoEmbedding, todo.id)
+        if embedding is None:
+            embedding = TodoEmbedding(todo_id=todo.id)
+            self.db.add(embedding)
+        embedding.model = self.embedder.name
+        embedding.vector = encode_vector(vector)
+        return vector
+
+    async def delete(self, todo_ids: Sequence[int]) -> None:
+        """Delete the embeddings of todos in the current transaction"""
+        await self.db.execute(
+            delete(TodoEmbedding).where(TodoEmbedding.todo_id.in_(todo_ids))
+        )
+
+    async def load_index(self, user_id: int) -> UserVectorIndex:
+        """
+        Build a user's index from stored vectors, embedding any todos that
+        lack one
+        """
+        await self.backfill(user_id)
+        result = await self.db.execute(
+            select(TodoEmbedding.todo_id, TodoEmbedding.vector)
+            .join(Todo, Todo.id == TodoEmbedding.todo_id)
+            .filter(Todo.user_id == user_id, TodoEmbedding.model == self.embedder.name)
+        )
+        rows = result.all()
+        dimension = self.embedder.dimension
+        if not rows:
+            return UserVectorIndex(dimension)
+
+        vectors = np.frombuffer(b"".join(row.vector for row in rows), dtype=np.float16)
+        return UserVectorIndex(
+            dimension,
+            ids=[row.todo_id for row in rows],
+            vectors=vectors.reshape(len(rows), dimension).astype(np.float32),
+        )
+
+    async def backfill(self, user_id: int) -> int:
+        """
+        Embed a user's todos that have no vector from the current embedder,
+        such as imported todos or ones stored before the embedder changed.
+        Todos are read and embedded in batches, off the event loop, so that a
+        large backfill neither holds them all in memory nor stalls other
+        requests.
+        """
+        loop = asyncio.get_running_loop()
+        backfilled = 0
+        last_id = 0
+        while True:
+            result = await self.db.execute(
+                select(Todo.id, Todo.title, Todo.description)
+                .outerjoin(
+                    TodoEmbedding,
+                    and_(
+                        TodoEmbedding.todo_id == Todo.id,
+                        TodoEmbedding.model == self.embedder.name,
+                    ),
+                )
+                .filter(
+                    Todo.user_id == user_id,
+                    Todo.id > last_id,
+                    TodoEmbedding.todo_id.is_(None),
+                )
+                .order_by(Todo.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            )
+            batch = result.all()
+            if not batch:
+                return backfilled
+
+            vectors = await loop.run_in_executor(
+                None,
+                self.embedder.embed,
+                [todo_text(row.title, row.description) for row in batch],
+            )
+            await self.delete([row.id for row in batch])
+            await self.db.execute(
+                insert(TodoEmbedding),
+                [
+                    {
+                        "todo_id": row.id,
+                        "model": self.embedder.name,
+                        "vector": encode_vector(vector),
+                    }
+                    for row, vector in zip(batch, vectors)
+                ],
+            )
+            await self.db.commit()
+            backfilled += len(batch)
+            last_id = batch[-1].id
+
+    async def related_todos(
+        self, todo_id: int, user_id: int, k: int = 10, min_score: Optional[float] = None
+    ) -> List[Todo]:
+        """Get up to k of the user's todos most similar to a todo, best first"""
+        min_score = settings.RELATED_TODOS_MIN_SCORE if min_score is None else min_score
+        index = await vector_index.get(self.db, user_id)
+        query = index.get(todo_id)
+        if query is None:
+            return []
+
+        matches = [
+            match_id
+            for match_id, score in index.search(query, k, exclude=[todo_id])[0]
+            if score >= min_score
+        ]
+        if not matches:
+            return []
+
+        result = await self.db.execute(
+            select(Todo).filter(Todo.user_id == user_id, Todo.id.in_(matches))
+        )
+        todos = {todo.id: todo for todo in result.scalars().all()}
+        return [todos[match_id] for match_id in matches if match_id in todos]
@@ -0,0 +1,470 @@
+import asyncio
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from enum import Enum as PyEnum
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.metrics import SUGGESTION_QUEUE_DEPTH
+from app.db.models import SuggestionJobRecord
+from app.db.sharding import shards
+from app.events.pubsub import PubSubManager, pubsub
+from app.services.llm import (
+    SuggestionError,
+    SuggestionErrorCode,
+    SuggestionResult,
+    SuggestionRouter,
+    build_suggestion_request,
+)
+from app.services.reminders import utc_naive
+
+
+class JobStatus(str, PyEnum):
+    """Suggestion job status enumeration"""
+
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
+
+
+ACTIVE_STATUSES = [JobStatus.QUEUED.value, JobStatus.RUNNING.value]
+FINISHED_STATUSES = {JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED}
+
+# Finished jobs are deleted within this long after their TTL expires
+PRUNE_INTERVAL_SECONDS = 60
+
+# How often the queued jobs of all processes are counted for the metrics
+QUEUE_DEPTH_INTERVAL_SECONDS = 15
+
+# A worker waits this long after a job fails outside the suggestion, doubling
+# with each failure in a row, e.g. while the database is unreachable
+WORKER_BACKOFF_SECONDS = 0.5
+WORKER_MAX_BACKOFF_SECONDS = 30.0
+
+# IDs of cancelled jobs, for the process running each to stop it
+CANCELLATIONS_CHANNEL = "suggestion-jobs:cancelled"
+
+
+def job_channel(job_id: str) -> str:
+    """Pub/Sub channel carrying a suggestion job's status updates"""
+    return f"suggestion-job:{job_id}"
+
+
+class SuggestionQueueFullError(RuntimeError):
+    """Raised when the suggestion job queue is at capacity"""
+
+
+@dataclass
+class SuggestionJob:
+    """A queued or running AI suggestion request"""
+
+    id: str
+    user_id: int
+    status: JobStatus = JobStatus.QUEUED
+    suggestion: Optional[str] = None
+    error: Optional[SuggestionError] = None
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @classmethod
+    def from_record(cls, record: SuggestionJobRecord) -> "SuggestionJob":
+        """A job as stored in the database"""
+        return cls(
+            id=record.id,
+            user_id=record.user_id,
+            status=JobStatus(record.status),
+            suggestion=record.suggestion,
+            error=(
+                SuggestionError(
+                    SuggestionErrorCode(record.error_code), record.error_message or ""
+                )
+                if record.error_code
+                else None
+            ),
+            created_at=utc_naive(record.created_at),
+            finished_at=utc_naive(record.finished_at) if record.finished_at else None,
+        )
+
+    @property
+    def is_finished(self) -> bool:
+        """Check if the job reached a final status"""
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def channel_id(self) -> str:
+        """Pub/Sub channel carrying this job's status updates"""
+        return job_channel(self.id)
+
+
+class SuggestionJobQueue:
+    """
+    Bounded queue of suggestion jobs drained by a fixed pool of workers.
+
+    Jobs are stored in the suggestion_jobs table on the user's shard, so that
+    every app process can look one up, subscribe to it or cancel it, and run
+    in the process that queued them. Each user has at most one queued or
+    running job at a time, across processes; enqueueing again returns the
+    existing job. Status changes are published on the job's Pub/Sub
+    channel, which reaches every app.server worker. A job still queued or
+    running after the result TTL was left behind by a process that exited
+    and is failed; finished jobs are deleted after the TTL, by the process
+    running the periodic jobs.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_size: int,
+        result_ttl_seconds: int,
+        pubsub_manager: PubSubManager,
+    ):
+        self.worker_count = workers
+        self.result_ttl = timedelta(seconds=result_ttl_seconds)
+        self.pubsub = pubsub_manager
+        self.max_size = max_size
+        # Created in start() so it binds to the running event loop
+        self.queue: Optional["asyncio.Queue[str]"] = None
+        # Jobs queued in this process and not finished yet
+        self.jobs: Dict[str, SuggestionJob] = {}
+        # Jobs queued in the database, as last counted
+        self.queued_count = 0
+        self._workers: List[asyncio.Task] = []
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker in this process"""
+        return self.queue.qsize() if self.queue is not None else 0
+
+    @property
+    def running(self) -> int:
+        """Number of jobs currently being processed in this process"""
+        return sum(1 for job in self.jobs.values() if job.status == JobStatus.RUNNING)
+
+    async def start(self, prune: bool = True) -> None:
+        """Start the worker pool, and with prune, the deletion of expired jobs"""
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.max_size)
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._worker()) for _ in range(self.worker_count)
+            ]
+            self._tasks = [
+                asyncio.create_task(self._listen_for_cancellations()),
+                asyncio.create_task(self._count_queued_periodically()),
+            ]
+            if prune:
+                self._tasks.append(asyncio.create_task(self._prune_periodically()))
+
+    async def stop(self) -> None:
+        """Stop the worker pool, cancelling running and queued jobs"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job in list(self.jobs.values()):
+            await self._finish(job, JobStatus.CANCELLED)
+
+    async def enqueue(self, user_id: int) -> SuggestionJob:
+        """Queue a suggestion job for a user, or return the one already pending"""
+        if self.queue is None:
+            raise RuntimeError("The suggestion job queue is not running")
+        if self.queue.full():
+            raise SuggestionQueueFullError(
+                "Too many pending suggestion jobs, try again later"
+            )
+
+        job = SuggestionJob(id=uuid.uuid4().hex, user_id=user_id)
+        async with shards.session(user_id) as session:
+            active = await self._active(session, user_id)
+            if active is not None:
+                return active
+            session.add(
+                SuggestionJobRecord(
+                    id=job.id,
+                    user_id=user_id,
+                    status=job.status.value,
+                    created_at=job.created_at,
+                )
+            )
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Another process queued one for the user meanwhile
+                await session.rollback()
+                active = await self._active(session, user_id)
+                if active is None:
+                    raise
+                return active
+
+        try:
+            self.queue.put_nowait(job.id)
+        except asyncio.QueueFull:
+            # Filled up by other requests during the insert
+            async with shards.session(user_id) as session:
+                await session.execute(delete(SuggestionJobRecord).filter_by(id=job.id))
+                await session.commit()
+            raise SuggestionQueueFullError(
+                "Too many pending suggestion jobs, try again later"
+            )
+        self.jobs[job.id] = job
+        return job
+
+    async def get(self, job_id: str, user_id: int) -> Optional[SuggestionJob]:
+        """Get a job by ID for a user"""
+        async with shards.session(user_id) as session:
+            record = await session.get(SuggestionJobRecord, job_id)
+        if record is None or record.user_id != user_id:
+            return None
+        return SuggestionJob.from_record(record)
+
+    async def cancel(self, job_id: str, user_id: int) -> Optional[SuggestionJob]:
+        """Cancel a queued or running job, whichever process runs it"""
+        job = await self.get(job_id, user_id)
+        if job is None or job.is_finished:
+            return job
+
+        job.status = JobStatus.CANCELLED
+        job.finished_at = datetime.utcnow()
+        if await self._save_finished(job):
+            # Stops the job in the process running it
+            await self.pubsub.publish(CANCELLATIONS_CHANNEL, job.id)
+        return await self.get(job_id, user_id)
+
+    async def _active(
+        self, session: AsyncSession, user_id: int
+    ) -> Optional[SuggestionJob]:
+        """A user's queued or running job, failing it if it was left behind"""
+        record = (
+            await session.execute(
+                select(SuggestionJobRecord).filter(
+                    SuggestionJobRecord.user_id == user_id,
+                    SuggestionJobRecord.status.in_(ACTIVE_STATUSES),
+                )
+            )
+        ).scalar_one_or_none()
+        if record is None:
+            return None
+        job = SuggestionJob.from_record(record)
+        if job.created_at >= datetime.utcnow() - self.result_ttl:
+            return job
+        await self._abandon(job)
+        return None
+
+    async def _worker(self) -> None:
+        """
+        Process jobs from the queue one at a time. A job that fails outside
+        the suggestion itself, e.g. as its shard is unreachable or its user
+        is moving, is dropped here and failed by the pruning as left behind;
+        the worker backs off and carries on.
+        """
+        failures = 0
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._process(job_id)
+                failures = 0
+            except Exception as e:
+                self.jobs.pop(job_id, None)
+                failures += 1
+                print(f"Suggestion job {job_id} failed: {e!r}")
+                backoff = WORKER_BACKOFF_SECONDS * 2 ** (failures - 1)
+                await asyncio.sleep(min(backoff, WORKER_MAX_BACKOFF_SECONDS))
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, job_id: str) -> None:
+        """Claim a queued job, generate its suggestion and store the result"""
+        job = self.jobs.get(job_id)
+        # Skip jobs cancelled while waiting in the queue
+        if job is None or job.is_finished:
+            return
+        if not await self._claim(job):
+            # Cancelled, or failed as left behind, through the database
+            del self.jobs[job_id]
+            return
+
+        await self._publish(job)
+        job.task = asyncio.create_task(self._generate(job.user_id))
+        try:
+            result = await job.task
+        except asyncio.CancelledError:
+            if job.status != JobStatus.CANCELLED:
+                # The worker itself is shutting down
+                await self._finish(job, JobStatus.CANCELLED)
+                raise
+            return
+        except Exception as e:
+            job.error = SuggestionError(SuggestionErrorCode.INTERNAL_ERROR, str(e))
+            await self._finish(job, JobStatus.FAILED)
+            return
+
+        job.suggestion = result.suggestion
+        job.error = result.error
+        await self._finish(
+            job, JobStatus.FAILED if result.error else JobStatus.SUCCEEDED
+        )
+
+    async def _generate(self, user_id: int) -> SuggestionResult:
+        """
+        Generate a suggestion. The database session is only held while the
+        context todos are read, not during the LLM call.
+        """
+        async with shards.session(user_id) as session:
+            request = await build_suggestion_request(session, user_id)
+
+        return await SuggestionRouter().suggest(request)
+
+    async def _claim(self, job: SuggestionJob) -> bool:
+        """Mark a queued job as running; False if it is not queued anymore"""
+        async with shards.session(job.user_id) as session:
+            result = await session.execute(
+                update(SuggestionJobRecord)
+                .filter_by(id=job.id, status=JobStatus.QUEUED.value)
+                .values(status=JobStatus.RUNNING.value)
+            )
+            await session.commit()
+        if result.rowcount:
+            job.status = JobStatus.RUNNING
+        return bool(result.rowcount)
+
+    async def _finish(self, job: SuggestionJob, status: JobStatus) -> bool:
+        """Move a job to a final status and notify subscribers"""
+        job.status = status
+        job.finished_at = datetime.utcnow()
+        job.task = None
+        self.jobs.pop(job.id, None)
+        return await self._save_finished(job)
+
+    async def _save_finished(self, job: SuggestionJob) -> bool:
+        """
+        Store a job's final status and publish it; False if it had finished
+        already, e.g. cancelled through another process
+        """
+        async with shards.session(job.user_id) as session:
+            result = await session.execute(
+                update(SuggestionJobRecord)
+                .filter(
+                    SuggestionJobRecord.id == job.id,
+                    SuggestionJobRecord.status.in_(ACTIVE_STATUSES),
+                )
+                .values(
+                    status=job.status.value,
+                    suggestion=job.suggestion,
+                    error_code=job.error.code.value if job.error else None,
+                    error_message=job.error.message if job.error else None,
+                    finished_at=job.finished_at,
+                )
+            )
+            await session.commit()
+        if not result.rowcount:
+            return False
+        await self._publish(job)
+        await self.pubsub.close_channel(job.channel_id)
+        return True
+
+    async def _abandon(self, job: SuggestionJob) -> None:
+        """Fail a job that its process left behind"""
+        job.error = SuggestionError(
+            SuggestionErrorCode.INTERNAL_ERROR, "The job was not finished in time"
+        )
+        await self._finish(job, JobStatus.FAILED)
+
+    async def _publish(self, job: SuggestionJob) -> None:
+        """Publish a job's current status on its channel"""
+        await self.pubsub.publish(job.channel_id, job.status.value)
+
+    async def _listen_for_cancellations(self) -> None:
+        """Stop the jobs of this process that were cancelled, here or elsewhere"""
+        async for job_id in self.pubsub.subscribe(CANCELLATIONS_CHANNEL):
+            job = self.jobs.pop(job_id, None)
+            if job is None:
+                continue
+            job.status = JobStatus.CANCELLED
+            if job.task is not None:
+                job.task.cancel()
+
+    async def _prune(self) -> None:
+        """
+        Delete finished jobs older than the result TTL and fail the ones left
+        behind
+        """
+        cutoff = datetime.utcnow() - self.result_ttl
+        for sessionmaker in shards.sessionmakers.values():
+            async with sessionmaker() as session:
+                await session.execute(
+                    delete(SuggestionJobRecord).filter(
+                        SuggestionJobRecord.status.not_in(ACTIVE_STATUSES),
+                        SuggestionJobRecord.finished_at < cutoff,
+                    )
+                )
+                await session.commit()
+                left_behind = (
+                    (
+                        await session.execute(
+                            select(SuggestionJobRecord).filter(
+                                SuggestionJobRecord.status.in_(ACTIVE_STATUSES),
+                                SuggestionJobRecord.created_at < cutoff,
+                            )
+                        )
+                    )
+                    .scalars()
+                    .all()
+                )
+            for record in left_behind:
+                await self._abandon(SuggestionJob.from_record(record))
+
+    async def _count_queued(self) -> int:
+        """Count the jobs waiting for a worker on every shard"""
+        total = 0
+        for sessionmaker in shards.sessionmakers.values():
+            async with sessionmaker() as session:
+                total += (
+                    await session.execute(
+                        select(func.count())
+                        .select_from(SuggestionJobRecord)
+                        .filter(SuggestionJobRecord.status == JobStatus.QUEUED.value)
+                    )
+                ).scalar_one()
+        return total
+
+    async def _count_queued_periodically(self) -> None:
+        """Keep queued_count current without querying on every metrics scrape"""
+        while True:
+            try:
+                self.queued_count = await self._count_queued()
+            except Exception as e:
+                print(f"Counting queued suggestion jobs failed: {e}")
+            await asyncio.sleep(QUEUE_DEPTH_INTERVAL_SECONDS)
+
+    async def _prune_periodically(self) -> None:
+        """Prune whether or not jobs keep being enqueued"""
+        interval = min(self.result_ttl.total_seconds(), PRUNE_INTERVAL_SECONDS)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._prune()
+            except Exception as e:
+                print(f"Pruning suggestion jobs failed: {e}")
+
+
+# Shared queue for the application process, started from the app lifespan
+suggestion_jobs = SuggestionJobQueue(
+    workers=settings.SUGGESTION_WORKERS,
+    max_size=settings.SUGGESTION_QUEUE_SIZE,
+    result_ttl_seconds=settings.SUGGESTION_JOB_TTL_SECONDS,
+    pubsub_manager=pubsub,
+)
+
+SUGGESTION_QUEUE_DEPTH.set_function(lambda: suggestion_jobs.queued_count)
@@ -1,75 +1,326 @@
-import httpx
-from typing import List, Optional
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, replace
+from enum import Enum as PyEnum
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Sequence
 
-from openai import AsyncOpenAI
 from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.db.models import Todo
+from app.core.metrics import LLM_REQUEST_DURATION, LLM_TOKENS, PROMPT_TOKENS
+from app.services.local_suggestions import LocalSuggestionEngine
+from app.services.prompt_context import (
+    ContextTodo,
+    PromptContextBuilder,
+    count_tokens,
+    format_context_line,
+)
+from app.services.resilience import CircuitBreaker, Deadline, hedged
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 
 class TodoSuggestion(BaseModel):
     """Model for OpenAI API to generate structured todo suggestions"""
+
     title: str = Field(..., description="The title of the todo item")
-    description: Optional[str] = Field(None, description="A detailed description of the todo")
+    description: Optional[str] = Field(
+        None, description="A detailed description of the todo"
+    )
     priority: int = Field(
         1, description="Priority from 1 (lowest) to 3 (highest)", ge=1, le=3
     )
 
 
-class LLMService:
+class SuggestionErrorCode(str, PyEnum):
+    """Reasons a suggestion could not be generated"""
+
+    TIMEOUT = "TIMEOUT"
+    CIRCUIT_OPEN = "CIRCUIT_OPEN"
+    RATE_LIMITED = "RATE_LIMITED"
+    UPSTREAM_ERROR = "UPSTREAM_ERROR"
+    INVALID_RESPONSE = "INVALID_RESPONSE"
+    INTERNAL_ERROR = "INTERNAL_ERROR"
+
+
+@dataclass
+class SuggestionError:
+    """Structured error for a failed suggestion"""
+
+    code: SuggestionErrorCode
+    message: str
+
+
+@dataclass
+class SuggestionResult:
+    """Outcome of a suggestion request: either a suggestion or an error"""
+
+    suggestion: Optional[str] = None
+    error: Optional[SuggestionError] = None
+    # How sure the backend is of the suggestion, from 0 to 1, if it can tell
+    confidence: Optional[float] = None
+
+    @classmethod
+    def failure(cls, code: SuggestionErrorCode, message: str) -> "SuggestionResult":
+        """Create a failed result"""
+        return cls(error=SuggestionError(code=code, message=message))
+
+
+@dataclass
+class SuggestionRequest:
+    """A user's recent todos, and the part of them selected as prompt context"""
+
+    user_id: int
+    history: Sequence[ContextTodo]
+    context: Sequence[ContextTodo]
+    # A suggestion for the LLM to refine, e.g. one from the local engine
+    draft: Optional[str] = None
+
+
+async def build_suggestion_request(db: AsyncSession, user_id: int) -> SuggestionRequest:
+    """Read the todos any suggestion backend needs, in a single query"""
+    builder = PromptContextBuilder(db)
+    history = await builder.fetch_recent(
+        user_id, max(builder.candidates, settings.LOCAL_SUGGESTION_HISTORY)
+    )
+    return SuggestionRequest(
+        user_id=user_id,
+        history=history,
+        context=builder.select(history[: builder.candidates]),
+    )
+
+
+class SuggestionBackend(ABC):
+    """A source of todo suggestions"""
+
+    @abstractmethod
+    async def suggest(
+        self, request: SuggestionRequest, deadline: Optional[Deadline] = None
+    ) -> SuggestionResult:
+        """Suggest a new todo for the request's user"""
+
+
+class LocalSuggestionBackend(SuggestionBackend):
+    """Suggestions computed in-process from the user's own history"""
+
+    def __init__(self, engine: Optional[LocalSuggestionEngine] = None):
+        self.engine = engine or LocalSuggestionEngine()
+
+    async def suggest(
+        self, request: SuggestionRequest, deadline: Optional[Deadline] = None
+    ) -> SuggestionResult:
+        """Suggest a todo without any network round trip"""
+        local = self.engine.suggest(request.history)
+        return SuggestionResult(suggestion=local.text, confidence=local.confidence)
+
+
+# Shared by all LLMService instances in the process, so that failures seen
+# by one request make the following ones fail fast
+circuit_breaker = CircuitBreaker(
+    failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=settings.LLM_CIRCUIT_RESET_SECONDS,
+)
+
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> "AsyncOpenAI":
+    """
+    Shared OpenAI client. Building one loads an SSL context and a connection
+    pool, which is too costly to repeat per request. The SDK itself is
+    imported here, on first use, as it is the slowest import of the app.
+    """
+    from openai import AsyncOpenAI
+
+    # Retries are made by hedged() within the request deadline
+    return AsyncOpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_BASE_URL,
+        max_retries=0,
+    )
+
+
+class LLMService(SuggestionBackend):
     """Service for interacting with OpenAI API"""
 
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
         self.model = settings.OPENAI_MODEL
         self.timeout = settings.OPENAI_TIMEOUT
+        self.hedge_delay = (
+            settings.LLM_HEDGE_DELAY_MS / 1000
+            if settings.LLM_HEDGE_DELAY_MS > 0
+            else None
+        )
+        self.circuit_breaker = circuit_breaker
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        """The shared client, created when the first completion is requested"""
+        return get_openai_client()
+
+    async def suggest(
+        self, request: SuggestionRequest, deadline: Optional[Deadline] = None
+    ) -> SuggestionResult:
+        """Suggest a todo with the LLM, refining the request's draft if any"""
+        return await self.generate_todo_suggestion(
+            request.context, request.user_id, deadline=deadline, draft=request.draft
+        )
 
     async def generate_todo_suggestion(
-        self, existing_todos: List[Todo], user_id: int
-    ) -> str:
-        """Generate a todo suggestion based on existing todos - no streaming"""
+        self,
+        existing_todos: Sequence[ContextTodo],
+        user_id: int,
+        deadline: Optional[Deadline] = None,
+        draft: Optional[str] = None,
+    ) -> SuggestionResult:
+        """
+        Generate a todo suggestion based on existing todos - no streaming.
+        The request is bounded by the caller's deadline (capped at
+        OPENAI_TIMEOUT); a second attempt may race a slow first one, or
+        replace one that failed with a retryable error.
+        """
+        started = time.perf_counter()
+        result = await self._generate(existing_todos, deadline, draft)
+        outcome = result.error.code.value if result.error else "OK"
+        LLM_REQUEST_DURATION.labels(outcome).observe(time.perf_counter() - started)
+        return result
+
+    async def _generate(
+        self,
+        existing_todos: Sequence[ContextTodo],
+        deadline: Optional[Deadline],
+        draft: Optional[str],
+    ) -> SuggestionResult:
+        """Get a suggestion from the LLM, mapping failures to error codes"""
+        import openai
+
+        deadline = deadline.cap(self.timeout) if deadline else Deadline(self.timeout)
+
+        if not self.circuit_breaker.allow_request():
+            return SuggestionResult.failure(
+                SuggestionErrorCode.CIRCUIT_OPEN,
+                "The suggestion service is temporarily unavailable",
+            )
+
         # Generate the system message with context from existing todos
-        system_message = self._create_system_message(existing_todos)
-        
+        system_message = self._create_system_message(existing_todos, draft)
+        messages = [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": "Generate a new todo suggestion."},
+        ]
+        # The whole prompt: instructions and todo context, in every message
+        PROMPT_TOKENS.observe(
+            sum(count_tokens(message["content"]) for message in messages)
+        )
+
         try:
-            # Call the OpenAI API without streaming
-            response = await self.client.chat.completions.create(
+            content = await hedged(
+                lambda: self._complete(messages, deadline),
+                deadline,
+                self.hedge_delay,
+                retry=self._retry,
+            )
+        except (asyncio.TimeoutError, openai.APITimeoutError):
+            self.circuit_breaker.record_failure()
+            return SuggestionResult.failure(
+                SuggestionErrorCode.TIMEOUT, "The suggestion request timed out"
+            )
+        except openai.RateLimitError as e:
+            self.circuit_breaker.record_failure()
+            return SuggestionResult.failure(SuggestionErrorCode.RATE_LIMITED, str(e))
+        except openai.APIStatusError as e:
+            # Client errors say nothing about upstream health
+            if e.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            return SuggestionResult.failure(
+                SuggestionErrorCode.UPSTREAM_ERROR, f"OpenAI API error: {e}"
+            )
+        except openai.APIError as e:
+            self.circuit_breaker.record_failure()
+            return SuggestionResult.failure(
+                SuggestionErrorCode.UPSTREAM_ERROR, f"OpenAI API error: {e}"
+            )
+
+        self.circuit_breaker.record_success()
+        if not content:
+            return SuggestionResult.failure(
+                SuggestionErrorCode.INVALID_RESPONSE,
+                "The model returned an empty suggestion",
+            )
+        return SuggestionResult(suggestion=content)
+
+    def _retry(self, error: BaseException) -> bool:
+        """
+        Whether to re-issue an attempt that failed: only after a timeout, a
+        connection error or a 5xx response, never a 4xx or 429. The failure
+        counts against the circuit breaker, which must still let requests
+        through.
+        """
+        import openai
+
+        if isinstance(error, openai.APIStatusError):
+            retryable = error.status_code >= 500
+        else:
+            retryable = isinstance(
+                error, (asyncio.TimeoutError, openai.APIConnectionError)
+            )
+        if not retryable:
+            return False
+        self.circuit_breaker.record_failure()
+        return self.circuit_breaker.allow_request()
+
+    async def _complete(self, messages: list, deadline: Deadline) -> Optional[str]:
+        """Run a single chat completion within the remaining deadline"""
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+
+        # Call the OpenAI API without streaming
+        response = await asyncio.wait_for(
+            self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": "Generate a new todo suggestion."},
-                ],
+                messages=messages,
                 temperature=0.7,
                 max_tokens=150,
                 stream=False,
-            )
-            
-            # Return the complete generated text
-            return response.choices[0].message.content
-            
-        except httpx.HTTPStatusError as e:
-            error_message = f"OpenAI API error: {str(e)}"
-            return f"Error: {error_message}"
-        
-        except Exception as e:
-            error_message = f"Unexpected error: {str(e)}"
-            return f"Error: {error_message}"
-
-    def _create_system_message(self, existing_todos: List[Todo]) -> str:
-        """Create a system message with context from existing todos"""
+                timeout=remaining,
+            ),
+            timeout=remaining,
+        )
+        if response.usage:
+            LLM_TOKENS.labels("prompt").inc(response.usage.prompt_tokens)
+            LLM_TOKENS.labels("completion").inc(response.usage.completion_tokens)
+        return response.choices[0].message.content
+
+    def _create_system_message(
+        self, existing_todos: Sequence[ContextTodo], draft: Optional[str] = None
+    ) -> str:
+        """
+        Create a system message with context from existing todos, which
+        PromptContextBuilder has already selected and truncated
+        """
         # Format existing todos as context
         todo_context = "\n".join(
             [
-                f"- {todo.title}" + (f": {todo.description}" if todo.description else "")
-                for todo in existing_todos[-5:]  # Use the 5 most recent todos
+                format_context_line(todo.title, todo.description)
+                for todo in existing_todos
             ]
         )
-        
+        draft_context = (
+            "A suggestion drafted from patterns in the user's history, which you may "
+            f"refine or replace with a better one:\n{draft}\n\n"
+            if draft
+            else ""
+        )
+
         return (
             "You are an intelligent todo list assistant. Your job is to suggest a relevant "
             "new todo item based on the user's existing todos.\n\n"
             f"Here are the user's recent todos:\n{todo_context}\n\n"
+            f"{draft_context}"
             "Generate a single, specific, actionable todo item that would be relevant "
             "to add to this list. The suggestion should be coherent with the existing "
             "todos and provide value to the user. Keep the title brief (under 10 words) "
@@ -77,4 +328,51 @@ class LLMService:
             "Format your response as a natural suggestion starting with a phrase like "
             "'How about...' or 'Consider adding...' followed by the todo item. "
             "Don't use JSON or structured format, just natural text."
-        )
\ No newline at end of file
+        )
+
+
+class SuggestionRouter:
+    """
+    Picks the suggestion backend per SUGGESTION_ROUTING:
+    - llm: the LLM, falling back to the local engine while the circuit is open
+    - local: the local engine only
+    - local_first: the local engine, with the LLM refining its suggestion
+      when it is not confident; the local suggestion is kept if the LLM fails
+    """
+
+    def __init__(
+        self,
+        routing: Optional[str] = None,
+        llm: Optional[SuggestionBackend] = None,
+        local: Optional[SuggestionBackend] = None,
+        min_confidence: Optional[float] = None,
+    ):
+        self.routing = routing or settings.SUGGESTION_ROUTING
+        self.llm = llm or LLMService()
+        self.local = local or LocalSuggestionBackend()
+        self.min_confidence = (
+            settings.LOCAL_SUGGESTION_MIN_CONFIDENCE
+            if min_confidence is None
+            else min_confidence
+        )
+
+    async def suggest(
+        self, request: SuggestionRequest, deadline: Optional[Deadline] = None
+    ) -> SuggestionResult:
+        """Suggest a todo from the backend the routing policy picks"""
+        if self.routing == "local":
+            return await self.local.suggest(request, deadline)
+
+        if self.routing == "local_first":
+            local = await self.local.suggest(request, deadline)
+            if local.error is None and (local.confidence or 0.0) >= self.min_confidence:
+                return local
+            refined = await self.llm.suggest(
+                replace(request, draft=local.suggestion), deadline
+            )
+            return local if refined.error and local.error is None else refined
+
+        result = await self.llm.suggest(request, deadline)
+        if result.error and result.error.code == SuggestionErrorCode.CIRCUIT_OPEN:
+            return await self.local.suggest(request, deadline)
+        return result
@@ -0,0 +1,349 @@
+"""
+Offline todo suggestions built from the user's own todo history.
+
+Three signals are combined, each computed with NumPy over the user's
+recent todos:
+- recurring todos, detected from regular gaps between their created_at times
+- follow-ups to recently completed todos, picked from keyword templates
+- TF-IDF similarity to the pending todos, so that follow-ups on what the
+  user is working on now rank first
+"""
+import math
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.db.models import TodoStatus
+from app.services.prompt_context import ContextTodo
+
+SECONDS_PER_DAY = 86400.0
+# Only the first tokens of a title and description are used as features
+MAX_FEATURE_TOKENS = 16
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = _EPOCH.replace(tzinfo=timezone.utc)
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_KEY_PATTERN = re.compile(r"[^a-z]+")
+
+STOP_WORDS = frozenset(
+    {
+        "a",
+        "an",
+        "and",
+        "the",
+        "to",
+        "of",
+        "for",
+        "on",
+        "in",
+        "at",
+        "with",
+        "my",
+        "our",
+        "up",
+    }
+)
+
+# Keywords of a completed todo, the follow-up title and why it is suggested
+FOLLOW_UP_TEMPLATES: List[Tuple[frozenset, str, str]] = [
+    (
+        frozenset({"meeting", "call", "sync", "interview", "standup", "workshop"}),
+        "Send notes from {title}",
+        "share the decisions and action items",
+    ),
+    (
+        frozenset(
+            {"proposal", "draft", "report", "application", "pitch", "quote", "invoice"}
+        ),
+        "Follow up on {title}",
+        "check whether it got a response",
+    ),
+    (
+        frozenset({"fix", "bug", "deploy", "release", "migrate", "install", "upgrade"}),
+        "Verify {title}",
+        "make sure the change works as expected",
+    ),
+    (
+        frozenset({"read", "review", "study", "learn", "course", "research"}),
+        "Write down takeaways from {title}",
+        "capture what is worth remembering",
+    ),
+]
+DEFAULT_FOLLOW_UP = ("Follow up on {title}", "see whether anything is left to do")
+
+
+@dataclass
+class LocalSuggestion:
+    """A suggestion from the local engine and how sure the engine is of it"""
+
+    title: str
+    text: str
+    confidence: float
+    reason: str
+
+
+GENERIC_SUGGESTION = LocalSuggestion(
+    title="Plan your top three priorities for tomorrow",
+    text=(
+        "How about adding 'Plan your top three priorities for tomorrow'? "
+        "A short plan makes the next day easier to start."
+    ),
+    confidence=0.1,
+    reason="generic",
+)
+
+
+@lru_cache(maxsize=4096)
+def _title_key(title: str) -> str:
+    """Normalize a title so that repeats of the same todo compare equal"""
+    return _KEY_PATTERN.sub(" ", title.lower()).strip()
+
+
+@lru_cache(maxsize=4096)
+def _features(title: str, description: Optional[str]) -> np.ndarray:
+    """
+    Hashed unigram and bigram features of a todo. Cached, as the same user's
+    history is mostly unchanged between requests.
+    """
+    text = f"{title} {description}" if description else title
+    tokens = [
+        token
+        for token in _TOKEN_PATTERN.findall(text.lower())
+        if token not in STOP_WORDS
+    ][:MAX_FEATURE_TOKENS]
+    return np.array(
+        [
+            hash(feature)
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        ],
+        dtype=np.int64,
+    )
+
+
+def _to_days(value: Optional[datetime]) -> float:
+    """Convert a timestamp to days since the epoch; naive values are UTC"""
+    if value is None:
+        return math.nan
+    epoch = _EPOCH if value.tzinfo is None else _EPOCH_UTC
+    return (value - epoch).total_seconds() / SECONDS_PER_DAY
+
+
+class LocalSuggestionEngine:
+    """Suggests todos from patterns in the user's history, without network calls"""
+
+    def __init__(
+        self,
+        min_occurrences: int = 3,
+        max_interval_variation: float = 0.35,
+        follow_up_days: float = 7.0,
+    ):
+        self.min_occurrences = min_occurrences
+        self.max_interval_variation = max_interval_variation
+        self.follow_up_days = follow_up_days
+
+    def suggest(
+        self, history: Sequence[ContextTodo], now: Optional[datetime] = None
+    ) -> LocalSuggestion:
+        """Suggest a todo from recent history, newest first"""
+        if not history:
+            return GENERIC_SUGGESTION
+
+        today = _to_days(now or datetime.utcnow())
+        keys = [_title_key(todo.title) for todo in history]
+        pending = np.array([todo.status == TodoStatus.PENDING for todo in history])
+        created = np.array([_to_days(todo.created_at) for todo in history])
+        completed = np.array([_to_days(todo.completed_at) for todo in history])
+        relevance = self._relevance(history, pending)
+
+        candidates = [
+            suggestion
+            for suggestion in (
+                self._recurring(history, keys, pending, created, today),
+                self._follow_up(history, set(keys), relevance, completed, today),
+                self._next_step(history, pending, relevance),
+            )
+            if suggestion is not None
+        ]
+        if not candidates:
+            return GENERIC_SUGGESTION
+        return max(candidates, key=lambda suggestion: suggestion.confidence)
+
+    def _recurring(
+        self,
+        history: Sequence[ContextTodo],
+        keys: List[str],
+        pending: np.ndarray,
+        created: np.ndarray,
+        today: float,
+    ) -> Optional[LocalSuggestion]:
+        """Find a todo the user adds at regular intervals and is due again"""
+        groups_by_key: Dict[str, int] = {}
+        group = np.array(
+            [groups_by_key.setdefault(key, len(groups_by_key)) for key in keys]
+        )
+        known = ~np.isnan(created)
+        if len(groups_by_key) == len(history) or known.sum() < self.min_occurrences:
+            return None
+
+        # Sort by group, then time, so each group's gaps are adjacent diffs
+        rows = np.flatnonzero(known)
+        order = rows[np.lexsort((created[rows], group[rows]))]
+        groups, times = group[order], created[order]
+        same = groups[1:] == groups[:-1]
+        gap_groups = groups[1:][same]
+        gaps = np.diff(times)[same]
+
+        size = len(groups_by_key)
+        count = np.bincount(gap_groups, minlength=size)
+        total = np.bincount(gap_groups, weights=gaps, minlength=size)
+        squares = np.bincount(gap_groups, weights=gaps * gaps, minlength=size)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            period = total / count
+            spread = np.sqrt(np.maximum(squares / count - period * period, 0.0))
+            variation = spread / period
+
+        # The last row of each group holds its most recent occurrence
+        ends = np.append(groups[1:] != groups[:-1], True)
+        last_row = np.zeros(size, dtype=int)
+        last_row[groups[ends]] = order[ends]
+        last = np.full(size, np.inf)
+        last[groups[ends]] = times[ends]
+        has_pending = np.bincount(group[pending], minlength=size) > 0
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            due = (today - last) / period
+            eligible = (
+                (count >= self.min_occurrences - 1)
+                & (period >= 0.5)
+                & (variation <= self.max_interval_variation)
+                & ~has_pending
+                & (due >= 0.75)
+            )
+        if not eligible.any():
+            return None
+
+        # Regular and due now beats irregular or long abandoned
+        confidence = np.where(
+            eligible,
+            (1.0 - variation) * np.minimum(due, 1.0) * np.where(due <= 2.0, 1.0, 0.5),
+            -1.0,
+        )
+        best = int(np.argmax(confidence))
+        title = history[last_row[best]].title
+        return LocalSuggestion(
+            title=title,
+            text=(
+                f"How about adding '{title}' again? You usually add it every "
+                f"{period[best]:.0f} days and last did "
+                f"{today - last[best]:.0f} days ago."
+            ),
+            confidence=float(confidence[best]),
+            reason="recurring",
+        )
+
+    def _follow_up(
+        self,
+        history: Sequence[ContextTodo],
+        existing: set,
+        relevance: np.ndarray,
+        completed: np.ndarray,
+        today: float,
+    ) -> Optional[LocalSuggestion]:
+        """Suggest a follow-up to a recently completed todo"""
+        with np.errstate(invalid="ignore"):
+            age = today - completed
+            recent = np.flatnonzero(age <= self.follow_up_days)
+        if not len(recent):
+            return None
+
+        # Fresher and more relevant to the pending todos first
+        freshness = np.exp(-age[recent] / (self.follow_up_days / 2))
+        scores = freshness * (0.5 + 0.5 * relevance[recent])
+        for index in np.argsort(-scores):
+            todo = history[recent[index]]
+            words = set(_TOKEN_PATTERN.findall(todo.title.lower()))
+            template, detail, weight = DEFAULT_FOLLOW_UP[0], DEFAULT_FOLLOW_UP[1], 0.8
+            for keywords, keyword_template, keyword_detail in FOLLOW_UP_TEMPLATES:
+                if words & keywords:
+                    template, detail, weight = keyword_template, keyword_detail, 1.0
+                    break
+
+            title = template.format(title=todo.title)
+            if _title_key(title) in existing:
+                continue
+            days = age[recent[index]]
+            when = "today" if days < 1 else f"{days:.0f} days ago"
+            return LocalSuggestion(
+                title=title,
+                text=(
+                    f"How about adding '{title}'? You completed '{todo.title}' "
+                    f"{when}, so {detail}."
+                ),
+                confidence=float(0.6 * weight * scores[index]),
+                reason="follow_up",
+            )
+        return None
+
+    def _next_step(
+        self, history: Sequence[ContextTodo], pending: np.ndarray, relevance: np.ndarray
+    ) -> Optional[LocalSuggestion]:
+        """Suggest breaking down the most central high priority pending todo"""
+        rows = np.flatnonzero(pending)
+        if not len(rows):
+            return None
+        priority = np.array([history[row].priority for row in rows], dtype=float)
+        best = rows[int(np.argmax(relevance[rows] + 0.25 * priority))]
+        title = history[best].title
+        return LocalSuggestion(
+            title=f"First step for {title}",
+            text=(
+                f"Consider adding a first concrete step for '{title}' "
+                "to get it moving."
+            ),
+            confidence=0.2,
+            reason="next_step",
+        )
+
+    def _relevance(
+        self, history: Sequence[ContextTodo], pending: np.ndarray
+    ) -> np.ndarray:
+        """
+        Cosine similarity of each todo to the centroid of the pending todos,
+        over TF-IDF weighted unigrams and bigrams of titles and descriptions.
+        The term matrix is kept sparse as (row, column, count) entries.
+        """
+        count = len(history)
+        features = [_features(todo.title, todo.description) for todo in history]
+        lengths = [len(row) for row in features]
+        total = sum(lengths)
+        if not total or not pending.any():
+            return np.zeros(count)
+
+        rows = np.repeat(np.arange(count), lengths)
+        hashed = np.concatenate(features)
+        _, columns = np.unique(hashed, return_inverse=True)
+        size = int(columns.max()) + 1
+        cells, frequency = np.unique(rows * size + columns, return_counts=True)
+        rows, columns = np.divmod(cells, size)
+
+        document_frequency = np.bincount(columns, minlength=size)
+        idf = np.log((1 + count) / (1 + document_frequency)) + 1
+        weights = frequency * idf[columns]
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=count))
+        weights /= norms[rows]
+
+        in_pending = pending[rows]
+        centroid = np.bincount(
+            columns[in_pending], weights=weights[in_pending], minlength=size
+        ).astype(np.float64)
+        # The pending todos may have no features at all, as in "!!!" or "the"
+        norm = np.linalg.norm(centroid)
+        if not norm:
+            return np.zeros(count)
+        centroid /= norm
+        return np.bincount(rows, weights=weights * centroid[columns], minlength=count)
@@ -0,0 +1,182 @@
+import math
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models import Todo, TodoStatus
+
+# Upper bound on characters fetched per description; the token limit is
+# applied afterwards, this only keeps huge descriptions off the wire.
+CHARS_PER_TOKEN_LIMIT = 8
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """Load the tiktoken encoding for the configured model, if installed"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(settings.OPENAI_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count tokens with tiktoken when available; otherwise estimate them as
+    one token per word or punctuation mark, with long words split every
+    four characters.
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return sum(math.ceil(len(word) / 4) for word in _WORD_PATTERN.findall(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Truncate text to at most max_tokens tokens"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens]).rstrip() + "..."
+
+    used = 0
+    for match in _WORD_PATTERN.finditer(text):
+        used += math.ceil(len(match.group()) / 4)
+        if used > max_tokens:
+            return text[: match.start()].rstrip() + "..."
+    return text
+
+
+@dataclass
+class ContextTodo:
+    """The columns of a todo that go into a suggestion prompt"""
+
+    title: str
+    description: Optional[str]
+    status: TodoStatus
+    priority: int
+    created_at: Optional[datetime]
+    completed_at: Optional[datetime] = None
+
+
+class PromptContextBuilder:
+    """
+    Selects the todos to show the LLM as context for a suggestion.
+    Recent candidates are scored by recency, pending status and priority,
+    then packed into a fixed token budget.
+    """
+
+    def __init__(
+        self,
+        db: AsyncSession,
+        token_budget: Optional[int] = None,
+        max_todos: Optional[int] = None,
+        candidates: Optional[int] = None,
+        description_max_tokens: Optional[int] = None,
+    ):
+        self.db = db
+        self.token_budget = token_budget or settings.PROMPT_CONTEXT_TOKEN_BUDGET
+        self.max_todos = max_todos or settings.PROMPT_CONTEXT_MAX_TODOS
+        self.candidates = candidates or settings.PROMPT_CONTEXT_CANDIDATES
+        self.description_max_tokens = (
+            description_max_tokens or settings.PROMPT_DESCRIPTION_MAX_TOKENS
+        )
+
+    async def build(self, user_id: int) -> List[ContextTodo]:
+        """Get the highest scoring recent todos that fit the token budget"""
+        return self.select(await self.fetch_recent(user_id))
+
+    async def fetch_recent(
+        self, user_id: int, limit: Optional[int] = None
+    ) -> List[ContextTodo]:
+        """
+        Fetch the most recent todos, newest first, reading only the columns
+        the prompt uses
+        """
+        max_chars = self.description_max_tokens * CHARS_PER_TOKEN_LIMIT
+        query = (
+            select(
+                Todo.title,
+                func.substr(Todo.description, 1, max_chars),
+                Todo.status,
+                Todo.priority,
+                Todo.created_at,
+                Todo.completed_at,
+            )
+            .filter(Todo.user_id == user_id)
+            .order_by(Todo.created_at.desc())
+            .limit(limit or self.candidates)
+        )
+        result = await self.db.execute(query)
+        return [ContextTodo(*row) for row in result.all()]
+
+    def score(self, todo: ContextTodo, recency_rank: int, total: int) -> float:
+        """Score a candidate; recency_rank 0 is the newest of total candidates"""
+        recency = 1.0 - recency_rank / total
+        pending = 1.0 if todo.status == TodoStatus.PENDING else 0.0
+        priority = (todo.priority - 1) / 2
+        return (
+            settings.PROMPT_WEIGHT_RECENCY * recency
+            + settings.PROMPT_WEIGHT_PENDING * pending
+            + settings.PROMPT_WEIGHT_PRIORITY * priority
+        )
+
+    def select(self, candidates: List[ContextTodo]) -> List[ContextTodo]:
+        """Pick the best scoring candidates, truncated to fit the token budget"""
+        ranked = sorted(
+            enumerate(candidates),
+            key=lambda item: self.score(item[1], item[0], len(candidates)),
+            reverse=True,
+        )
+
+        selected: List[ContextTodo] = []
+        used = 0
+        for _, todo in ranked:
+            if len(selected) >= self.max_todos:
+                break
+
+            description = (
+                truncate_tokens(todo.description, self.description_max_tokens)
+                if todo.description
+                else None
+            )
+            cost = count_tokens(format_context_line(todo.title, description))
+            if used + cost > self.token_budget and description:
+                # Fall back to the title alone
+                description = None
+                cost = count_tokens(format_context_line(todo.title, None))
+            if used + cost > self.token_budget:
+                continue
+
+            used += cost
+            selected.append(
+                ContextTodo(
+                    title=todo.title,
+                    description=description,
+                    status=todo.status,
+                    priority=todo.priority,
+                    created_at=todo.created_at,
+                    completed_at=todo.completed_at,
+                )
+            )
+        return selected
+
+
+def format_context_line(title: str, description: Optional[str]) -> str:
+    """Format one todo as a line of prompt context"""
+    return f"- {title}" + (f": {description}" if description else "")
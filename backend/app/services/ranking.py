@@ -0,0 +1,143 @@
+"""
+Lexicographic rank keys for manual todo ordering.
+
+A key is a header digit giving the length of its integer part, the integer
+digits, then an optional fractional part that never ends in "0". Keys only
+use 0-9 and a-z, so plain string comparison (SQLite BINARY or any Postgres
+collation) orders them correctly. A new key can always be generated between
+two existing ones, so moving a todo only rewrites that todo's row.
+"""
+from typing import List, Optional
+
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+
+# The smallest integer part; a bare "10" is never issued so that there is
+# always room to insert before the first key.
+SMALLEST_INTEGER = "10"
+
+
+def _split(key: str) -> "tuple[str, str]":
+    """Split a key into its integer part (with header) and fractional part"""
+    if not key or key[0] not in DIGITS[1:]:
+        raise ValueError(f"Invalid rank key: {key!r}")
+    length = DIGITS.index(key[0]) + 1
+    if len(key) < length or key[length:].endswith("0"):
+        raise ValueError(f"Invalid rank key: {key!r}")
+    return key[:length], key[length:]
+
+
+def _midpoint(a: str, b: Optional[str]) -> str:
+    """Fractional digits strictly between a and b (None meaning 1)"""
+    if b is not None:
+        # Carry over the common prefix, padding a with zeros
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else "0") == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+
+    digit_a = DIGITS.index(a[0]) if a else 0
+    digit_b = DIGITS.index(b[0]) if b is not None else BASE
+    if digit_b - digit_a > 1:
+        return DIGITS[(digit_a + digit_b) // 2]
+
+    # Consecutive digits
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[digit_a] + _midpoint(a[1:], None)
+
+
+def _increment(integer: str) -> Optional[str]:
+    """Next integer part, growing the header when the digits overflow"""
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        position = DIGITS.index(digits[i])
+        if position < BASE - 1:
+            digits[i] = DIGITS[position + 1]
+            return head + "".join(digits)
+        digits[i] = "0"
+
+    length = DIGITS.index(head) + 1
+    if length >= BASE:
+        return None
+    return DIGITS[length] + "0" * length
+
+
+def _decrement(integer: str) -> Optional[str]:
+    """Previous integer part, shrinking the header when the digits underflow"""
+    if integer == SMALLEST_INTEGER:
+        return None
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        position = DIGITS.index(digits[i])
+        if position > 0:
+            digits[i] = DIGITS[position - 1]
+            return head + "".join(digits)
+        digits[i] = DIGITS[-1]
+
+    length = DIGITS.index(head) - 1
+    return DIGITS[length] + DIGITS[-1] * length
+
+
+def key_between(a: Optional[str], b: Optional[str]) -> str:
+    """
+    Generate a key strictly between a and b.
+    None for a means "before everything", None for b "after everything".
+    """
+    if a is not None and b is not None and a >= b:
+        raise ValueError(f"Rank keys out of order: {a!r} >= {b!r}")
+
+    if a is None and b is None:
+        return "1" + DIGITS[BASE // 2]
+
+    if a is None:
+        integer_b, fraction_b = _split(b)
+        if integer_b == SMALLEST_INTEGER:
+            return integer_b + _midpoint("", fraction_b)
+        if fraction_b:
+            return integer_b
+        previous = _decrement(integer_b)
+        if previous == SMALLEST_INTEGER:
+            return previous + _midpoint("", None)
+        return previous
+
+    integer_a, fraction_a = _split(a)
+    if b is None:
+        following = _increment(integer_a)
+        return (
+            following
+            if following is not None
+            else integer_a + _midpoint(fraction_a, None)
+        )
+
+    integer_b, fraction_b = _split(b)
+    if integer_a == integer_b:
+        return integer_a + _midpoint(fraction_a, fraction_b)
+    following = _increment(integer_a)
+    if following is not None and following < b:
+        return following
+    return integer_a + _midpoint(fraction_a, None)
+
+
+def spaced_keys(count: int) -> List[str]:
+    """
+    Generate count ascending keys of equal length, centered in their key
+    space so there is room to insert on either side. Used for rebalancing.
+    """
+    if count <= 0:
+        return []
+
+    length = 1
+    while BASE**length < 2 * count + 2:
+        length += 1
+    start = BASE**length // 2 - count // 2
+
+    keys = []
+    for value in range(start, start + count):
+        digits = []
+        for _ in range(length):
+            value, remainder = divmod(value, BASE)
+            digits.append(DIGITS[remainder])
+        keys.append(DIGITS[length] + "".join(reversed(digits)))
+    return keys
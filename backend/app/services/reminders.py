@@ -0,0 +1,343 @@
+"""
+Due date reminders, published through the pub/sub manager.
+
+Each app process keeps the pending todos that fall due within a bounded
+look-ahead window in a min-heap ordered by reminder time, which is
+REMINDER_LEAD_MINUTES before the due date. The window is loaded with one
+range query on (status, due_date), served by ix_todos_status_due_date,
+and reloaded every REMINDER_REFRESH_SECONDS, so that a todo is loaded
+before its reminder is due as long as the window is longer than that.
+TodoService reports the todos it creates, reschedules, completes,
+reopens and deletes, and the heap is updated in place; an entry whose
+todo changed since it was pushed is skipped once it reaches the top.
+The scheduler sleeps until the earliest reminder or the next reload, so
+its cost grows with the reminders coming up, not with the todos stored.
+
+A reminder is published on the reminders channel of the todo's user
+(see Subscription.todo_reminders), and in a single process only while the
+user is subscribed, so that no query is spent on reminders nobody would
+receive. The todo is read back first, so one completed or rescheduled
+through another process is not reminded about.
+
+With sharding, the window is loaded from every shard, and todos are
+known by user and ID, since IDs repeat across shards.
+
+Under app.server, only the first worker loads the window and sends
+reminders, through the pub/sub broker that reaches the subscribers of
+every worker. The other workers publish the todo changes they make on
+REMINDER_CHANGES_CHANNEL for it to apply.
+"""
+import asyncio
+import heapq
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.metrics import REMINDERS_SCHEDULED, REMINDERS_SENT
+from app.db.models import Todo, TodoStatus
+from app.db.sharding import shards
+from app.events.pubsub import PubSubManager, pubsub
+
+
+def utc_naive(value: datetime) -> datetime:
+    """A datetime as naive UTC, like datetime.utcnow()"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# (user ID, todo ID)
+TodoKey = Tuple[int, int]
+
+# Todo changes made by processes that do not run the scheduler, as
+# [user ID, todo ID, due date or null]
+REMINDER_CHANGES_CHANNEL = "reminders:changes"
+
+
+def reminder_channel(user_id: int) -> str:
+    """Pub/Sub channel carrying a user's due date reminders"""
+    return f"reminders:{user_id}"
+
+
+@dataclass
+class Reminder:
+    """A scheduled reminder of a pending todo's due date"""
+
+    todo_id: int
+    user_id: int
+    due_date: datetime
+    remind_at: datetime
+
+
+class ReminderScheduler:
+    """
+    Reminders of the todos due within the look-ahead window, sent from a
+    background task at their reminder time
+    """
+
+    def __init__(
+        self,
+        lead_minutes: int,
+        window_minutes: int,
+        refresh_seconds: int,
+        pubsub_manager: PubSubManager,
+    ):
+        self.lead = timedelta(minutes=lead_minutes)
+        self.window = timedelta(minutes=window_minutes)
+        self.refresh_seconds = refresh_seconds
+        self.pubsub = pubsub_manager
+        # (remind at, user ID, todo ID), earliest first; includes stale entries
+        self.heap: List[Tuple[datetime, int, int]] = []
+        # The current reminder of each scheduled todo
+        self.reminders: Dict[TodoKey, Reminder] = {}
+        # Due date each todo was last reminded about, so that reloads skip it
+        self.sent: Dict[TodoKey, datetime] = {}
+        # Todos due up to this time are loaded; later ones wait for a reload
+        self.horizon: Optional[datetime] = None
+        # Changes made while a reload is querying, replayed on its result
+        self._changes: Optional[List[Tuple[int, int, Optional[datetime]]]] = None
+        self._next_load = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+        # Set where another process runs the scheduler
+        self._forward = False
+
+    async def start(self, load: bool = True) -> None:
+        """
+        Load the window and start sending reminders, or with load False,
+        forward todo changes to the process that does
+        """
+        if not load:
+            self._forward = True
+            return
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            if self.pubsub.shared:
+                self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._listener):
+            if task:
+                task.cancel()
+        self._task = None
+        self._listener = None
+        self._forward = False
+        self.heap = []
+        self.reminders = {}
+        self.horizon = None
+
+    def todo_changed(self, todo: Todo) -> None:
+        """Schedule, move or drop a todo's reminder after it was saved"""
+        pending = todo.status == TodoStatus.PENDING and todo.due_date is not None
+        self._change(
+            todo.user_id, todo.id, utc_naive(todo.due_date) if pending else None
+        )
+
+    def todo_deleted(self, todo_id: int, user_id: int) -> None:
+        """Drop a deleted todo's reminder"""
+        self._change(user_id, todo_id, None)
+
+    def _change(self, user_id: int, todo_id: int, due_date: Optional[datetime]) -> None:
+        """Apply a todo change here, or send it to the process running the scheduler"""
+        if self._forward:
+            self.pubsub.publish_nowait(
+                REMINDER_CHANGES_CHANNEL,
+                json.dumps(
+                    [user_id, todo_id, due_date.isoformat() if due_date else None]
+                ),
+            )
+        elif self._task is not None:
+            self._apply(user_id, todo_id, due_date)
+
+    async def _listen(self) -> None:
+        """Apply the todo changes forwarded by other processes"""
+        async for message in self.pubsub.subscribe(REMINDER_CHANGES_CHANNEL):
+            user_id, todo_id, due_date = json.loads(message)
+            self._apply(
+                user_id, todo_id, datetime.fromisoformat(due_date) if due_date else None
+            )
+
+    def user_moved(self, user_id: int) -> None:
+        """Reload after a user's todos moved to another shard, where their IDs differ"""
+        for key in [key for key in self.reminders if key[0] == user_id]:
+            del self.reminders[key]
+        for key in [key for key in self.sent if key[0] == user_id]:
+            del self.sent[key]
+        if self._task is not None:
+            self._next_load = 0.0
+            self._wakeup.set()
+
+    def _apply(self, user_id: int, todo_id: int, due_date: Optional[datetime]) -> None:
+        """
+        Make due_date the todo's reminder, or drop it if None or outside the
+        window
+        """
+        if self._changes is not None:
+            self._changes.append((user_id, todo_id, due_date))
+        key = (user_id, todo_id)
+        if (
+            due_date is None
+            or self.horizon is None
+            or not datetime.utcnow() < due_date <= self.horizon
+            or self.sent.get(key) == due_date
+        ):
+            self.reminders.pop(key, None)
+            return
+
+        current = self.reminders.get(key)
+        if current and current.due_date == due_date:
+            return
+        remind_at = due_date - self.lead
+        self.reminders[key] = Reminder(todo_id, user_id, due_date, remind_at)
+        heapq.heappush(self.heap, (remind_at, user_id, todo_id))
+        if self._wakeup and self.heap[0] == (remind_at, user_id, todo_id):
+            self._wakeup.set()
+
+    async def load(self) -> None:
+        """Replace the schedule with the pending todos due within the window"""
+        now = datetime.utcnow()
+        horizon = now + self.lead + self.window
+        rows = []
+        self._changes = []
+        try:
+            for name, sessionmaker in shards.sessionmakers.items():
+                async with sessionmaker() as session:
+                    result = await session.execute(
+                        select(Todo.user_id, Todo.id, Todo.due_date).filter(
+                            Todo.status == TodoStatus.PENDING,
+                            Todo.due_date > now,
+                            Todo.due_date <= horizon,
+                        )
+                    )
+                    # Skip copies of users being moved to or from this shard
+                    rows += [
+                        row
+                        for row in result.all()
+                        if shards.shard_for(row.user_id) == name
+                    ]
+        finally:
+            changes, self._changes = self._changes, None
+
+        # Rebuilding also drops the stale heap entries
+        self.heap = []
+        self.reminders = {}
+        self.horizon = horizon
+        self.sent = {
+            key: due_date for key, due_date in self.sent.items() if due_date > now
+        }
+        for user_id, todo_id, due_date in rows:
+            self._apply(user_id, todo_id, utc_naive(due_date))
+        for change in changes:
+            self._apply(*change)
+
+    def _pop_due(self) -> List[Reminder]:
+        """Take the reminders whose time has come off the heap"""
+        now = datetime.utcnow()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            remind_at, user_id, todo_id = heapq.heappop(self.heap)
+            reminder = self.reminders.get((user_id, todo_id))
+            if reminder and reminder.remind_at == remind_at:
+                del self.reminders[(user_id, todo_id)]
+                self.sent[(user_id, todo_id)] = reminder.due_date
+                due.append(reminder)
+        return due
+
+    async def _send(self, due: List[Reminder]) -> None:
+        """Publish the reminders of subscribed users whose todos are still due then"""
+        # Subscribers of other processes are not known here
+        due = [
+            reminder
+            for reminder in due
+            if self.pubsub.shared
+            or self.pubsub.has_subscribers(reminder_channel(reminder.user_id))
+        ]
+        if not due:
+            return
+
+        by_shard: Dict[str, List[Reminder]] = {}
+        for reminder in due:
+            by_shard.setdefault(shards.shard_for(reminder.user_id), []).append(reminder)
+        current = {}
+        for name, shard_due in by_shard.items():
+            async with shards.sessionmakers[name]() as session:
+                result = await session.execute(
+                    select(Todo.user_id, Todo.id, Todo.title, Todo.due_date).filter(
+                        Todo.id.in_([reminder.todo_id for reminder in shard_due]),
+                        Todo.status == TodoStatus.PENDING,
+                    )
+                )
+                current.update({(row.user_id, row.id): row for row in result.all()})
+
+        for reminder in due:
+            row = current.get((reminder.user_id, reminder.todo_id))
+            if (
+                not row
+                or not row.due_date
+                or utc_naive(row.due_date) != reminder.due_date
+            ):
+                continue
+            channel_id = reminder_channel(reminder.user_id)
+            # The subscription may have ended during the query
+            if not self.pubsub.shared and not self.pubsub.has_subscribers(channel_id):
+                continue
+            await self.pubsub.publish(
+                channel_id,
+                json.dumps(
+                    {
+                        "todo_id": reminder.todo_id,
+                        "title": row.title,
+                        "due_date": reminder.due_date.isoformat(),
+                    }
+                ),
+            )
+            REMINDERS_SENT.inc()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._next_load = loop.time()
+        while True:
+            if loop.time() >= self._next_load:
+                self._next_load = loop.time() + self.refresh_seconds
+                try:
+                    await self.load()
+                except Exception as e:
+                    print(f"Loading reminders failed: {e}")
+
+            # Cleared before popping, so a reminder scheduled meanwhile wakes us
+            self._wakeup.clear()
+            due = self._pop_due()
+            if due:
+                try:
+                    await self._send(due)
+                except Exception as e:
+                    print(f"Sending reminders failed: {e}")
+
+            timeout = self._next_load - loop.time()
+            if self.heap:
+                timeout = min(
+                    timeout, (self.heap[0][0] - datetime.utcnow()).total_seconds()
+                )
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+
+# Shared scheduler for the application process
+due_reminders = ReminderScheduler(
+    lead_minutes=settings.REMINDER_LEAD_MINUTES,
+    window_minutes=settings.REMINDER_WINDOW_MINUTES,
+    refresh_seconds=settings.REMINDER_REFRESH_SECONDS,
+    pubsub_manager=pubsub,
+)
+
+shards.move_listeners.append(due_reminders.user_moved)
+
+REMINDERS_SCHEDULED.set_function(lambda: len(due_reminders.reminders))
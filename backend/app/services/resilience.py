@@ -0,0 +1,141 @@
+"""
+Deadlines, request hedging and retries, and circuit breaking for upstream
+calls.
+"""
+import asyncio
+import time
+from enum import Enum as PyEnum
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Deadline:
+    """An absolute point in time by which a request must finish"""
+
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + max(0.0, timeout)
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        """Check if the deadline has passed"""
+        return self.remaining() <= 0
+
+    def cap(self, timeout: float) -> "Deadline":
+        """A deadline no later than this one and no later than timeout from now"""
+        return Deadline(min(self.remaining(), timeout))
+
+
+class CircuitState(str, PyEnum):
+    """Circuit breaker state enumeration"""
+
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream is unhealthy.
+    After failure_threshold consecutive failures the circuit opens and
+    requests are rejected; after reset_timeout seconds a single trial
+    request is let through, and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow_request(self) -> bool:
+        """Check whether a request may be sent to the upstream"""
+        if self.state == CircuitState.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            # Let one trial request through; another one follows after a
+            # further reset_timeout if the trial never reports back
+            self.state = CircuitState.HALF_OPEN
+            self.opened_at = now
+            return True
+        return False
+
+    def record_success(self) -> None:
+        """Record a successful request, closing the circuit"""
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        """Record a failed request, opening the circuit past the threshold"""
+        self.failures += 1
+        if (
+            self.state == CircuitState.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            self.state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
+
+
+async def hedged(
+    attempt: Callable[[], Awaitable[T]],
+    deadline: Deadline,
+    hedge_delay: Optional[float] = None,
+    retry: Optional[Callable[[BaseException], bool]] = None,
+    max_attempts: int = 2,
+) -> T:
+    """
+    Run attempt(), starting another one at most max_attempts - 1 times
+    within the deadline: while the first is still pending after hedge_delay
+    seconds, and in place of an attempt that failed if retry(error) is true.
+    The first success wins and the other attempts are cancelled. Raises
+    asyncio.TimeoutError when the deadline passes, or the last error when
+    no attempt is left.
+    """
+    tasks: List["asyncio.Task[T]"] = [asyncio.ensure_future(attempt())]
+    hedge_at = time.monotonic() + hedge_delay if hedge_delay is not None else None
+    pending = set(tasks)
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            timeout = deadline.remaining()
+            can_hedge = hedge_at is not None and len(tasks) < max_attempts
+            if can_hedge:
+                timeout = min(timeout, max(0.0, hedge_at - time.monotonic()))
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                if deadline.expired:
+                    raise asyncio.TimeoutError()
+                if can_hedge:
+                    # Slow rather than failed: race a second attempt against it
+                    tasks.append(asyncio.ensure_future(attempt()))
+                    pending.add(tasks[-1])
+                continue
+
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+                if (
+                    len(tasks) < max_attempts
+                    and not deadline.expired
+                    and retry is not None
+                    and retry(error)
+                ):
+                    tasks.append(asyncio.ensure_future(attempt()))
+                    pending.add(tasks[-1])
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Mark a losing attempt's error as retrieved
+                task.exception()
@@ -1,10 +1,137 @@
+import asyncio
 from datetime import datetime
-from typing import List, Optional
+from typing import Awaitable, Callable, Iterable, List, Optional, Set, Tuple, TypeVar
 
-from sqlalchemy import select
+import numpy as np
+from sqlalchemy import String, cast, func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.models import Todo, TodoStatus
+from app.core.config import settings
+from app.db.models import Tag, Todo, TodoStatus, todo_tags
+from app.db.sharding import shards
+from app.services.embeddings import EmbeddingService, vector_index
+from app.services.ranking import key_between, spaced_keys
+from app.services.reminders import due_reminders
+
+TAG_NAME_MAX_LENGTH = 50
+TITLE_MAX_LENGTH = 255
+MIN_PRIORITY = 1
+MAX_PRIORITY = 3
+
+# Attempts at a write that assigns rank keys; concurrent writes of the same
+# user can pick the same key, which the unique (user_id, rank) index rejects
+RANK_WRITE_ATTEMPTS = 5
+RANK_INDEX = "ix_todos_user_id_rank"
+
+T = TypeVar("T")
+
+
+def normalize_tag_names(names: Iterable[str]) -> List[str]:
+    """Normalize tag names: strip '#', lowercase, drop blanks and duplicates"""
+    normalized: List[str] = []
+    for name in names:
+        name = name.strip().lstrip("#").strip().lower()
+        if not name or name in normalized:
+            continue
+        if len(name) > TAG_NAME_MAX_LENGTH:
+            raise ValueError(
+                f"Tag name exceeds {TAG_NAME_MAX_LENGTH} characters: {name}"
+            )
+        normalized.append(name)
+    return normalized
+
+
+def is_rank_conflict(error: IntegrityError) -> bool:
+    """
+    Check if a write was rejected by the unique (user_id, rank) index.
+    asyncpg names the violated constraint on the original exception and in
+    its message; SQLite only lists the index's columns.
+    """
+    constraint = getattr(error.orig.__cause__, "constraint_name", None)
+    if constraint is not None:
+        return constraint == RANK_INDEX
+    message = str(error.orig)
+    return RANK_INDEX in message or "todos.user_id, todos.rank" in message
+
+
+async def retry_rank_conflicts(
+    session: AsyncSession, write: Callable[[], Awaitable[T]]
+) -> T:
+    """
+    Run a write that reads rank keys, assigns new ones and commits, again
+    from the start if a concurrent write took one of its keys first. Any
+    other integrity error is raised at once.
+    """
+    for attempt in range(RANK_WRITE_ATTEMPTS):
+        try:
+            return await write()
+        except IntegrityError as e:
+            await session.rollback()
+            if not is_rank_conflict(e) or attempt == RANK_WRITE_ATTEMPTS - 1:
+                raise
+
+
+# Users with a rank rebalance in flight, and the tasks running them
+_rebalancing_users: Set[int] = set()
+_rebalance_tasks: Set[asyncio.Task] = set()
+
+
+async def rebalance_ranks(user_id: int, batch_size: int = 1000) -> int:
+    """Rewrite all rank keys of a user as short, evenly spaced keys"""
+    async with shards.session(user_id) as session:
+        return await retry_rank_conflicts(
+            session, lambda: _rewrite_ranks(session, user_id, batch_size)
+        )
+
+
+async def _rewrite_ranks(session: AsyncSession, user_id: int, batch_size: int) -> int:
+    """Rebalance a user's rank keys in one transaction"""
+    result = await session.execute(
+        select(Todo.id).filter(Todo.user_id == user_id).order_by(Todo.rank, Todo.id)
+    )
+    todo_ids = list(result.scalars().all())
+    keys = spaced_keys(len(todo_ids))
+
+    # Move every key out of the way first, as a new key may equal another
+    # todo's old one; "~" sorts after every key character
+    await session.execute(
+        update(Todo)
+        .filter(Todo.user_id == user_id)
+        .values(rank="~" + cast(Todo.id, String))
+    )
+    for start in range(0, len(todo_ids), batch_size):
+        await session.execute(
+            update(Todo),
+            [
+                {"id": todo_id, "rank": key}
+                for todo_id, key in zip(
+                    todo_ids[start : start + batch_size],
+                    keys[start : start + batch_size],
+                )
+            ],
+        )
+    await session.commit()
+    return len(todo_ids)
+
+
+def schedule_rank_rebalance(user_id: int) -> None:
+    """Rebalance a user's rank keys in the background, at most once at a time"""
+    if user_id in _rebalancing_users:
+        return
+    _rebalancing_users.add(user_id)
+
+    async def run() -> None:
+        try:
+            await rebalance_ranks(user_id)
+        finally:
+            _rebalancing_users.discard(user_id)
+
+    task = asyncio.create_task(run())
+    _rebalance_tasks.add(task)
+    task.add_done_callback(_rebalance_tasks.discard)
 
 
 class TodoService:
@@ -13,19 +140,98 @@ class TodoService:
     def __init__(self, db: AsyncSession):
         self.db = db
 
+    @staticmethod
+    def validate(title: Optional[str] = None, priority: Optional[int] = None) -> None:
+        """Validate todo fields, raising ValueError for invalid values"""
+        if title is not None:
+            if not title.strip():
+                raise ValueError("Title must not be empty")
+            if len(title) > TITLE_MAX_LENGTH:
+                raise ValueError(f"Title exceeds {TITLE_MAX_LENGTH} characters")
+        if priority is not None and not MIN_PRIORITY <= priority <= MAX_PRIORITY:
+            raise ValueError(
+                f"Priority must be between {MIN_PRIORITY} and {MAX_PRIORITY}"
+            )
+
     async def get_todos(
-        self, user_id: int, skip: int = 0, limit: int = 100, include_completed: bool = True
+        self,
+        user_id: int,
+        skip: int = 0,
+        limit: int = 100,
+        include_completed: bool = True,
+        tags: Optional[List[str]] = None,
+        match_all: bool = True,
+        manual_order: bool = False,
     ) -> List[Todo]:
-        """Get all todos for a user"""
-        query = select(Todo).filter(Todo.user_id == user_id).order_by(Todo.priority.desc(), Todo.created_at.desc())
-        
+        """Get all todos for a user, optionally filtered by tags"""
+        query = select(Todo).filter(Todo.user_id == user_id)
+        if manual_order:
+            query = query.order_by(Todo.rank, Todo.id)
+        else:
+            query = query.order_by(Todo.priority.desc(), Todo.created_at.desc())
+
         if not include_completed:
             query = query.filter(Todo.status != TodoStatus.COMPLETED)
-            
+
+        tag_names = normalize_tag_names(tags or [])
+        if tag_names:
+            query = query.filter(
+                Todo.id.in_(self._tagged_todo_ids(user_id, tag_names, match_all))
+            )
+
         query = query.offset(skip).limit(limit)
         result = await self.db.execute(query)
         return list(result.scalars().all())
 
+    def _tagged_todo_ids(self, user_id: int, tag_names: List[str], match_all: bool):
+        """
+        Subquery of todo IDs carrying the given tags.
+        Resolves names through the (user_id, name) unique index and walks the
+        (tag_id, todo_id) index, so cost follows the matching rows only.
+        """
+        subquery = (
+            select(todo_tags.c.todo_id)
+            .join(Tag, Tag.id == todo_tags.c.tag_id)
+            .filter(Tag.user_id == user_id, Tag.name.in_(tag_names))
+        )
+        if match_all:
+            subquery = subquery.group_by(todo_tags.c.todo_id).having(
+                func.count(todo_tags.c.tag_id) == len(tag_names)
+            )
+        return subquery
+
+    async def get_tags(self, user_id: int) -> List[Tag]:
+        """Get all tags for a user"""
+        query = select(Tag).filter(Tag.user_id == user_id).order_by(Tag.name)
+        result = await self.db.execute(query)
+        return list(result.scalars().all())
+
+    async def get_or_create_tags(self, user_id: int, names: List[str]) -> List[Tag]:
+        """
+        Get tags by name for a user, creating the missing ones. A tag created
+        by a concurrent request in the meantime is used rather than violating
+        the (user_id, name) unique constraint.
+        """
+        tag_names = normalize_tag_names(names)
+        if not tag_names:
+            return []
+
+        query = select(Tag).filter(Tag.user_id == user_id, Tag.name.in_(tag_names))
+        existing = {tag.name: tag for tag in (await self.db.execute(query)).scalars()}
+        missing = [name for name in tag_names if name not in existing]
+        if missing:
+            dialect = (await self.db.connection()).dialect.name
+            insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+            await self.db.execute(
+                insert(Tag)
+                .values([{"user_id": user_id, "name": name} for name in missing])
+                .on_conflict_do_nothing(index_elements=["user_id", "name"])
+            )
+            existing.update(
+                (tag.name, tag) for tag in (await self.db.execute(query)).scalars()
+            )
+        return [existing[name] for name in tag_names]
+
     async def get_todo_by_id(self, todo_id: int, user_id: int) -> Optional[Todo]:
         """Get a specific todo by ID for a user"""
         query = select(Todo).filter(Todo.id == todo_id, Todo.user_id == user_id)
@@ -40,19 +246,33 @@ class TodoService:
         priority: int = 1,
         due_date: Optional[datetime] = None,
         is_ai_generated: bool = False,
+        tags: Optional[List[str]] = None,
     ) -> Todo:
-        """Create a new todo for a user"""
-        todo = Todo(
-            user_id=user_id,
-            title=title,
-            description=description,
-            priority=priority,
-            due_date=due_date,
-            is_ai_generated=is_ai_generated,
-        )
-        self.db.add(todo)
-        await self.db.commit()
+        """Create a new todo for a user, at the end of the manual order"""
+        self.validate(title=title, priority=priority)
+
+        async def create() -> Tuple[Todo, np.ndarray]:
+            todo = Todo(
+                user_id=user_id,
+                title=title,
+                description=description,
+                priority=priority,
+                due_date=due_date,
+                is_ai_generated=is_ai_generated,
+                tags=await self.get_or_create_tags(user_id, tags or []),
+                rank=key_between(await self.get_last_rank(user_id), None),
+            )
+            self.db.add(todo)
+            await self.db.flush()
+            vector = await EmbeddingService(self.db).stage(todo, created=True)
+            await self.db.commit()
+            return todo, vector
+
+        todo, vector = await retry_rank_conflicts(self.db, create)
         await self.db.refresh(todo)
+        vector_index.upsert(user_id, todo.id, vector)
+        if due_date is not None:
+            due_reminders.todo_changed(todo)
         return todo
 
     async def update_todo(
@@ -64,8 +284,10 @@ class TodoService:
         status: Optional[TodoStatus] = None,
         priority: Optional[int] = None,
         due_date: Optional[datetime] = None,
+        tags: Optional[List[str]] = None,
     ) -> Optional[Todo]:
         """Update a todo for a user"""
+        self.validate(title=title, priority=priority)
         todo = await self.get_todo_by_id(todo_id, user_id)
         if not todo:
             return None
@@ -84,9 +306,22 @@ class TodoService:
             todo.priority = priority
         if due_date is not None:
             todo.due_date = due_date
+        if tags is not None:
+            todo.tags = await self.get_or_create_tags(user_id, tags)
+
+        # Re-embed only when the embedded text changed
+        vector = (
+            await EmbeddingService(self.db).stage(todo)
+            if title is not None or description is not None
+            else None
+        )
 
         await self.db.commit()
         await self.db.refresh(todo)
+        if vector is not None:
+            vector_index.upsert(user_id, todo.id, vector)
+        if status is not None or due_date is not None:
+            due_reminders.todo_changed(todo)
         return todo
 
     async def toggle_todo_status(self, todo_id: int, user_id: int) -> Optional[Todo]:
@@ -104,6 +339,102 @@ class TodoService:
 
         await self.db.commit()
         await self.db.refresh(todo)
+        due_reminders.todo_changed(todo)
+        return todo
+
+    async def get_last_rank(self, user_id: int) -> Optional[str]:
+        """Get the highest rank key of a user's todos"""
+        result = await self.db.execute(
+            select(func.max(Todo.rank)).filter(Todo.user_id == user_id)
+        )
+        return result.scalar()
+
+    async def _adjacent_rank(
+        self,
+        user_id: int,
+        exclude_id: int,
+        below: Optional[str] = None,
+        above: Optional[str] = None,
+    ) -> Optional[str]:
+        """Get the nearest rank key strictly above `below` or strictly below `above`"""
+        if below is not None:
+            query = select(func.min(Todo.rank)).filter(Todo.rank > below)
+        elif above is not None:
+            query = select(func.max(Todo.rank)).filter(Todo.rank < above)
+        else:
+            query = select(func.max(Todo.rank))
+        query = query.filter(Todo.user_id == user_id, Todo.id != exclude_id)
+        result = await self.db.execute(query)
+        return result.scalar()
+
+    async def move_todo(
+        self,
+        todo_id: int,
+        user_id: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> Optional[Todo]:
+        """
+        Move a todo in the manual order.
+        before_id is the todo that should end up right before it and after_id
+        the one right after it; omit one to use its current neighbour, or both
+        to move the todo to the end. Only the moved todo's row is updated.
+        """
+        todo = await retry_rank_conflicts(
+            self.db, lambda: self._move(todo_id, user_id, before_id, after_id)
+        )
+        if not todo:
+            return None
+        await self.db.refresh(todo)
+
+        if len(todo.rank) > settings.TODO_RANK_REBALANCE_LENGTH:
+            schedule_rank_rebalance(user_id)
+        return todo
+
+    async def _move(
+        self,
+        todo_id: int,
+        user_id: int,
+        before_id: Optional[int],
+        after_id: Optional[int],
+    ) -> Optional[Todo]:
+        """Give a todo a rank key between its new neighbours and commit"""
+        todo = await self.get_todo_by_id(todo_id, user_id)
+        if not todo:
+            return None
+
+        neighbor_ids = [i for i in (before_id, after_id) if i is not None]
+        if todo_id in neighbor_ids:
+            raise ValueError("A todo cannot be moved relative to itself")
+
+        ranks = {}
+        if neighbor_ids:
+            result = await self.db.execute(
+                select(Todo.id, Todo.rank).filter(
+                    Todo.id.in_(neighbor_ids), Todo.user_id == user_id
+                )
+            )
+            ranks = dict(result.all())
+            missing = [i for i in neighbor_ids if i not in ranks]
+            if missing:
+                raise ValueError(f"Todo not found: {missing[0]}")
+
+        lower = ranks.get(before_id)
+        upper = ranks.get(after_id)
+        if before_id is not None and after_id is None:
+            upper = await self._adjacent_rank(user_id, todo_id, below=lower)
+        elif after_id is not None and before_id is None:
+            lower = await self._adjacent_rank(user_id, todo_id, above=upper)
+        elif before_id is None and after_id is None:
+            lower = await self._adjacent_rank(user_id, todo_id)
+
+        if lower is not None and upper is not None and lower >= upper:
+            raise ValueError(
+                "The todo placed before must come ahead of the todo placed after"
+            )
+
+        todo.rank = key_between(lower, upper)
+        await self.db.commit()
         return todo
 
     async def delete_todo(self, todo_id: int, user_id: int) -> bool:
@@ -112,6 +443,9 @@ class TodoService:
         if not todo:
             return False
 
+        await EmbeddingService(self.db).delete([todo_id])
         await self.db.delete(todo)
         await self.db.commit()
-        return True
\ No newline at end of file
+        vector_index.remove(user_id, [todo_id])
+        due_reminders.todo_deleted(todo_id, user_id)
+        return True
@@ -0,0 +1,280 @@
+"""
+End-to-end latency of AI suggestions against the local fake OpenAI endpoint.
+
+Runs closed loops of generateTodoSuggestion at increasing concurrency
+against the real app, in-process or in a subprocess as in graphql_load,
+with LLMService pointed at benchmarks.fake_openai through
+OPENAI_BASE_URL. For each level, the app's end-to-end latency is set
+against the upstream latency the fake logged for the same period, which
+leaves the app's own overhead (prompt context, queueing, the OpenAI
+client), and the fake's peak in-flight requests show how much
+concurrency reaches the LLM (admission control sheds some, hedging adds
+some). The fake's behaviour comes from the options below or from a
+profile file (see benchmarks.fake_openai). Use a throwaway database, as
+it is migrated and seeded.
+
+    USE_SQLITE=true SQLITE_DB_FILE=bench.db OPENAI_API_KEY=unused \\
+        python -m benchmarks.ai_latency --concurrency 1,4,16,64 --llm-latency-ms 300 \\
+        --latency-distribution lognormal --latency-spread 0.5 --output ai.json
+    python -m benchmarks.ai_latency --server prefork --workers 2 \\
+        --llm-profile scenario.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import time
+from collections import Counter
+from dataclasses import asdict
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+from benchmarks.fake_openai import (
+    LATENCY_DISTRIBUTIONS,
+    FakeProfile,
+    RequestLog,
+    load_profile,
+    start_in_thread,
+)
+from benchmarks.graphql_load import QUERIES, failed, prepare, start_server
+from benchmarks.llm_resilience import percentile
+
+OPERATION = "generateTodoSuggestion"
+
+
+def _percentiles(values: List[float], scale: float = 1000) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {
+        "p50_ms": percentile(values, 0.50) * scale,
+        "p95_ms": percentile(values, 0.95) * scale,
+        "p99_ms": percentile(values, 0.99) * scale,
+    }
+
+
+async def drive(
+    client: httpx.AsyncClient, concurrency: int, duration: float, warmup: float
+) -> Tuple[List[float], Dict[str, int], float]:
+    """
+    Run a closed loop of concurrent clients; returns the latencies of the
+    suggestions that succeeded and the errors by kind, recorded after the
+    warmup, and the measured time. A client that is shed waits as long as
+    Retry-After says, as the frontend would, rather than retrying at once.
+    """
+    latencies: List[float] = []
+    errors: Counter = Counter()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    end = measure_from + duration
+
+    async def user() -> None:
+        while time.perf_counter() < end:
+            request_started = time.perf_counter()
+            response = await client.post("/graphql", json={"query": QUERIES[OPERATION]})
+            elapsed = time.perf_counter() - request_started
+            error = failed(OPERATION, response)
+            if request_started >= measure_from:
+                if error:
+                    errors[error] += 1
+                else:
+                    latencies.append(elapsed)
+            if response.status_code == 503:
+                await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - measure_from
+
+
+def summarize_level(
+    latencies: List[float],
+    errors: Dict[str, int],
+    elapsed: float,
+    upstream: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """End-to-end and upstream latency of one concurrency level, and their difference"""
+    e2e = _percentiles(latencies)
+    upstream_ok = [
+        entry["duration_ms"] for entry in upstream if entry["outcome"] == "ok"
+    ]
+    upstream_latency = _percentiles(upstream_ok, scale=1)
+    summary = {
+        "count": len(latencies),
+        "errors": sum(errors.values()),
+        "error_kinds": dict(errors),
+        # Suggestions per second, not counting errors
+        "throughput_rps": len(latencies) / elapsed,
+        "e2e": e2e,
+        "upstream": {
+            "requests": len(upstream),
+            "outcomes": dict(Counter(entry["outcome"] for entry in upstream)),
+            "peak_in_flight": max(
+                (entry["in_flight"] for entry in upstream), default=0
+            ),
+            "ttft": _percentiles(
+                [
+                    entry["ttft_ms"]
+                    for entry in upstream
+                    if entry["ttft_ms"] is not None
+                ],
+                scale=1,
+            ),
+            "latency": upstream_latency,
+        },
+    }
+    if e2e and upstream_latency:
+        # Percentiles do not subtract exactly, but the median is a fair estimate
+        summary["overhead_p50_ms"] = e2e["p50_ms"] - upstream_latency["p50_ms"]
+    return summary
+
+
+async def run_levels(
+    client: httpx.AsyncClient, log: RequestLog, args: argparse.Namespace
+) -> Dict[str, Any]:
+    levels = {}
+    for concurrency in args.concurrency:
+        # Upstream requests of the warmup, and of the previous level's last
+        # clients, are left out along with their end-to-end latencies
+        measure_from = time.time() + args.warmup
+        latencies, errors, elapsed = await drive(
+            client, concurrency, args.duration, args.warmup
+        )
+        upstream = [
+            entry
+            for entry in log.snapshot(since=measure_from)
+            if entry["started_at"] <= measure_from + elapsed
+        ]
+        levels[str(concurrency)] = summarize_level(latencies, errors, elapsed, upstream)
+        print_level(concurrency, levels[str(concurrency)])
+    return levels
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from app.core.config import settings
+
+    if args.llm_profile:
+        profile, phases = load_profile(args.llm_profile)
+    else:
+        profile, phases = FakeProfile(), []
+        profile.update(
+            {
+                "latency_ms": args.llm_latency_ms,
+                "latency_distribution": args.latency_distribution,
+                "latency_spread": args.latency_spread,
+                "tokens_per_second": args.tokens_per_second,
+                "error_rate": args.error_rate,
+            }
+        )
+    initial_profile = asdict(profile)
+    log = RequestLog()
+    settings.OPENAI_BASE_URL = start_in_thread(profile, args.seed, log, phases)
+    # Todos for the prompt context
+    await prepare(args.todos, args.seed)
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+
+    print(
+        f"{'concurrency':>11} {'rps':>7} {'errors':>6} "
+        f"{'e2e p50':>8} {'p95':>8} {'p99':>8} "
+        f"{'llm p50':>8} {'p95':>8} {'overhead':>8} {'llm peak':>8}"
+    )
+    if args.server != "inprocess":
+        process, base_url = start_server(args.workers, args.server)
+        try:
+            async with httpx.AsyncClient(
+                base_url=base_url, limits=limits, timeout=None
+            ) as client:
+                levels = await run_levels(client, log, args)
+        finally:
+            process.terminate()
+            process.wait()
+    else:
+        from app.main import app
+
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                transport=transport,
+                base_url=f"http://bench{settings.API_V1_STR}",
+                timeout=None,
+            ) as client:
+                levels = await run_levels(client, log, args)
+
+    return {
+        "levels": levels,
+        "config": {
+            "server": args.server,
+            "workers": args.workers if args.server != "inprocess" else 1,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "llm_profile": args.llm_profile,
+            "fake_profile": initial_profile,
+            "suggestion_routing": settings.SUGGESTION_ROUTING,
+            "hedge_delay_ms": settings.LLM_HEDGE_DELAY_MS,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "started_at": datetime.utcnow().isoformat(),
+        },
+    }
+
+
+def print_level(concurrency: int, level: Dict[str, Any]) -> None:
+    e2e, upstream = level["e2e"], level["upstream"]["latency"]
+    print(
+        f"{concurrency:11d} {level['throughput_rps']:7.1f} {level['errors']:6d} "
+        f"{e2e.get('p50_ms', 0):8.1f} {e2e.get('p95_ms', 0):8.1f} "
+        f"{e2e.get('p99_ms', 0):8.1f} "
+        f"{upstream.get('p50_ms', 0):8.1f} {upstream.get('p95_ms', 0):8.1f} "
+        f"{level.get('overhead_p50_ms', 0):8.1f} "
+        f"{level['upstream']['peak_in_flight']:8d}"
+    )
+    if level["error_kinds"]:
+        print(f"{'':11} errors: {level['error_kinds']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="End-to-end AI suggestion latency benchmark"
+    )
+    parser.add_argument(
+        "--server", choices=["inprocess", "uvicorn", "prefork"], default="inprocess"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Server worker processes"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 4, 16, 64],
+        help="Comma-separated concurrency levels, run in turn",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Measured seconds per level"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=2.0, help="Unmeasured seconds per level"
+    )
+    parser.add_argument(
+        "--todos", type=int, default=200, help="Todos the demo user starts with"
+    )
+    parser.add_argument(
+        "--llm-profile", help="Fake OpenAI profile file; overrides the options below"
+    )
+    parser.add_argument(
+        "--llm-latency-ms", type=float, default=300.0, help="Time to first token"
+    )
+    parser.add_argument(
+        "--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="constant"
+    )
+    parser.add_argument("--latency-spread", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
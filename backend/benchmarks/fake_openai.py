@@ -0,0 +1,460 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint.
+
+Serves POST /v1/chat/completions, streamed (server-sent events, as with
+stream=True) or not, so the LLM path can be exercised offline. Point the
+app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+The time to first token is drawn from a latency distribution, with an
+optional slow tail; the remaining tokens follow at a fixed rate, and a
+non-streamed answer is sent once they are all generated. Faults are
+injected at given rates: error responses, requests that never get an
+answer, and streams that stall after their first token. A profile can
+be loaded from a JSON file, with phases that change it at given seconds
+after startup, and changed while running with PUT /_fake/profile.
+Every request is logged with its outcome, time to first token, duration
+and the number of requests in flight when it arrived: GET /_fake/requests
+returns the log, and --log-file appends it as JSON lines.
+
+    python -m benchmarks.fake_openai --port 8001 --latency-ms 200 --error-rate 0.05
+    python -m benchmarks.fake_openai --latency-distribution lognormal \\
+        --latency-spread 0.5 --tokens-per-second 40 --profile scenario.json \\
+        --log-file requests.jsonl
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, fields
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+
+SUGGESTIONS = [
+    "How about adding 'Prepare agenda for the team meeting'? List the topics to cover.",
+    "Consider adding 'Follow up on the project proposal' "
+    "to check the client's feedback.",
+    "How about 'Write release notes' summarizing the latest documentation changes?",
+]
+
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "normal", "lognormal", "exponential")
+ERROR_TYPES = {429: "rate_limit_error", 500: "server_error", 503: "server_error"}
+
+# Seconds a hung request or stalled stream waits; longer than any client timeout
+HANG_SECONDS = 3600
+
+
+@dataclass
+class FakeProfile:
+    """Latency, token rate and fault behaviour of the fake endpoint"""
+
+    # Time to first token (the whole answer when tokens_per_second is 0),
+    # drawn from latency_distribution: constant; uniform within
+    # latency_ms * (1 +- spread); normal with a standard deviation of
+    # latency_ms * spread; lognormal with median latency_ms and sigma
+    # spread; or exponential with mean latency_ms
+    latency_ms: float = 100.0
+    latency_distribution: str = "constant"
+    latency_spread: float = 0.0
+    # Fraction of requests that take slow_latency_ms instead
+    slow_rate: float = 0.0
+    slow_latency_ms: float = 5000.0
+    # Completion tokens generated per second after the first (0: all at once)
+    tokens_per_second: float = 0.0
+    # Fraction of requests answered with error_status (429 adds Retry-After)
+    error_rate: float = 0.0
+    error_status: int = 500
+    # Fraction of requests that never get an answer
+    hang_rate: float = 0.0
+    # Fraction of streamed requests that stop after their first token
+    stall_rate: float = 0.0
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """Seconds to the first token of a request"""
+        if rng.random() < self.slow_rate:
+            return self.slow_latency_ms / 1000
+        if self.latency_distribution == "uniform":
+            latency = (
+                rng.uniform(1 - self.latency_spread, 1 + self.latency_spread)
+                * self.latency_ms
+            )
+        elif self.latency_distribution == "normal":
+            latency = rng.gauss(self.latency_ms, self.latency_spread * self.latency_ms)
+        elif self.latency_distribution == "lognormal":
+            latency = self.latency_ms * rng.lognormvariate(0, self.latency_spread)
+        elif self.latency_distribution == "exponential":
+            latency = (
+                rng.expovariate(1 / self.latency_ms) if self.latency_ms > 0 else 0.0
+            )
+        else:
+            latency = self.latency_ms
+        return max(0.0, latency) / 1000
+
+    def update(self, values: Dict[str, Any]) -> None:
+        """Change the given fields, rejecting unknown ones"""
+        known = {field.name for field in fields(self)}
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"Unknown profile fields: {', '.join(sorted(unknown))}")
+        if (
+            values.get("latency_distribution", self.latency_distribution)
+            not in LATENCY_DISTRIBUTIONS
+        ):
+            raise ValueError(
+                "latency_distribution must be one of "
+                + ", ".join(LATENCY_DISTRIBUTIONS)
+            )
+        self.__dict__.update(values)
+
+
+# (seconds after startup, profile fields to change)
+Phase = Tuple[float, Dict[str, Any]]
+
+
+def load_profile(path: str) -> Tuple[FakeProfile, List[Phase]]:
+    """
+    Read a profile from a JSON object of FakeProfile fields, with an
+    optional "phases" list of objects with "at_seconds" and the fields to
+    change then
+    """
+    with open(path) as f:
+        data = json.load(f)
+    phases = sorted(
+        (phase.pop("at_seconds"), phase) for phase in data.pop("phases", [])
+    )
+    profile = FakeProfile()
+    profile.update(data)
+    return profile, phases
+
+
+class RequestLog:
+    """Requests the fake served, newest last, and how many are in flight"""
+
+    def __init__(self, max_entries: int = 100_000, path: Optional[str] = None):
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=max_entries)
+        self.in_flight = 0
+        self.file = open(path, "a") if path else None
+        # Read from the benchmark's thread while the fake's appends
+        self.lock = threading.Lock()
+
+    def start(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Count a request as in flight; returns its entry, logged by finish()"""
+        self.in_flight += 1
+        return {
+            "started_at": time.time(),
+            "started": time.perf_counter(),
+            "stream": bool(body.get("stream")),
+            "model": body.get("model"),
+            "prompt_tokens": sum(
+                len(str(message.get("content", "")).split())
+                for message in body.get("messages", [])
+            ),
+            "in_flight": self.in_flight,
+        }
+
+    def finish(
+        self,
+        entry: Dict[str, Any],
+        outcome: str,
+        status: int,
+        completion_tokens: int = 0,
+        first_token: Optional[float] = None,
+    ) -> None:
+        """Log a request's outcome and timings"""
+        self.in_flight -= 1
+        started = entry.pop("started")
+        entry.update(
+            outcome=outcome,
+            status=status,
+            completion_tokens=completion_tokens,
+            ttft_ms=(first_token - started) * 1000 if first_token else None,
+            duration_ms=(time.perf_counter() - started) * 1000,
+        )
+        with self.lock:
+            self.entries.append(entry)
+        if self.file:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def snapshot(self, since: float = 0.0) -> List[Dict[str, Any]]:
+        """Entries of the requests that arrived at or after since (a Unix time)"""
+        with self.lock:
+            return [entry for entry in self.entries if entry["started_at"] >= since]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+def _tokens(text: str) -> List[str]:
+    """Words with their leading space, standing in for model tokens"""
+    return re.findall(r"\s*\S+", text)
+
+
+def _error(status: int) -> JSONResponse:
+    """An error response shaped like the API's"""
+    return JSONResponse(
+        status_code=status,
+        content={
+            "error": {
+                "message": "Injected fault",
+                "type": ERROR_TYPES.get(status, "invalid_request_error"),
+            }
+        },
+        headers={"retry-after": "1"} if status == 429 else None,
+    )
+
+
+def create_app(
+    profile: FakeProfile,
+    seed: int = 0,
+    log: Optional[RequestLog] = None,
+    phases: Sequence[Phase] = (),
+) -> FastAPI:
+    """Create the fake API; the profile may be changed while it runs"""
+    rng = random.Random(seed)
+    log = log or RequestLog()
+
+    async def run_phases() -> None:
+        started = time.perf_counter()
+        for at_seconds, values in phases:
+            await asyncio.sleep(max(0.0, started + at_seconds - time.perf_counter()))
+            profile.update(values)
+            print(f"Fake OpenAI at {at_seconds:g}s: {values}")
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        task = asyncio.create_task(run_phases())
+        yield
+        task.cancel()
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        try:
+            body = await request.json()
+        except ClientDisconnect:
+            # A hedged attempt that lost the race
+            return Response(status_code=499)
+        entry = log.start(body)
+        roll = rng.random()
+
+        if roll < profile.hang_rate:
+            try:
+                await asyncio.sleep(HANG_SECONDS)
+            finally:
+                log.finish(entry, "hang", 0)
+            return Response(status_code=504)
+        roll -= profile.hang_rate
+
+        latency = profile.sample_latency(rng)
+        if roll < profile.error_rate:
+            await asyncio.sleep(latency)
+            log.finish(entry, "error", profile.error_status)
+            return _error(profile.error_status)
+        roll -= profile.error_rate
+
+        content = rng.choice(SUGGESTIONS)
+        tokens = _tokens(content)
+        max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+        finish_reason = "stop"
+        if max_tokens and len(tokens) > max_tokens:
+            tokens, finish_reason = tokens[:max_tokens], "length"
+        token_interval = (
+            1 / profile.tokens_per_second if profile.tokens_per_second else 0.0
+        )
+        completion_id = f"chatcmpl-fake-{rng.getrandbits(32):08x}"
+        usage = {
+            "prompt_tokens": entry["prompt_tokens"],
+            "completion_tokens": len(tokens),
+            "total_tokens": entry["prompt_tokens"] + len(tokens),
+        }
+
+        if entry["stream"]:
+            stall = roll < profile.stall_rate
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            return StreamingResponse(
+                _stream(
+                    log,
+                    entry,
+                    completion_id,
+                    body.get("model", "fake"),
+                    tokens,
+                    finish_reason,
+                    latency,
+                    token_interval,
+                    stall,
+                    usage if include_usage else None,
+                ),
+                media_type="text/event-stream",
+            )
+
+        await asyncio.sleep(latency + token_interval * max(0, len(tokens) - 1))
+        log.finish(entry, "ok", 200, len(tokens), time.perf_counter())
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": finish_reason,
+                }
+            ],
+            "usage": usage,
+        }
+
+    @app.get("/_fake/profile")
+    async def get_profile():
+        return asdict(profile)
+
+    @app.put("/_fake/profile")
+    async def put_profile(request: Request):
+        try:
+            profile.update(await request.json())
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"detail": str(e)})
+        return asdict(profile)
+
+    @app.get("/_fake/requests")
+    async def get_requests(since: float = 0.0):
+        return log.snapshot(since)
+
+    @app.delete("/_fake/requests")
+    async def clear_requests():
+        log.clear()
+        return Response(status_code=204)
+
+    return app
+
+
+async def _stream(
+    log: RequestLog,
+    entry: Dict[str, Any],
+    completion_id: str,
+    model: str,
+    tokens: List[str],
+    finish_reason: str,
+    latency: float,
+    token_interval: float,
+    stall: bool,
+    usage: Optional[Dict[str, int]],
+) -> AsyncIterator[str]:
+    """Server-sent events of a streamed completion, as chat.completion.chunk objects"""
+    created = int(time.time())
+
+    def event(choices: List[Dict[str, Any]], **extra: Any) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": choices,
+            **extra,
+        }
+        return f"data: {json.dumps(data)}\n\n"
+
+    def chunk(delta: Dict[str, str], reason: Optional[str] = None) -> str:
+        return event([{"index": 0, "delta": delta, "finish_reason": reason}])
+
+    outcome = "disconnected"
+    first_token = None
+    sent = 0
+    try:
+        await asyncio.sleep(latency)
+        first_token = time.perf_counter()
+        yield chunk({"role": "assistant", "content": tokens[0] if tokens else ""})
+        sent = min(1, len(tokens))
+        if stall:
+            outcome = "stall"
+            await asyncio.sleep(HANG_SECONDS)
+        for token in tokens[1:]:
+            if token_interval:
+                await asyncio.sleep(token_interval)
+            yield chunk({"content": token})
+            sent += 1
+        yield chunk({}, finish_reason)
+        if usage:
+            yield event([], usage=usage)
+        yield "data: [DONE]\n\n"
+        outcome = "ok"
+    finally:
+        log.finish(entry, outcome, 200, sent, first_token)
+
+
+def start_in_thread(
+    profile: FakeProfile,
+    seed: int = 0,
+    log: Optional[RequestLog] = None,
+    phases: Sequence[Phase] = (),
+) -> str:
+    """Serve the fake API from a background thread; returns its base URL"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            create_app(profile, seed, log, phases),
+            host="127.0.0.1",
+            port=port,
+            log_level="warning",
+        )
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a fake OpenAI chat completions API"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument(
+        "--profile", help="JSON file with profile fields and optional phases"
+    )
+    # One option per profile field, overriding the profile file
+    for field in fields(FakeProfile):
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}",
+            type=type(field.default),
+            choices=LATENCY_DISTRIBUTIONS
+            if field.name == "latency_distribution"
+            else None,
+        )
+    parser.add_argument(
+        "--log-file", help="Append each request to this file as a JSON line"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    profile, phases = (
+        load_profile(args.profile) if args.profile else (FakeProfile(), [])
+    )
+    profile.update(
+        {
+            field.name: getattr(args, field.name)
+            for field in fields(FakeProfile)
+            if getattr(args, field.name) is not None
+        }
+    )
+    uvicorn.run(
+        create_app(profile, args.seed, RequestLog(path=args.log_file), phases),
+        host=args.host,
+        port=args.port,
+    )
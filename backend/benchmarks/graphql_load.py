@@ -0,0 +1,496 @@
+"""
+End-to-end GraphQL load benchmark.
+
+Drives a weighted mix of GraphQL operations against the real app, either
+in-process through an ASGI transport or in a subprocess (uvicorn, or the
+pre-forked workers of app.server), with generateTodoSuggestion answered
+by the local fake OpenAI endpoint. The
+database is whatever the settings point at (SQLite or Postgres); use a
+throwaway one, as it is migrated, seeded and written to.
+
+Writes throughput and p50/p95/p99 latency per operation as JSON, and can
+compare two such results, exiting with status 1 on a regression:
+
+    USE_SQLITE=true SQLITE_DB_FILE=bench.db OPENAI_API_KEY=unused \\
+        python -m benchmarks.graphql_load run --duration 30 --output base.json
+    python -m benchmarks.graphql_load run --server uvicorn --output new.json \\
+        --mix todos=50,createTodo=25,generateTodoSuggestion=25
+    python -m benchmarks.graphql_load compare base.json new.json --threshold 0.1
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.fake_openai import FakeProfile, start_in_thread
+from benchmarks.llm_resilience import percentile
+from benchmarks.startup import free_port
+
+TODO_FIELDS = (
+    "id title description status priority dueDate isAiGenerated "
+    "createdAt updatedAt completedAt"
+)
+
+QUERIES = {
+    "todos": (
+        f"query Todos($limit: Int!) {{ todos(limit: $limit) {{ {TODO_FIELDS} }} }}"
+    ),
+    "todo": f"query Todo($id: Int!) {{ todo(id: $id) {{ {TODO_FIELDS} }} }}",
+    "createTodo": (
+        "mutation CreateTodo($input: CreateTodoInput!) "
+        f"{{ createTodo(input: $input) {{ todo {{ {TODO_FIELDS} }} }} }}"
+    ),
+    "updateTodo": (
+        "mutation UpdateTodo($input: UpdateTodoInput!) "
+        f"{{ updateTodo(input: $input) {{ todo {{ {TODO_FIELDS} }} }} }}"
+    ),
+    "toggleTodoStatus": (
+        "mutation Toggle($id: Int!) "
+        f"{{ toggleTodoStatus(id: $id) {{ todo {{ {TODO_FIELDS} }} }} }}"
+    ),
+    "deleteTodo": "mutation Delete($id: Int!) { deleteTodo(id: $id) { success id } }",
+    "generateTodoSuggestion": (
+        "mutation Suggest "
+        "{ generateTodoSuggestion { suggestion error { code message } } }"
+    ),
+}
+
+DEFAULT_MIX = (
+    "todos=40,todo=20,createTodo=10,updateTodo=10,toggleTodoStatus=10,"
+    "deleteTodo=5,generateTodoSuggestion=5"
+)
+
+# Metrics compared between runs; for latencies higher is worse
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse an operation mix like "todos=80,createTodo=20" into weights"""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in QUERIES:
+            raise argparse.ArgumentTypeError(
+                f"Unknown operation {name.strip()!r}; choose from {', '.join(QUERIES)}"
+            )
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Workload:
+    """
+    Builds the variables of each operation from a pool of known todo ids,
+    which creates grow and deletes shrink
+    """
+
+    def __init__(self, todo_ids: List[int], page_size: int, seed: int):
+        self.todo_ids = list(todo_ids)
+        self.page_size = page_size
+        self.rng = random.Random(seed)
+
+    def next_operation(self, mix: Dict[str, float]) -> str:
+        """Pick an operation by weight; deletes need a todo to spare"""
+        operation = self.rng.choices(list(mix), weights=list(mix.values()))[0]
+        if (
+            operation in ("todo", "updateTodo", "toggleTodoStatus", "deleteTodo")
+            and len(self.todo_ids) < 2
+        ):
+            return "createTodo"
+        return operation
+
+    def variables(self, operation: str) -> Dict[str, Any]:
+        """Variables for one request of an operation"""
+        if operation == "todos":
+            return {"limit": self.page_size}
+        if operation == "createTodo":
+            return {
+                "input": {
+                    "title": f"Load test todo {self.rng.getrandbits(32):08x}",
+                    "description": "Created by the GraphQL load benchmark",
+                    "priority": self.rng.randint(1, 3),
+                }
+            }
+        if operation == "updateTodo":
+            return {
+                "input": {
+                    "id": self.rng.choice(self.todo_ids),
+                    "title": f"Updated todo {self.rng.getrandbits(32):08x}",
+                    "priority": self.rng.randint(1, 3),
+                }
+            }
+        if operation == "deleteTodo":
+            # Removed up front so that no other request picks it meanwhile
+            return {"id": self.todo_ids.pop(self.rng.randrange(len(self.todo_ids)))}
+        if operation in ("todo", "toggleTodoStatus"):
+            return {"id": self.rng.choice(self.todo_ids)}
+        return {}
+
+    def record(self, operation: str, data: Dict[str, Any]) -> None:
+        """Track the ids of created todos"""
+        if operation == "createTodo":
+            self.todo_ids.append(data["createTodo"]["todo"]["id"])
+
+
+def failed(operation: str, response: httpx.Response) -> Optional[str]:
+    """Why a response counts as an error, if it does"""
+    if response.status_code != 200:
+        return f"HTTP {response.status_code}"
+    body = response.json()
+    if body.get("errors"):
+        return body["errors"][0]["message"]
+    if (
+        operation == "generateTodoSuggestion"
+        and body["data"]["generateTodoSuggestion"]["error"]
+    ):
+        return body["data"]["generateTodoSuggestion"]["error"]["code"]
+    return None
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    workload: Workload,
+    mix: Dict[str, float],
+    concurrency: int,
+    duration: float,
+    warmup: float,
+) -> Tuple[Dict[str, List[float]], Dict[str, Dict[str, int]], float]:
+    """
+    Run a closed loop of concurrent clients; returns latencies and error
+    counts per operation, recorded after the warmup, and the measured time
+    """
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    started = time.perf_counter()
+    measure_from = started + warmup
+    end = measure_from + duration
+
+    async def user() -> None:
+        while time.perf_counter() < end:
+            operation = workload.next_operation(mix)
+            request_started = time.perf_counter()
+            response = await client.post(
+                "/graphql",
+                json={
+                    "query": QUERIES[operation],
+                    "variables": workload.variables(operation),
+                },
+            )
+            elapsed = time.perf_counter() - request_started
+            error = failed(operation, response)
+            if error is None:
+                workload.record(operation, response.json()["data"])
+            if request_started >= measure_from:
+                latencies[operation].append(elapsed)
+                if error:
+                    errors[operation][error] += 1
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - measure_from
+
+
+def summarize(
+    latencies: Dict[str, List[float]], errors: Dict[str, Dict[str, int]], elapsed: float
+) -> Dict[str, Any]:
+    """Throughput and latency percentiles per operation and overall"""
+    operations = {}
+    for operation, values in sorted(latencies.items()):
+        operations[operation] = {
+            "count": len(values),
+            "errors": sum(errors[operation].values()),
+            "error_kinds": dict(errors[operation]),
+            "throughput_rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "mean_ms": sum(values) / len(values) * 1000,
+            "max_ms": max(values) * 1000,
+        }
+    everything = [value for values in latencies.values() for value in values]
+    total = {
+        "count": len(everything),
+        "errors": sum(operation["errors"] for operation in operations.values()),
+        "throughput_rps": len(everything) / elapsed,
+    }
+    if everything:
+        total.update(
+            p50_ms=percentile(everything, 0.50) * 1000,
+            p95_ms=percentile(everything, 0.95) * 1000,
+            p99_ms=percentile(everything, 0.99) * 1000,
+        )
+    return {"total": total, "operations": operations}
+
+
+async def prepare(todos: int, seed: int) -> List[int]:
+    """Migrate and seed the database and give the demo user todos; returns their ids"""
+    from sqlalchemy import func, select
+
+    from app.db.generate import generate_driver_rows, write_rows
+    from app.db.migrations import migrate
+    from app.db.models import Todo
+    from app.db.seed import seed_database
+    from app.db.session import SessionLocal, engine
+    from app.services.ranking import key_between
+
+    await migrate()
+    await seed_database()
+    async with SessionLocal() as session:
+        # The API serves user 1 until authentication exists
+        existing = (
+            await session.execute(select(func.count()).where(Todo.user_id == 1))
+        ).scalar()
+        if existing < todos:
+            rows = generate_driver_rows(
+                seed, datetime.utcnow(), todos - existing, engine.dialect.name, [(0, 1)]
+            )
+            # Rank keys are unique per user: order the new todos after the
+            # existing ones rather than at the generated keys
+            last_rank = (
+                await session.execute(
+                    select(func.max(Todo.rank)).where(Todo.user_id == 1)
+                )
+            ).scalar()
+            ranked = []
+            for row in rows:
+                last_rank = key_between(last_rank, None)
+                ranked.append(row[:-1] + (last_rank,))
+            await write_rows(ranked)
+        ids = (
+            (await session.execute(select(Todo.id).where(Todo.user_id == 1)))
+            .scalars()
+            .all()
+        )
+    await engine.dispose()
+    return list(ids)
+
+
+def start_server(
+    workers: int, launcher: str = "uvicorn"
+) -> Tuple[subprocess.Popen, str]:
+    """
+    Serve the app from a subprocess, uvicorn's own or app.server's
+    pre-forked workers; returns it and its API base URL
+    """
+    from app.core.config import settings
+
+    port = free_port()
+    env = dict(os.environ, OPENAI_BASE_URL=settings.OPENAI_BASE_URL)
+    command = ["uvicorn", "app.main:app"] if launcher == "uvicorn" else ["app.server"]
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            *command,
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.perf_counter() + 60
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=0.5).status_code == 200:
+                return process, f"{base_url}{settings.API_V1_STR}"
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    process.terminate()
+    raise TimeoutError("Server did not become ready")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from app.core.config import settings
+
+    settings.OPENAI_BASE_URL = start_in_thread(
+        FakeProfile(latency_ms=args.llm_latency_ms)
+    )
+    todo_ids = await prepare(args.todos, args.seed)
+    workload = Workload(todo_ids, args.page_size, args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    if args.server != "inprocess":
+        process, base_url = start_server(args.workers, args.server)
+        try:
+            async with httpx.AsyncClient(
+                base_url=base_url, limits=limits, timeout=None
+            ) as client:
+                measured = await drive(
+                    client,
+                    workload,
+                    args.mix,
+                    args.concurrency,
+                    args.duration,
+                    args.warmup,
+                )
+        finally:
+            process.terminate()
+            process.wait()
+    else:
+        from app.main import app
+
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                transport=transport,
+                base_url=f"http://bench{settings.API_V1_STR}",
+                timeout=None,
+            ) as client:
+                measured = await drive(
+                    client,
+                    workload,
+                    args.mix,
+                    args.concurrency,
+                    args.duration,
+                    args.warmup,
+                )
+
+    from app.db.session import engine
+
+    result = summarize(*measured)
+    result["config"] = {
+        "server": args.server,
+        "workers": args.workers if args.server != "inprocess" else 1,
+        "database": engine.dialect.name,
+        "mix": args.mix,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "warmup_s": args.warmup,
+        "todos": args.todos,
+        "page_size": args.page_size,
+        "llm_latency_ms": args.llm_latency_ms,
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "started_at": datetime.utcnow().isoformat(),
+    }
+    return result
+
+
+def print_summary(result: Dict[str, Any]) -> None:
+    print(
+        f"{'operation':24} {'count':>7} {'errors':>6} {'rps':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    rows = list(result["operations"].items()) + [("total", result["total"])]
+    for name, stats in rows:
+        print(
+            f"{name:24} {stats['count']:7d} {stats['errors']:6d} "
+            f"{stats['throughput_rps']:8.1f} {stats.get('p50_ms', 0):8.1f} "
+            f"{stats.get('p95_ms', 0):8.1f} {stats.get('p99_ms', 0):8.1f}"
+        )
+
+
+def compare(
+    base: Dict[str, Any], new: Dict[str, Any], threshold: float, min_delta_ms: float
+) -> List[str]:
+    """
+    Regressions of new against base: a latency percentile that grew, or a
+    throughput that dropped, by more than threshold (a fraction). Latency
+    changes under min_delta_ms are ignored as noise.
+    """
+    regressions = []
+    operations = dict(base["operations"], total=base["total"])
+    new_operations = dict(new["operations"], total=new["total"])
+    print(f"{'operation':24} {'metric':>14} {'base':>9} {'new':>9} {'change':>8}")
+    for name, before in operations.items():
+        after = new_operations.get(name)
+        if after is None:
+            continue
+        for metric in LATENCY_METRICS + ("throughput_rps",):
+            if metric not in before or metric not in after:
+                continue
+            change = (
+                (after[metric] - before[metric]) / before[metric]
+                if before[metric]
+                else 0.0
+            )
+            if metric == "throughput_rps":
+                regressed = change < -threshold
+            else:
+                regressed = (
+                    change > threshold
+                    and after[metric] - before[metric] >= min_delta_ms
+                )
+            flag = "  REGRESSION" if regressed else ""
+            print(
+                f"{name:24} {metric:>14} {before[metric]:9.1f} "
+                f"{after[metric]:9.1f} {change:+8.1%}{flag}"
+            )
+            if regressed:
+                regressions.append(f"{name} {metric} {change:+.1%}")
+        if after["errors"] > before["errors"]:
+            regressions.append(f"{name} errors {before['errors']} -> {after['errors']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GraphQL load benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmark")
+    run_parser.add_argument(
+        "--server", choices=["inprocess", "uvicorn", "prefork"], default="inprocess"
+    )
+    run_parser.add_argument(
+        "--workers", type=int, default=1, help="Server worker processes"
+    )
+    run_parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument(
+        "--duration", type=float, default=20.0, help="Measured seconds"
+    )
+    run_parser.add_argument(
+        "--warmup", type=float, default=3.0, help="Unmeasured seconds first"
+    )
+    run_parser.add_argument(
+        "--todos", type=int, default=1000, help="Todos the demo user starts with"
+    )
+    run_parser.add_argument(
+        "--page-size", type=int, default=100, help="Limit of todos queries"
+    )
+    run_parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    compare_parser = commands.add_parser(
+        "compare", help="Flag regressions between two runs"
+    )
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Tolerated relative change"
+    )
+    compare_parser.add_argument("--min-delta-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        result = asyncio.run(run(args))
+        print_summary(result)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): " + "; ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions")
@@ -0,0 +1,131 @@
+"""
+Import-time profile and budget check for app startup.
+
+Imports a module (app.main by default) in fresh interpreters with
+`python -X importtime`, and prints the median cost of the slowest modules
+and of each top-level package. Exits with status 1 when the total import
+time exceeds the budget (DEFAULT_BUDGET_MS unless --budget-ms says
+otherwise) or a module that must be loaded lazily is imported, so it can
+gate CI.
+
+    OPENAI_API_KEY=unused python -m benchmarks.import_time --runs 5
+    OPENAI_API_KEY=unused python -m benchmarks.import_time \\
+        --module app.services.llm --budget-ms 600
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# Imported on first use only; loading them at startup is a regression
+LAZY_MODULES = ["openai", "httpx"]
+
+# Median import time of app.main allowed; it takes about 1 s on one CPU,
+# so this catches a large eager import rather than noise
+DEFAULT_BUDGET_MS = 1500
+
+
+def profile_imports(module: str) -> Dict[str, Tuple[int, int]]:
+    """Self and cumulative import time in microseconds of every module loaded"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def median_timings(
+    runs: List[Dict[str, Tuple[int, int]]]
+) -> Dict[str, Tuple[float, float]]:
+    """Median self and cumulative time of each module across runs"""
+    samples = defaultdict(list)
+    for run in runs:
+        for name, timing in run.items():
+            samples[name].append(timing)
+    return {
+        name: (
+            statistics.median(timing[0] for timing in timings),
+            statistics.median(timing[1] for timing in timings),
+        )
+        for name, timings in samples.items()
+    }
+
+
+def main(args: argparse.Namespace) -> int:
+    timings = median_timings([profile_imports(args.module) for _ in range(args.runs)])
+    total = timings[args.module][1]
+
+    slowest = sorted(timings.items(), key=lambda item: item[1][1], reverse=True)
+    print(f"Slowest {args.top} modules by cumulative time")
+    print(f"{'self ms':>9} {'cumul ms':>9} {'share':>6}  module")
+    for name, (self_us, cumulative_us) in slowest[: args.top]:
+        print(
+            f"{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f} "
+            f"{cumulative_us / total:6.1%}  {name}"
+        )
+
+    # A package's cost is the self time of all its modules, so nested
+    # imports of other packages are not counted twice
+    packages = defaultdict(lambda: [0.0, 0])
+    for name, (self_us, _) in timings.items():
+        package = packages[name.split(".")[0]]
+        package[0] += self_us
+        package[1] += 1
+    by_package = sorted(packages.items(), key=lambda item: item[1][0], reverse=True)
+    print(f"\nTop {args.top} packages by own time")
+    print(f"{'self ms':>9} {'share':>6} {'modules':>7}  package")
+    for name, (self_us, count) in by_package[: args.top]:
+        print(f"{self_us / 1000:9.1f} {self_us / total:6.1%} {count:7d}  {name}")
+
+    print(
+        f"\n{args.module}: {total / 1000:.0f} ms median over {args.runs} runs, "
+        f"{len(timings)} modules"
+    )
+    failed = False
+    eager = [name for name in args.lazy if name in timings]
+    if eager:
+        print(f"FAIL: imported at startup but should load lazily: {', '.join(eager)}")
+        failed = True
+    if args.budget_ms and total / 1000 > args.budget_ms:
+        print(f"FAIL: import time is over the budget of {args.budget_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Profile import time and check it against a budget"
+    )
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        help=(
+            "Fail above this median import time "
+            f"(default {DEFAULT_BUDGET_MS}; 0 disables)"
+        ),
+    )
+    parser.add_argument(
+        "--lazy",
+        nargs="*",
+        default=LAZY_MODULES,
+        help="Fail if any of these modules is imported",
+    )
+    args = parser.parse_args()
+
+    sys.exit(main(args))
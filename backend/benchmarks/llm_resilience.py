@@ -0,0 +1,98 @@
+"""
+Exercise LLMService's deadlines, hedging and circuit breaker against the
+local fake OpenAI endpoint under several upstream conditions.
+
+    OPENAI_API_KEY=unused python -m benchmarks.llm_resilience --requests 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+from typing import Dict, List
+
+from app.core.config import settings
+from app.services import llm
+from app.services.llm import LLMService
+from app.services.prompt_context import ContextTodo
+from app.db.models import TodoStatus
+from app.services.resilience import CircuitBreaker, Deadline
+from benchmarks.fake_openai import FakeProfile, start_in_thread
+
+SCENARIOS: Dict[str, FakeProfile] = {
+    "healthy": FakeProfile(latency_ms=100),
+    "slow-tail": FakeProfile(latency_ms=100, slow_rate=0.05, slow_latency_ms=8000),
+    "flaky": FakeProfile(latency_ms=100, error_rate=0.2),
+    "outage": FakeProfile(latency_ms=50, error_rate=1.0),
+    "blackhole": FakeProfile(hang_rate=1.0),
+}
+
+CONTEXT = [
+    ContextTodo(
+        "Complete project proposal", "Draft the proposal", TodoStatus.PENDING, 3, None
+    ),
+    ContextTodo("Review pull requests", None, TodoStatus.COMPLETED, 2, None),
+]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_scenario(
+    requests: int, concurrency: int, deadline_seconds: float
+) -> Dict:
+    """Send requests through LLMService and collect latencies and outcomes"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    outcomes: Counter = Counter()
+
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            result = await LLMService().generate_todo_suggestion(
+                CONTEXT, user_id=1, deadline=Deadline(deadline_seconds)
+            )
+            latencies.append(time.perf_counter() - started)
+            outcomes[result.error.code.value if result.error else "OK"] += 1
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return {
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "outcomes": dict(outcomes),
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    profile = FakeProfile()
+    settings.OPENAI_BASE_URL = start_in_thread(profile)
+    settings.LLM_HEDGE_DELAY_MS = args.hedge_delay_ms
+
+    for name, scenario in SCENARIOS.items():
+        profile.__dict__.update(scenario.__dict__)
+        llm.circuit_breaker = CircuitBreaker(
+            settings.LLM_CIRCUIT_FAILURE_THRESHOLD, settings.LLM_CIRCUIT_RESET_SECONDS
+        )
+        stats = await run_scenario(args.requests, args.concurrency, args.deadline)
+        print(
+            f"{name:10} p50 {stats['p50_ms']:7.0f} ms  p95 {stats['p95_ms']:7.0f} ms  "
+            f"p99 {stats['p99_ms']:7.0f} ms  {stats['outcomes']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM resilience scenarios")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--deadline", type=float, default=2.0, help="Per-request deadline (s)"
+    )
+    parser.add_argument("--hedge-delay-ms", type=int, default=300)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,95 @@
+"""
+Latency benchmark for the local suggestion engine.
+
+Builds a deterministic synthetic history (a weekly recurring todo, recent
+completions and random filler) and times LocalSuggestionEngine.suggest for
+several history sizes, both with cold feature caches and warm ones.
+
+    OPENAI_API_KEY=unused python -m benchmarks.local_suggestions
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from app.db.models import TodoStatus
+from app.services import local_suggestions
+from app.services.local_suggestions import LocalSuggestionEngine
+from app.services.prompt_context import ContextTodo
+
+WORDS = (
+    "review budget client meeting report draft plan design release fix bug email "
+    "invoice call research team onboarding roadmap deploy proposal schedule"
+).split()
+
+
+def make_history(size: int, seed: int = 0) -> List[ContextTodo]:
+    """Synthetic history of the given size, newest first"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    history = [
+        ContextTodo(
+            "Water the plants",
+            None,
+            TodoStatus.COMPLETED,
+            1,
+            now - timedelta(days=7 * week + 7),
+            now - timedelta(days=7 * week + 6.9),
+        )
+        for week in range(6)
+    ]
+    while len(history) < size:
+        created = now - timedelta(days=rng.random() * 60)
+        completed = rng.random() < 0.5
+        history.append(
+            ContextTodo(
+                title=" ".join(rng.sample(WORDS, 3)).capitalize(),
+                description=" ".join(rng.choices(WORDS, k=rng.randint(0, 12))) or None,
+                status=TodoStatus.COMPLETED if completed else TodoStatus.PENDING,
+                priority=rng.randint(1, 3),
+                created_at=created,
+                completed_at=created + timedelta(days=rng.random())
+                if completed
+                else None,
+            )
+        )
+    history = history[:size]
+    history.sort(key=lambda todo: todo.created_at, reverse=True)
+    return history
+
+
+def main(args: argparse.Namespace) -> None:
+    engine = LocalSuggestionEngine()
+    for size in args.sizes:
+        history = make_history(size)
+
+        local_suggestions._features.cache_clear()
+        local_suggestions._title_key.cache_clear()
+        started = time.perf_counter()
+        engine.suggest(history)
+        cold = time.perf_counter() - started
+
+        timings = []
+        for _ in range(args.iterations):
+            started = time.perf_counter()
+            engine.suggest(history)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        p50 = timings[len(timings) // 2] * 1000
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+        print(
+            f"history {size:5d}: cold {cold * 1000:6.3f} ms  "
+            f"warm p50 {p50:6.3f} ms  p99 {p99:6.3f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the local suggestion engine"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[25, 50, 100, 200])
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    main(args)
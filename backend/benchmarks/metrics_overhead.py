@@ -0,0 +1,292 @@
+"""
+Overhead of the /metrics instrumentation on the hot path.
+
+Times the metric primitives in isolation, counts the metric updates each
+GraphQL operation makes, then times the same work with and without
+instrumentation: SQL statements with and without the engine event
+listeners, and GraphQL operations against the app's schema and a copy
+built without the metrics and query-check extensions.
+
+Each comparison runs rounds of one timing with and one without, each
+timing about --timing-ms long, in alternating order so that drift and
+warm-up affect both alike, and reports the median of the per-round
+overheads. Rounds continue until the median is known to within
+--tolerance (about two standard errors), or for at most --max-seconds,
+so the figure is stable across runs; a run takes a few minutes. The
+update count times the primitive cost is still the tighter bound.
+
+It creates, seeds and removes its own SQLite database, with --todos
+todos for the demo user, whatever database the environment configures.
+
+    OPENAI_API_KEY=unused python -m benchmarks.metrics_overhead --todos 100
+"""
+import argparse
+import asyncio
+import gc
+import math
+import os
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List
+
+TODO_FIELDS = (
+    "id title description status priority dueDate isAiGenerated "
+    "createdAt updatedAt completedAt"
+)
+OPERATIONS = {
+    "todos(limit: 100)": f"query {{ todos(limit: 100) {{ {TODO_FIELDS} }} }}",
+    "todo(id: 1)": f"query {{ todo(id: 1) {{ {TODO_FIELDS} }} }}",
+}
+
+
+def metric_updates() -> int:
+    """Observations and increments recorded so far, across all metrics"""
+    from app.core.metrics import REGISTRY, Histogram
+
+    total = 0
+    for metric in REGISTRY:
+        for series in metric.series.values():
+            total += (
+                series.count if isinstance(metric, Histogram) else int(series.value)
+            )
+    return total
+
+
+def time_call(function: Callable[[], None], iterations: int) -> float:
+    """Nanoseconds per call"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+async def time_async(function: Callable[[], Awaitable[None]], iterations: int) -> float:
+    """Microseconds per call, with the garbage collector off as in timeit"""
+    gc.collect()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await function()
+        return (time.perf_counter() - started) / iterations * 1e6
+    finally:
+        gc.enable()
+
+
+@dataclass
+class Comparison:
+    instrumented_us: float
+    bare_us: float
+    # Median relative overhead across rounds, and about two standard errors of it
+    overhead: float
+    margin: float
+    rounds: int
+
+
+async def compare(
+    instrumented: Callable[[int], Awaitable[float]],
+    bare: Callable[[int], Awaitable[float]],
+    args: argparse.Namespace,
+) -> Comparison:
+    """
+    Run rounds of one timing of each, alternating which goes first, until
+    the median overhead is within the tolerance or the time is up. The
+    functions take the number of calls to time.
+    """
+    # Calls per timing, from a warm-up call of each
+    per_call_us = max(await instrumented(1), await bare(1))
+    iterations = max(1, round(args.timing_ms * 1000 / per_call_us))
+
+    with_times: List[float] = []
+    without_times: List[float] = []
+    overheads: List[float] = []
+    margin = math.inf
+    deadline = time.perf_counter() + args.max_seconds
+    round_number = 0
+    while round_number < args.min_rounds or time.perf_counter() < deadline:
+        if round_number % 2:
+            without_time = await bare(iterations)
+            with_time = await instrumented(iterations)
+        else:
+            with_time = await instrumented(iterations)
+            without_time = await bare(iterations)
+        round_number += 1
+        with_times.append(with_time)
+        without_times.append(without_time)
+        overheads.append(with_time / without_time - 1)
+
+        if len(overheads) >= args.min_rounds:
+            # The standard error of a median is about 1.25 sigma / sqrt(n),
+            # with sigma estimated robustly from the interquartile range
+            quartiles = statistics.quantiles(overheads, n=4)
+            sigma = (quartiles[2] - quartiles[0]) / 1.349
+            margin = 2 * 1.253 * sigma / math.sqrt(len(overheads))
+            if margin <= args.tolerance:
+                break
+
+    return Comparison(
+        instrumented_us=statistics.median(with_times),
+        bare_us=statistics.median(without_times),
+        overhead=statistics.median(overheads),
+        margin=margin,
+        rounds=len(overheads),
+    )
+
+
+def print_comparison(name: str, comparison: Comparison, tolerance: float) -> None:
+    stable = "" if comparison.margin <= tolerance else "  (not stable)"
+    print(
+        f"  {name:18} instrumented {comparison.instrumented_us:7.1f} us  "
+        f"bare {comparison.bare_us:7.1f} us  overhead {comparison.overhead:+.1%} "
+        f"± {comparison.margin:.1%} over {comparison.rounds} rounds{stable}"
+    )
+
+
+def bare_schema():
+    """
+    The app's schema without the metrics and query-check extensions and
+    resolver timers
+    """
+    import strawberry
+
+    from app.graphql.extensions import ParserCache, ResolverTimer, ValidationCache
+    from app.graphql.schema import Mutation, Query
+
+    for type_ in (Query, Mutation):
+        for field in type_.__strawberry_definition__.fields:
+            field.extensions = [
+                e for e in field.extensions if not isinstance(e, ResolverTimer)
+            ]
+    return strawberry.Schema(
+        query=Query,
+        mutation=Mutation,
+        extensions=[ParserCache(maxsize=256), ValidationCache(maxsize=256)],
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    # Imported once the environment points at the benchmark's database
+    from sqlalchemy import event, func, select, text
+
+    from app.core.metrics import REGISTRY, Counter, Histogram, LATENCY_BUCKETS
+    from app.db import session as db_session
+    from app.db.models import Todo
+    from app.db.session import SessionLocal, engine
+    from app.graphql.schema import schema
+    from benchmarks.graphql_load import prepare
+
+    histogram = Histogram("bench_histogram", "", LATENCY_BUCKETS, labels=["field"])
+    counter = Counter("bench_counter_total", "")
+    for benchmark in (histogram, counter):
+        REGISTRY.remove(benchmark)
+    series = histogram.labels("Query.todos")
+    observe_ns = time_call(
+        lambda: histogram.labels("Query.todos").observe(0.0123), 1_000_000
+    )
+    series_ns = time_call(lambda: series.observe(0.0123), 1_000_000)
+    counter_ns = time_call(lambda: counter.inc(), 1_000_000)
+    print("primitives:")
+    print(f"  histogram series observe   {series_ns:6.0f} ns")
+    print(f"  labels(...).observe        {observe_ns:6.0f} ns")
+    print(f"  counter inc                {counter_ns:6.0f} ns")
+
+    await prepare(args.todos, args.seed)
+    async with SessionLocal() as db:
+        todos = (
+            await db.execute(select(func.count()).where(Todo.user_id == 1))
+        ).scalar()
+
+    listeners = [
+        ("before_cursor_execute", db_session._start_query_timer),
+        ("after_cursor_execute", db_session._observe_query),
+    ]
+    async with engine.connect() as conn:
+
+        async def select_one() -> None:
+            await conn.execute(text("SELECT 1"))
+
+        async def instrumented_sql(iterations: int) -> float:
+            return await time_async(select_one, iterations)
+
+        async def bare_sql(iterations: int) -> float:
+            for name, listener in listeners:
+                event.remove(engine.sync_engine, name, listener)
+            try:
+                return await time_async(select_one, iterations)
+            finally:
+                for name, listener in listeners:
+                    event.listen(engine.sync_engine, name, listener)
+
+        print("SQL statement:")
+        print_comparison(
+            "SELECT 1", await compare(instrumented_sql, bare_sql, args), args.tolerance
+        )
+
+    bare = bare_schema()
+    print(f"GraphQL operation (with {todos} todos):")
+    async with SessionLocal() as db:
+        context = {"request": None, "db": db}
+        for name, query in OPERATIONS.items():
+
+            async def instrumented() -> None:
+                await schema.execute(query, context_value=context)
+
+            async def plain() -> None:
+                await bare.execute(query, context_value=context)
+
+            await plain()
+            before = metric_updates()
+            await instrumented()
+            updates = metric_updates() - before
+
+            comparison = await compare(
+                lambda iterations: time_async(instrumented, iterations),
+                lambda iterations: time_async(plain, iterations),
+                args,
+            )
+            print_comparison(name, comparison, args.tolerance)
+            print(
+                f"  {'':18} {updates} metric updates, "
+                f"~{updates * observe_ns / 1000:.1f} us "
+                f"({updates * observe_ns / 1000 / comparison.bare_us:.2%}) "
+                "at the primitive cost"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the overhead of metrics instrumentation"
+    )
+    parser.add_argument(
+        "--todos", type=int, default=100, help="Todos the demo user has"
+    )
+    parser.add_argument(
+        "--timing-ms", type=float, default=50.0, help="Length of each timing"
+    )
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=60.0,
+        help="Longest time spent on one comparison",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.015,
+        help="Stop once the median overhead is known to within this fraction",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The app reads its settings on first import; the database path is
+        # taken relative to the working directory
+        os.environ.update(
+            USE_SQLITE="true",
+            SQLITE_DB_FILE=os.path.relpath(os.path.join(directory, "bench.db")),
+            DATABASE_SHARDS="{}",
+        )
+        asyncio.run(main(args))
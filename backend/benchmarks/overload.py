@@ -0,0 +1,182 @@
+"""
+Goodput under overload, with and without admission control.
+
+Serves the app from uvicorn and offers it an open-loop (Poisson) stream
+of GraphQL requests at increasing rates, in the graphql_load operation
+mix, with generateTodoSuggestion answered by the local fake OpenAI
+endpoint. A request is good if it succeeds within --deadline; shed (503),
+late and failed requests are not. Past capacity, the good rate should
+level off with admission control and collapse without it, as every
+request queues until it is late.
+
+    USE_SQLITE=true SQLITE_DB_FILE=bench.db OPENAI_API_KEY=unused \\
+        python -m benchmarks.overload --rates 25,50,100,200 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.fake_openai import FakeProfile, start_in_thread
+from benchmarks.graphql_load import (
+    DEFAULT_MIX,
+    QUERIES,
+    Workload,
+    failed,
+    parse_mix,
+    prepare,
+    start_server,
+)
+
+CLASSES = ("read", "write", "ai")
+# Width of each class's column in the results table, in CLASSES order
+CLASS_WIDTHS = {"read": 7, "write": 7, "ai": 6}
+
+
+def request_class(operation: str) -> str:
+    """Admission class of an operation, as app.core.admission classifies it"""
+    if operation == "generateTodoSuggestion":
+        return "ai"
+    return "write" if QUERIES[operation].startswith("mutation") else "read"
+
+
+async def offer(
+    client: httpx.AsyncClient,
+    workload: Workload,
+    mix: Dict[str, float],
+    rate: float,
+    duration: float,
+    deadline: float,
+    seed: int,
+) -> Counter:
+    """Send requests at Poisson arrivals for the duration; returns outcome counts"""
+    counts: Counter = Counter()
+    rng = random.Random(seed)
+
+    async def request(operation: str) -> None:
+        counts["offered"] += 1
+        try:
+            response = await client.post(
+                "/graphql",
+                json={
+                    "query": QUERIES[operation],
+                    "variables": workload.variables(operation),
+                },
+                timeout=deadline,
+            )
+        except httpx.TimeoutException:
+            counts["late"] += 1
+            return
+        except httpx.TransportError:
+            # e.g. the connection was reset with the server's accept queue full
+            counts["failed"] += 1
+            return
+        if response.status_code == 503:
+            counts["shed"] += 1
+        elif failed(operation, response):
+            counts["failed"] += 1
+        else:
+            workload.record(operation, response.json()["data"])
+            counts["good"] += 1
+            counts[f"good_{request_class(operation)}"] += 1
+
+    tasks = []
+    next_at = time.perf_counter()
+    end = next_at + duration
+    while next_at < end:
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        tasks.append(asyncio.create_task(request(workload.next_operation(mix))))
+        next_at += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+    return counts
+
+
+async def settle(client: httpx.AsyncClient, base_url: str) -> None:
+    """Wait for the backlog of the previous step to drain"""
+    root = base_url.rsplit("/api", 1)[0]
+    for _ in range(100):
+        await asyncio.sleep(0.5)
+        state = (await client.get(f"{root}/ready")).json()
+        if state["in_flight"] == 0 and not state["shedding"]:
+            return
+
+
+async def main(args: argparse.Namespace) -> None:
+    from app.core.config import settings
+
+    settings.OPENAI_BASE_URL = start_in_thread(
+        FakeProfile(latency_ms=args.llm_latency_ms)
+    )
+    # Shared by both modes, so that the second sees the first's creates and deletes
+    workload = Workload(await prepare(args.todos, args.seed), args.page_size, args.seed)
+    modes: List[bool] = {"on": [True], "off": [False], "both": [False, True]}[
+        args.admission
+    ]
+
+    print(
+        f"{'admission':9} {'rate':>6} {'offered':>7} "
+        f"{'good/s':>7} {'read/s':>7} {'write/s':>7} "
+        f"{'ai/s':>6} {'shed':>6} {'late':>6} {'failed':>6}"
+    )
+    for enabled in modes:
+        os.environ["ADMISSION_CONTROL"] = "true" if enabled else "false"
+        process, base_url = start_server(1)
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+        try:
+            async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+                for rate in args.rates:
+                    counts = await offer(
+                        client,
+                        workload,
+                        args.mix,
+                        rate,
+                        args.duration,
+                        args.deadline,
+                        args.seed,
+                    )
+                    per_class = " ".join(
+                        f"{counts[f'good_{name}'] / args.duration:{width}.1f}"
+                        for name, width in CLASS_WIDTHS.items()
+                    )
+                    print(
+                        f"{'on' if enabled else 'off':9} {rate:6.0f} "
+                        f"{counts['offered']:7d} {counts['good'] / args.duration:7.1f} "
+                        f"{per_class} {counts['shed']:6d} {counts['late']:6d} "
+                        f"{counts['failed']:6d}"
+                    )
+                    await settle(client, base_url)
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure goodput under overload")
+    parser.add_argument(
+        "--rates",
+        type=lambda value: [float(rate) for rate in value.split(",")],
+        default=[25.0, 50.0, 100.0, 200.0],
+        help="Offered requests per second, one step each",
+    )
+    parser.add_argument("--admission", choices=["on", "off", "both"], default="both")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per rate")
+    parser.add_argument(
+        "--deadline", type=float, default=1.0, help="Seconds a good request may take"
+    )
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument(
+        "--todos", type=int, default=1000, help="Todos the demo user starts with"
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=100, help="Limit of todos queries"
+    )
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,81 @@
+"""
+Cold-start-to-ready benchmark.
+
+Starts the app under uvicorn in a fresh process, polls /health until it
+answers, and reports how long that took, over several runs against the
+same (already migrated) database.
+
+    USE_SQLITE=true SQLITE_DB_FILE=bench.db OPENAI_API_KEY=unused \\
+        python -m benchmarks.startup --runs 10
+"""
+import argparse
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def free_port() -> int:
+    """Pick a free local TCP port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_ready(timeout: float) -> float:
+    """Seconds from spawning a server process until /health returns 200"""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                if (
+                    httpx.get(
+                        f"http://127.0.0.1:{port}/health", timeout=0.5
+                    ).status_code
+                    == 200
+                ):
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            time.sleep(0.005)
+        raise TimeoutError("Server did not become ready")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(args: argparse.Namespace) -> None:
+    timings = [time_to_ready(args.timeout) for _ in range(args.runs)]
+    print(
+        f"cold start to ready over {args.runs} runs: "
+        f"min {min(timings) * 1000:.0f} ms  "
+        f"median {statistics.median(timings) * 1000:.0f} ms  "
+        f"max {max(timings) * 1000:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold start to ready time")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    main(args)
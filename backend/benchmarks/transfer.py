@@ -0,0 +1,125 @@
+"""
+Round-trip benchmark for the streaming todo export/import endpoints.
+
+Imports N generated todos through POST /todos/import, exports them again
+through GET /todos/export, and reports rows/second and peak RSS. The server
+runs in-process under uvicorn, so the reported RSS covers both sides.
+
+Run from the backend directory against a throwaway database, e.g.:
+
+    USE_SQLITE=true SQLITE_DB_FILE=bench.db OPENAI_API_KEY=unused \\
+        python -m benchmarks.transfer --rows 1000000
+"""
+import argparse
+import asyncio
+import json
+import resource
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import AsyncGenerator
+
+import httpx
+import uvicorn
+
+from app.core.config import settings
+from app.db.seed import create_default_user
+from app.db.migrations import migrate
+from app.db.session import SessionLocal
+from app.main import app
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def start_server() -> str:
+    """Start the app under uvicorn in a background thread; returns its base URL"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"
+        )
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}{settings.API_V1_STR}"
+
+
+async def generate_ndjson(
+    rows: int, chunk_rows: int = 1000
+) -> AsyncGenerator[bytes, None]:
+    """Generate NDJSON todos lazily, chunk_rows lines at a time"""
+    start = datetime(2024, 1, 1)
+    for offset in range(0, rows, chunk_rows):
+        lines = []
+        for i in range(offset, min(offset + chunk_rows, rows)):
+            completed = i % 3 == 0
+            lines.append(
+                json.dumps(
+                    {
+                        "title": f"Imported task {i}",
+                        "description": f"Benchmark row {i} " + "x" * (i % 200),
+                        "status": "COMPLETED" if completed else "PENDING",
+                        "priority": i % 3 + 1,
+                        "due_date": (start + timedelta(hours=i)).isoformat(),
+                        "created_at": (start + timedelta(minutes=i)).isoformat(),
+                        "tags": ["bench", f"group-{i % 10}"],
+                    }
+                )
+            )
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def run(rows: int) -> None:
+    await migrate()
+    async with SessionLocal() as session:
+        await create_default_user(session)
+
+    base_url = start_server()
+    print(f"Peak RSS before import: {peak_rss_mb():.1f} MiB")
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        started = time.perf_counter()
+        response = await client.post(
+            "/todos/import?format=ndjson", content=generate_ndjson(rows)
+        )
+        response.raise_for_status()
+        elapsed = time.perf_counter() - started
+        result = response.json()
+        print(
+            f"Import: {result['imported']} rows ({result['failed']} failed) "
+            f"in {elapsed:.1f}s, {result['imported'] / elapsed:,.0f} rows/s, "
+            f"peak RSS {peak_rss_mb():.1f} MiB"
+        )
+
+        started = time.perf_counter()
+        exported = 0
+        exported_bytes = 0
+        async with client.stream("GET", "/todos/export?format=ndjson") as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                exported += chunk.count(b"\n")
+                exported_bytes += len(chunk)
+        elapsed = time.perf_counter() - started
+        print(
+            f"Export: {exported} rows ({exported_bytes / 2**20:.0f} MiB) "
+            f"in {elapsed:.1f}s, "
+            f"{exported / elapsed:,.0f} rows/s, peak RSS {peak_rss_mb():.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark streaming export/import")
+    parser.add_argument(
+        "--rows", type=int, default=100_000, help="Number of todos to round-trip"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(run(args.rows))
@@ -0,0 +1,74 @@
+"""
+Benchmark for the related-todos vector index.
+
+Embeds N synthetic todo titles with the configured embedder, loads them
+into a UserVectorIndex the way a stored index is loaded (through float16),
+and times top-k searches for single and batched queries.
+
+    OPENAI_API_KEY=unused python -m benchmarks.vector_index --vectors 100000
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from app.services.embeddings import UserVectorIndex, get_embedder
+
+WORDS = (
+    "review budget client meeting report draft plan design release fix bug email "
+    "invoice call research team onboarding roadmap deploy proposal schedule dentist "
+    "groceries garden taxes insurance car repair flight hotel birthday gift"
+).split()
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(0)
+    embedder = get_embedder()
+    titles = [
+        " ".join(rng.sample(WORDS, rng.randint(2, 5))) for _ in range(args.vectors)
+    ]
+
+    started = time.perf_counter()
+    vectors = embedder.embed(titles)
+    elapsed = time.perf_counter() - started
+    print(
+        f"embedded {len(titles)} titles in {elapsed:.2f}s "
+        f"({len(titles) / elapsed:,.0f}/s)"
+    )
+
+    stored = vectors.astype(np.float16)
+    print(f"stored size: {stored.nbytes / 2 ** 20:.1f} MiB as float16")
+    index = UserVectorIndex(
+        embedder.dimension,
+        ids=list(range(len(titles))),
+        vectors=stored.astype(np.float32),
+    )
+
+    for batch in args.batches:
+        timings = []
+        for _ in range(args.iterations):
+            queries = vectors[rng.sample(range(len(titles)), batch)]
+            started = time.perf_counter()
+            index.search(queries, args.k)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        p50 = timings[len(timings) // 2] * 1000
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+        print(
+            f"top-{args.k} over {len(index)} vectors, batch {batch:3d}: "
+            f"p50 {p50:7.2f} ms  p99 {p99:7.2f} ms  ({p50 / batch:.2f} ms/query)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the related-todos vector index"
+    )
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    main(args)
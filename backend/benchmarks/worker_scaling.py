@@ -0,0 +1,119 @@
+"""
+Throughput scaling of app.server from 1 to N worker processes.
+
+Runs the graphql_load workload against app.server with each worker count
+in turn, with concurrent clients in proportion to the workers, and reports
+throughput and latency with the speedup and efficiency over one worker.
+Scaling is bounded by the CPUs available, which the load generator shares
+when it runs on the same machine, and on SQLite by its single writer; use
+Postgres and spare cores for numbers that mean something.
+
+    USE_SQLITE=true SQLITE_DB_FILE=bench.db OPENAI_API_KEY=unused \\
+        python -m benchmarks.worker_scaling --workers 1,2,4 --duration 20
+"""
+import argparse
+import asyncio
+import json
+from typing import Any, Dict, List
+
+import httpx
+
+from app.server import available_cpus
+from benchmarks.fake_openai import FakeProfile, start_in_thread
+from benchmarks.graphql_load import (
+    DEFAULT_MIX,
+    Workload,
+    drive,
+    parse_mix,
+    prepare,
+    start_server,
+    summarize,
+)
+
+
+def default_worker_counts() -> List[int]:
+    """1, 2, 4, ... up to the available CPUs, and the CPU count itself"""
+    cpus = available_cpus()
+    counts = [1]
+    while counts[-1] * 2 <= cpus:
+        counts.append(counts[-1] * 2)
+    return counts if counts[-1] == cpus else counts + [cpus]
+
+
+async def main(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    from app.core.config import settings
+
+    settings.OPENAI_BASE_URL = start_in_thread(
+        FakeProfile(latency_ms=args.llm_latency_ms)
+    )
+    workload = Workload(await prepare(args.todos, args.seed), args.page_size, args.seed)
+
+    print(f"{available_cpus()} CPUs available")
+    print(
+        f"{'workers':>7} {'clients':>7} {'rps':>8} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'speedup':>8} {'efficiency':>10}"
+    )
+    results = []
+    for workers in args.workers:
+        concurrency = args.clients_per_worker * workers
+        process, base_url = start_server(workers, "prefork")
+        try:
+            limits = httpx.Limits(max_connections=concurrency)
+            async with httpx.AsyncClient(
+                base_url=base_url, limits=limits, timeout=None
+            ) as client:
+                measured = await drive(
+                    client, workload, args.mix, concurrency, args.duration, args.warmup
+                )
+        finally:
+            process.terminate()
+            process.wait()
+
+        total = summarize(*measured)["total"]
+        speedup = (
+            total["throughput_rps"] / results[0]["throughput_rps"] if results else 1.0
+        )
+        results.append(
+            dict(total, workers=workers, clients=concurrency, speedup=speedup)
+        )
+        print(
+            f"{workers:7d} {concurrency:7d} {total['throughput_rps']:8.1f} "
+            f"{total.get('p50_ms', 0):8.1f} "
+            f"{total.get('p99_ms', 0):8.1f} {speedup:7.2f}x {speedup / workers:10.0%}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure throughput scaling across worker processes"
+    )
+    parser.add_argument(
+        "--workers",
+        type=lambda value: [int(count) for count in value.split(",")],
+        default=default_worker_counts(),
+        help="Worker counts to run, e.g. 1,2,4",
+    )
+    parser.add_argument("--clients-per-worker", type=int, default=16)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument(
+        "--duration", type=float, default=20.0, help="Measured seconds per worker count"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=3.0, help="Unmeasured seconds first"
+    )
+    parser.add_argument(
+        "--todos", type=int, default=1000, help="Todos the demo user starts with"
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=100, help="Limit of todos queries"
+    )
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,56 @@
+"""
+Settings for importing the app in tests: a placeholder OpenAI key and a
+SQLite database of its own, read when app.core.config is first imported.
+Service tests get a fresh database each from the sessionmaker fixture.
+"""
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+_directory = tempfile.mkdtemp(prefix="todo-ai-tests-")
+os.environ.update(
+    OPENAI_API_KEY="unused",
+    OPENAI_PRELOAD="false",
+    USE_SQLITE="true",
+    # The database path is taken relative to the working directory
+    SQLITE_DB_FILE=os.path.relpath(os.path.join(_directory, "test.db")),
+    DATABASE_SHARDS="{}",
+    SHARD_MAP_FILE=os.path.join(_directory, "shard_map.json"),
+)
+
+
+@pytest.fixture
+def sessionmaker(tmp_path):
+    """
+    Session factory on a new SQLite database with the current schema and
+    users 1 and 2. Connections are not pooled, so each test may use its own
+    event loop.
+    """
+    # Imported once the settings above are in place
+    from app.db.models import User
+    from app.db.session import Base, create_sessionmaker
+
+    path = tmp_path / "service.db"
+    setup = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(setup)
+    with setup.begin() as conn:
+        conn.execute(
+            insert(User),
+            [
+                {
+                    "id": user_id,
+                    "username": f"user{user_id}",
+                    "email": f"user{user_id}@example.com",
+                    "hashed_password": "x",
+                }
+                for user_id in (1, 2)
+            ],
+        )
+    setup.dispose()
+    return create_sessionmaker(
+        create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    )
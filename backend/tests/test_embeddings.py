@@ -0,0 +1,128 @@
+"""
+Hashed embeddings of non-ASCII text, and backfilling the vectors of todos
+that have none from the current embedder
+"""
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+from sqlalchemy import insert, select
+
+from app.db.models import Todo, TodoEmbedding
+from app.services import embeddings
+from app.services.embeddings import (
+    EmbeddingService,
+    HashingEmbedder,
+    VectorIndex,
+    encode_vector,
+)
+from app.services.ranking import spaced_keys
+
+
+class RecordingEmbedder(HashingEmbedder):
+    """Records the size of each batch it embeds, and the thread it ran on"""
+
+    def __init__(self):
+        super().__init__(dimension=64)
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append((len(texts), threading.get_ident()))
+        return super().embed(texts)
+
+
+async def add_todos(session, titles, user_id=1):
+    """Todos without embeddings, in order; returns their IDs"""
+    result = await session.execute(
+        insert(Todo).returning(Todo.id, sort_by_parameter_order=True),
+        [
+            {
+                "title": title,
+                "status": "PENDING",
+                "priority": 1,
+                "user_id": user_id,
+                "rank": rank,
+            }
+            for title, rank in zip(titles, spaced_keys(len(titles)))
+        ],
+    )
+    todo_ids = result.scalars().all()
+    await session.commit()
+    return todo_ids
+
+
+async def stored_models(session):
+    result = await session.execute(
+        select(TodoEmbedding.todo_id, TodoEmbedding.model).order_by(
+            TodoEmbedding.todo_id
+        )
+    )
+    return dict(result.all())
+
+
+def test_words_are_unicode():
+    words = {feature for feature, _ in HashingEmbedder().features("Straße 東京 naïve")}
+    assert {"straße", "東京", "naïve"} <= words
+
+
+@pytest.mark.parametrize("text", ["Äöü", "Überweisung prüfen", "東京へ行く"])
+def test_non_ascii_text_has_a_vector(text):
+    vector = HashingEmbedder().embed([text])[0]
+    assert np.linalg.norm(vector) == pytest.approx(1.0, abs=1e-5)
+
+
+def test_backfill_in_batches_off_the_event_loop(sessionmaker, monkeypatch):
+    monkeypatch.setattr(embeddings, "BACKFILL_BATCH_SIZE", 3)
+    embedder = RecordingEmbedder()
+
+    async def run():
+        async with sessionmaker() as session:
+            todo_ids = await add_todos(session, [f"Todo {i}" for i in range(7)])
+            await add_todos(session, ["Someone else's"], user_id=2)
+            # A vector from an older embedder is replaced, not kept
+            session.add(
+                TodoEmbedding(
+                    todo_id=todo_ids[0],
+                    model="hashing-64",
+                    vector=encode_vector(np.zeros(64)),
+                )
+            )
+            await session.commit()
+
+            service = EmbeddingService(session, embedder)
+            assert await service.backfill(1) == 7
+            assert [size for size, _ in embedder.calls] == [3, 3, 1]
+            loop_thread = threading.get_ident()
+            assert all(thread != loop_thread for _, thread in embedder.calls)
+            assert await stored_models(session) == {
+                todo_id: embedder.name for todo_id in todo_ids
+            }
+
+            # Nothing is left to do
+            assert await service.backfill(1) == 0
+            assert len(embedder.calls) == 3
+
+    asyncio.run(run())
+
+
+def test_related_todos_in_other_scripts(sessionmaker, monkeypatch):
+    monkeypatch.setattr(embeddings, "vector_index", VectorIndex(10, 60))
+    titles = [
+        "Steuererklärung für 2024 abgeben",
+        "Fahrrad reparieren",
+        "Belege für die Steuererklärung sammeln",
+        "東京の ホテル を 予約",
+        "東京の 地図 を 買う",
+    ]
+
+    async def run():
+        async with sessionmaker() as session:
+            todo_ids = await add_todos(session, titles)
+            service = EmbeddingService(session, RecordingEmbedder())
+            related = await service.related_todos(todo_ids[0], 1, k=1, min_score=0.1)
+            assert [todo.id for todo in related] == [todo_ids[2]]
+            related = await service.related_todos(todo_ids[3], 1, k=1, min_score=0.1)
+            assert [todo.id for todo in related] == [todo_ids[4]]
+
+    asyncio.run(run())
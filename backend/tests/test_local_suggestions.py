@@ -0,0 +1,63 @@
+"""
+LocalSuggestionEngine over histories whose titles have no word features,
+such as punctuation, stop words, emoji and non-ASCII text
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.db.models import TodoStatus
+from app.services.local_suggestions import GENERIC_SUGGESTION, LocalSuggestionEngine
+from app.services.prompt_context import ContextTodo
+
+NOW = datetime(2024, 3, 1, 12)
+
+
+def todo(title, status=TodoStatus.PENDING, priority=1, days_ago=1.0, description=None):
+    created = NOW - timedelta(days=days_ago)
+    completed = created if status == TodoStatus.COMPLETED else None
+    return ContextTodo(title, description, status, priority, created, completed)
+
+
+@pytest.mark.parametrize("title", ["!!!", "the", "🎉🎉", "Äöü", "日本語のタスク", ""])
+def test_pending_todos_without_features(title):
+    history = [
+        todo(title),
+        todo("Review quarterly report", TodoStatus.COMPLETED, days_ago=0.5),
+        todo("Call the bank", TodoStatus.COMPLETED, days_ago=3),
+    ]
+    engine = LocalSuggestionEngine()
+    relevance = engine._relevance(history, np.array([True, False, False]))
+    assert relevance.dtype == np.float64
+    assert np.array_equal(relevance, np.zeros(3))
+
+    suggestion = engine.suggest(history, now=NOW)
+    assert suggestion.reason == "follow_up"
+    assert suggestion.title == "Follow up on Review quarterly report"
+
+
+def test_no_todo_has_features():
+    history = [todo("!!!"), todo("the", TodoStatus.COMPLETED, days_ago=2)]
+    engine = LocalSuggestionEngine()
+    assert np.array_equal(
+        engine._relevance(history, np.array([True, False])), np.zeros(2)
+    )
+    assert engine.suggest(history, now=NOW).reason in {"follow_up", "next_step"}
+
+
+def test_relevance_to_pending_todos():
+    history = [
+        todo("Prepare budget report"),
+        todo("Email budget report", TodoStatus.COMPLETED, days_ago=2),
+        todo("Water the plants", TodoStatus.COMPLETED, days_ago=2),
+    ]
+    relevance = LocalSuggestionEngine()._relevance(
+        history, np.array([True, False, False])
+    )
+    assert relevance[0] == pytest.approx(1.0)
+    assert relevance[1] > relevance[2] == 0.0
+
+
+def test_empty_history():
+    assert LocalSuggestionEngine().suggest([], now=NOW) is GENERIC_SUGGESTION
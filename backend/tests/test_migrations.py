@@ -0,0 +1,205 @@
+"""
+Upgrading a SQLite database from the schema before versioned migrations
+(users and todos, without ranks or tags) to the current version
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    create_engine,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.exc import IntegrityError
+
+from app.db import migrations
+from app.db.migrations import MIGRATIONS, SCHEMA_VERSION, _migrate
+from app.db.models import Tag, Todo, schema_version, todo_tags
+from app.services.ranking import spaced_keys
+
+# The users and todos tables as the first release created them
+baseline = MetaData()
+Table(
+    "users",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String(50), unique=True, index=True, nullable=False),
+    Column("email", String(100), unique=True, index=True, nullable=False),
+    Column("hashed_password", String(255), nullable=False),
+    Column("is_active", Boolean, default=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+)
+Table(
+    "todos",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("title", String(255), nullable=False),
+    Column("description", Text, nullable=True),
+    Column("status", String(9), nullable=False),
+    Column("priority", Integer, nullable=False),
+    Column("due_date", DateTime(timezone=True), nullable=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("is_ai_generated", Boolean, default=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+    Column("completed_at", DateTime(timezone=True), nullable=True),
+)
+
+START = datetime(2024, 1, 1)
+# (user_id, priority, days after START it was created) of each todo, by ID
+TODOS = [(1, 1, 0), (1, 3, 1), (2, 2, 2), (1, 3, 3), (1, 2, 4), (2, 2, 5), (2, 5, 6)]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    baseline.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(baseline.tables["users"]),
+            [
+                {
+                    "id": user_id,
+                    "username": f"user{user_id}",
+                    "email": f"user{user_id}@example.com",
+                    "hashed_password": "x",
+                }
+                for user_id in (1, 2)
+            ],
+        )
+        conn.execute(
+            insert(baseline.tables["todos"]),
+            [
+                {
+                    "id": todo_id,
+                    "title": f"Todo {todo_id}",
+                    "status": "PENDING",
+                    "priority": priority,
+                    "user_id": user_id,
+                    "created_at": START + timedelta(days=days),
+                }
+                for todo_id, (user_id, priority, days) in enumerate(TODOS, start=1)
+            ],
+        )
+    yield engine
+    engine.dispose()
+
+
+def migrate_to(engine, version):
+    """Apply the migrations up to a version, as a release at it would"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(migrations, "MIGRATIONS", MIGRATIONS[:version])
+        with engine.begin() as conn:
+            _migrate(conn)
+
+
+def expected_order(user_id):
+    """A user's todo IDs by priority, highest first, then newest first"""
+    rows = [
+        (todo_id, priority, days)
+        for todo_id, (owner, priority, days) in enumerate(TODOS, start=1)
+        if owner == user_id
+    ]
+    return [
+        todo_id for todo_id, _, _ in sorted(rows, key=lambda row: (-row[1], -row[2]))
+    ]
+
+
+def test_upgrade_from_baseline(engine):
+    with engine.begin() as conn:
+        assert _migrate(conn) == SCHEMA_VERSION
+
+    with engine.connect() as conn:
+        versions = conn.execute(select(schema_version.c.version)).scalars().all()
+        assert versions == list(range(1, SCHEMA_VERSION + 1))
+        assert SCHEMA_VERSION == 6
+
+        rank = next(
+            c for c in inspect(conn).get_columns("todos") if c["name"] == "rank"
+        )
+        assert not rank["nullable"]
+        indexes = {index["name"]: index for index in inspect(conn).get_indexes("todos")}
+        assert indexes["ix_todos_user_id_rank"]["unique"]
+
+        todos = Todo.__table__
+        for user_id in (1, 2):
+            rows = conn.execute(
+                select(todos.c.id, todos.c.rank)
+                .filter(todos.c.user_id == user_id)
+                .order_by(todos.c.rank)
+            ).all()
+            assert [row.id for row in rows] == expected_order(user_id)
+            assert [row.rank for row in rows] == spaced_keys(len(rows))
+
+    with pytest.raises(IntegrityError):
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE todos SET rank = NULL WHERE id = 1"))
+
+
+def test_tag_links_survive_the_rebuild(engine):
+    migrate_to(engine, 5)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(Tag.__table__),
+            [
+                {"id": 1, "user_id": 1, "name": "work"},
+                {"id": 2, "user_id": 1, "name": "home"},
+            ],
+        )
+        conn.execute(
+            insert(todo_tags),
+            [
+                {"todo_id": 1, "tag_id": 1},
+                {"todo_id": 2, "tag_id": 1},
+                {"todo_id": 2, "tag_id": 2},
+            ],
+        )
+        # A todo added by the release at version 5 without a key
+        conn.execute(
+            insert(Todo.__table__).values(
+                id=8,
+                title="Unranked",
+                status="PENDING",
+                priority=1,
+                user_id=1,
+                rank=None,
+            )
+        )
+        last_rank = conn.execute(
+            select(func.max(Todo.rank)).filter(Todo.user_id == 1)
+        ).scalar()
+
+    migrate_to(engine, 6)
+    with engine.connect() as conn:
+        links = conn.execute(
+            select(todo_tags.c.todo_id, todo_tags.c.tag_id).order_by(
+                todo_tags.c.todo_id, todo_tags.c.tag_id
+            )
+        ).all()
+        assert links == [(1, 1), (2, 1), (2, 2)]
+        assert conn.execute(select(Todo.rank).filter(Todo.id == 8)).scalar() > last_rank
+        assert conn.execute(select(func.max(schema_version.c.version))).scalar() == 6
+        assert not conn.execute(text("PRAGMA foreign_key_check")).all()
+
+
+def test_rebuild_refuses_enforced_foreign_keys(engine):
+    migrate_to(engine, 5)
+    with pytest.raises(RuntimeError, match="foreign keys off"):
+        with engine.begin() as conn:
+            conn.execute(text("PRAGMA foreign_keys = ON"))
+            _migrate(conn)
+    with engine.connect() as conn:
+        assert conn.execute(select(func.max(schema_version.c.version))).scalar() == 5
@@ -0,0 +1,128 @@
+"""
+Retrying writes whose rank keys a concurrent write took first, and only
+those: other integrity errors are raised at once
+"""
+import asyncio
+import sqlite3
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.services.todo import (
+    RANK_WRITE_ATTEMPTS,
+    TodoService,
+    is_rank_conflict,
+    retry_rank_conflicts,
+)
+
+
+class AsyncpgUniqueViolation(Exception):
+    """Stands in for asyncpg's exception, which names the violated constraint"""
+
+    def __init__(self, constraint_name):
+        super().__init__(
+            f'duplicate key value violates unique constraint "{constraint_name}"'
+        )
+        self.constraint_name = constraint_name
+
+
+def asyncpg_error(constraint_name):
+    """An IntegrityError as SQLAlchemy's asyncpg dialect raises it"""
+    cause = AsyncpgUniqueViolation(constraint_name)
+    try:
+        raise Exception(f"<class 'UniqueViolationError'>: {cause}") from cause
+    except Exception as orig:
+        return IntegrityError("INSERT ...", {}, orig)
+
+
+def sqlite_error(message):
+    return IntegrityError("INSERT ...", {}, sqlite3.IntegrityError(message))
+
+
+@pytest.mark.parametrize(
+    "error, conflict",
+    [
+        (sqlite_error("UNIQUE constraint failed: todos.user_id, todos.rank"), True),
+        (sqlite_error("UNIQUE constraint failed: tags.user_id, tags.name"), False),
+        (sqlite_error("NOT NULL constraint failed: todos.rank"), False),
+        (asyncpg_error("ix_todos_user_id_rank"), True),
+        (asyncpg_error("uq_tags_user_id_name"), False),
+        (asyncpg_error("uq_suggestion_jobs_active_user_id"), False),
+    ],
+)
+def test_is_rank_conflict(error, conflict):
+    assert is_rank_conflict(error) == conflict
+
+
+class FakeSession:
+    def __init__(self):
+        self.rollbacks = 0
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+def failing_write(*errors):
+    """A write that raises the given errors in turn, then succeeds"""
+    calls = []
+
+    async def write():
+        calls.append(None)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "written"
+
+    return write, calls
+
+
+def test_rank_conflicts_are_retried():
+    session = FakeSession()
+    conflict = sqlite_error("UNIQUE constraint failed: todos.user_id, todos.rank")
+    write, calls = failing_write(conflict, asyncpg_error("ix_todos_user_id_rank"))
+    assert asyncio.run(retry_rank_conflicts(session, write)) == "written"
+    assert len(calls) == 3 and session.rollbacks == 2
+
+
+def test_retries_are_limited():
+    conflict = sqlite_error("UNIQUE constraint failed: todos.user_id, todos.rank")
+    write, calls = failing_write(*[conflict] * RANK_WRITE_ATTEMPTS)
+    with pytest.raises(IntegrityError):
+        asyncio.run(retry_rank_conflicts(FakeSession(), write))
+    assert len(calls) == RANK_WRITE_ATTEMPTS
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        sqlite_error("UNIQUE constraint failed: tags.user_id, tags.name"),
+        asyncpg_error("uq_tags_user_id_name"),
+    ],
+)
+def test_other_integrity_errors_are_raised_at_once(error):
+    session = FakeSession()
+    write, calls = failing_write(error)
+    with pytest.raises(IntegrityError) as raised:
+        asyncio.run(retry_rank_conflicts(session, write))
+    assert raised.value is error
+    assert len(calls) == 1 and session.rollbacks == 1
+
+
+def test_create_retries_a_taken_key(sessionmaker):
+    async def main():
+        async with sessionmaker() as session:
+            service = TodoService(session)
+            first = await service.create_todo(1, "First")
+            first_rank = first.rank
+
+            # The key the second create picks was taken since it looked
+            get_last_rank = service.get_last_rank
+            stale = [None]
+
+            async def get_last_rank_once_stale(user_id):
+                return stale.pop() if stale else await get_last_rank(user_id)
+
+            service.get_last_rank = get_last_rank_once_stale
+            second = await service.create_todo(1, "Second")
+            assert second.rank > first_rank
+
+    asyncio.run(main())
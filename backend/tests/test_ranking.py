@@ -0,0 +1,104 @@
+"""
+Properties of the rank keys in app.services.ranking, checked over seeded
+random sequences of inserts
+"""
+import random
+from typing import List, Optional
+
+import pytest
+
+from app.services.ranking import DIGITS, key_between, spaced_keys
+
+
+def assert_valid(key: str) -> None:
+    """A header digit, that many integer characters, a fraction not ending in 0"""
+    assert key and all(character in DIGITS for character in key)
+    length = DIGITS.index(key[0]) + 1
+    assert length > 1 and len(key) >= length
+    assert not key[length:].endswith("0")
+
+
+def insert_at(keys: List[str], position: int) -> str:
+    """Insert a key at a position of a sorted list, as move_todo does"""
+    lower: Optional[str] = keys[position - 1] if position > 0 else None
+    upper: Optional[str] = keys[position] if position < len(keys) else None
+    key = key_between(lower, upper)
+    assert_valid(key)
+    if lower is not None:
+        assert lower < key
+    if upper is not None:
+        assert key < upper
+    keys.insert(position, key)
+    return key
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_inserts_keep_order(seed):
+    rng = random.Random(seed)
+    keys: List[str] = []
+    for _ in range(500):
+        insert_at(keys, rng.randint(0, len(keys)))
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_inserts_into_one_gap(seed):
+    # Repeatedly moving todos between the same two neighbours
+    rng = random.Random(seed)
+    keys = spaced_keys(2)
+    for _ in range(200):
+        insert_at(keys, rng.choice([1, len(keys) - 1]))
+    assert keys == sorted(keys)
+
+
+def test_appends_stay_short():
+    keys: List[str] = []
+    for _ in range(10_000):
+        insert_at(keys, len(keys))
+    assert keys == sorted(keys)
+    assert max(len(key) for key in keys) <= 4
+
+
+def test_prepends_keep_order():
+    keys: List[str] = []
+    for _ in range(2_000):
+        insert_at(keys, 0)
+    assert keys == sorted(keys)
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 3, 17, 18, 35, 36, 647, 648, 5_000])
+def test_spaced_keys(count):
+    keys = spaced_keys(count)
+    assert len(keys) == count
+    assert keys == sorted(keys)
+    assert len(set(keys)) == count
+    assert len({len(key) for key in keys}) <= 1
+    for key in keys:
+        assert_valid(key)
+    if keys:
+        # Room to insert before the first and after the last
+        assert key_between(None, keys[0]) < keys[0]
+        assert key_between(keys[-1], None) > keys[-1]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_inserts_between_spaced_keys(seed):
+    rng = random.Random(seed)
+    keys = spaced_keys(100)
+    for _ in range(300):
+        insert_at(keys, rng.randint(0, len(keys)))
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+
+
+@pytest.mark.parametrize("lower, upper", [("1h", "1h"), ("1i", "1h")])
+def test_out_of_order_keys_are_rejected(lower, upper):
+    with pytest.raises(ValueError):
+        key_between(lower, upper)
+
+
+@pytest.mark.parametrize("key", ["", "0", "2a", "1a0", "!a"])
+def test_invalid_keys_are_rejected(key):
+    with pytest.raises(ValueError):
+        key_between(key, None)
@@ -0,0 +1,229 @@
+"""
+Circuit breaking, deadlines and hedging, on their own and through
+LLMService against the fake OpenAI endpoint of benchmarks.fake_openai
+"""
+import asyncio
+import time
+from dataclasses import asdict
+
+import pytest
+
+from app.core.config import settings
+from app.core.metrics import PROMPT_TOKENS
+from app.services import llm
+from app.db.models import TodoStatus
+from app.services.llm import LLMService, SuggestionErrorCode
+from app.services.prompt_context import ContextTodo, count_tokens
+from app.services.resilience import CircuitBreaker, CircuitState, Deadline, hedged
+from benchmarks.fake_openai import FakeProfile, RequestLog, start_in_thread
+
+DEFAULTS = asdict(FakeProfile(latency_ms=20))
+
+
+@pytest.fixture(scope="module")
+def fake():
+    profile = FakeProfile(**DEFAULTS)
+    log = RequestLog()
+    base_url = start_in_thread(profile, seed=0, log=log)
+    return profile, log, base_url
+
+
+@pytest.fixture
+def service(fake, monkeypatch):
+    """An LLMService with a breaker of its own, talking to the fake"""
+    profile, log, base_url = fake
+    profile.update(DEFAULTS)
+    log.clear()
+    monkeypatch.setattr(settings, "OPENAI_BASE_URL", base_url)
+    # The client's connections belong to the event loop of the test that made them
+    llm.get_openai_client.cache_clear()
+    service = LLMService()
+    service.hedge_delay = None
+    service.circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    yield service
+    llm.get_openai_client.cache_clear()
+
+
+def error_code(result):
+    return result.error.code if result.error else None
+
+
+def test_breaker_opens_and_closes_after_one_trial():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED and breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN and not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert breaker.state == CircuitState.HALF_OPEN
+    # Only the one trial request until it reports back
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED and breaker.allow_request()
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN and not breaker.allow_request()
+
+
+def test_breaker_through_the_service(fake, service):
+    profile, log, _ = fake
+    profile.update({"error_rate": 1.0, "error_status": 500})
+
+    async def run():
+        # A 500 is retried once; both failures count
+        result = await service.generate_todo_suggestion([], user_id=1)
+        assert error_code(result) == SuggestionErrorCode.UPSTREAM_ERROR
+        assert len(log.snapshot()) == 2
+        assert service.circuit_breaker.state == CircuitState.OPEN
+
+        # Rejected without a request while open
+        result = await service.generate_todo_suggestion([], user_id=1)
+        assert error_code(result) == SuggestionErrorCode.CIRCUIT_OPEN
+        assert len(log.snapshot()) == 2
+
+        # After the reset timeout one trial goes through and closes it
+        await asyncio.sleep(0.25)
+        profile.update({"error_rate": 0.0, "latency_ms": 100})
+        trial, rejected = await asyncio.gather(
+            service.generate_todo_suggestion([], user_id=1),
+            service.generate_todo_suggestion([], user_id=1),
+        )
+        assert (
+            trial.suggestion
+            and error_code(rejected) == SuggestionErrorCode.CIRCUIT_OPEN
+        )
+        assert len(log.snapshot()) == 3
+        assert service.circuit_breaker.state == CircuitState.CLOSED
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("status", [400, 429])
+def test_client_errors_are_not_retried(fake, service, status):
+    profile, log, _ = fake
+    profile.update({"error_rate": 1.0, "error_status": status})
+    result = asyncio.run(service.generate_todo_suggestion([], user_id=1))
+    assert result.error is not None
+    assert len(log.snapshot()) == 1
+
+
+@pytest.mark.parametrize("timeout, deadline", [(0.2, None), (60, 0.2)])
+def test_deadline_bounds_the_request(fake, service, timeout, deadline):
+    profile, _, _ = fake
+    profile.update({"latency_ms": 2000})
+    service.timeout = timeout
+
+    started = time.perf_counter()
+    result = asyncio.run(
+        service.generate_todo_suggestion(
+            [], user_id=1, deadline=Deadline(deadline) if deadline else None
+        )
+    )
+    assert error_code(result) == SuggestionErrorCode.TIMEOUT
+    assert time.perf_counter() - started < 1.0
+
+
+def test_service_hedges_a_slow_request(fake, service):
+    profile, log, _ = fake
+    profile.update({"latency_ms": 300})
+    service.hedge_delay = 0.1
+
+    async def run():
+        started = time.time()
+        result = await service.generate_todo_suggestion([], user_id=1)
+        assert result.suggestion
+        # Wait for the losing attempt to be logged as well
+        await asyncio.sleep(0.4)
+        arrivals = sorted(entry["started_at"] - started for entry in log.snapshot())
+        assert len(arrivals) == 2
+        # The first arrives once the connection is made, the hedge not
+        # before the delay
+        assert arrivals[0] < 0.1 and arrivals[1] >= 0.095
+
+    asyncio.run(run())
+
+
+def test_prompt_tokens_cover_the_whole_prompt(service):
+    todos = [
+        ContextTodo(
+            title="Write report",
+            description="Quarterly numbers",
+            status=TodoStatus.PENDING,
+            priority=2,
+            created_at=None,
+        )
+    ]
+    system_message = service._create_system_message(todos, None)
+    expected = count_tokens(system_message) + count_tokens(
+        "Generate a new todo suggestion."
+    )
+    before = PROMPT_TOKENS.snapshot()
+
+    assert asyncio.run(service.generate_todo_suggestion(todos, user_id=1)).suggestion
+    after = PROMPT_TOKENS.snapshot()
+    assert after["count"] == before["count"] + 1
+    assert after["sum"] - before["sum"] == expected
+
+
+def attempts_of(*outcomes):
+    """An attempt function whose calls sleep and return or raise in turn"""
+    started = []
+
+    async def attempt():
+        delay, outcome = outcomes[len(started)]
+        started.append(time.perf_counter())
+        await asyncio.sleep(delay)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    return attempt, started
+
+
+def test_hedge_fires_only_after_the_delay():
+    attempt, started = attempts_of((0.3, "first"), (0.05, "second"))
+    result = asyncio.run(hedged(attempt, Deadline(5), hedge_delay=0.1))
+    assert result == "second"
+    assert len(started) == 2
+    assert started[1] - started[0] >= 0.09
+
+
+def test_no_hedge_before_the_delay():
+    attempt, started = attempts_of((0.05, "first"), (0.0, "second"))
+    assert asyncio.run(hedged(attempt, Deadline(5), hedge_delay=0.1)) == "first"
+    assert len(started) == 1
+
+
+def test_fast_failure_is_not_hedged():
+    attempt, started = attempts_of((0.0, ValueError("bad request")), (0.0, "second"))
+    with pytest.raises(ValueError):
+        asyncio.run(
+            hedged(attempt, Deadline(5), hedge_delay=0.1, retry=lambda e: False)
+        )
+    assert len(started) == 1
+
+
+def test_retryable_failure_is_retried_once():
+    attempt, started = attempts_of(
+        (0.0, ConnectionError()), (0.0, ConnectionError()), (0.0, "third")
+    )
+    with pytest.raises(ConnectionError):
+        asyncio.run(hedged(attempt, Deadline(5), retry=lambda e: True))
+    assert len(started) == 2
+
+
+def test_deadline_bounds_hedged_attempts():
+    attempt, started = attempts_of((1.0, "first"), (1.0, "second"))
+    began = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(hedged(attempt, Deadline(0.2), hedge_delay=0.05))
+    assert len(started) == 2
+    assert time.perf_counter() - began < 0.5
@@ -0,0 +1,280 @@
+"""
+The consistent hash ring, routing and write refusal of app.db.sharding,
+and moving users between two SQLite shards with app.db.rebalance
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from app.core.config import settings
+from app.db import rebalance
+from app.db.models import ArchivedTodo, Tag, Todo, TodoEmbedding, User, todo_tags
+from app.db.rebalance import copy_user, move_user, purge_user
+from app.db.session import Base
+from app.db.sharding import HashRing, ShardMap, ShardRouter, UserMovingError
+
+USERS = range(1, 2001)
+
+
+@pytest.fixture
+def router(tmp_path):
+    """A router over two empty SQLite shards, s0 and s1, reloading its map at once"""
+    urls = {name: f"sqlite+aiosqlite:///{tmp_path / name}.db" for name in ("s0", "s1")}
+    return ShardRouter(urls, str(tmp_path / "shard_map.json"), reload_seconds=0)
+
+
+async def create_schema(router):
+    for shard_engine in router.engines.values():
+        async with shard_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+
+async def add_user(shard_engine, user_id, todos=3):
+    """
+    A user with todos, two tags on the first todo, an embedding and an
+    archived todo
+    """
+    async with shard_engine.begin() as conn:
+        await conn.execute(
+            insert(User.__table__).values(
+                id=user_id,
+                username=f"user{user_id}",
+                email=f"user{user_id}@example.com",
+                hashed_password="x",
+            )
+        )
+        todo_ids = (
+            (
+                await conn.execute(
+                    insert(Todo.__table__).returning(
+                        Todo.id, sort_by_parameter_order=True
+                    ),
+                    [
+                        {
+                            "title": f"Todo {index}",
+                            "status": "PENDING",
+                            "priority": 1,
+                            "user_id": user_id,
+                            "rank": f"1{index:x}",
+                        }
+                        for index in range(1, todos + 1)
+                    ],
+                )
+            )
+            .scalars()
+            .all()
+        )
+        tag_ids = (
+            (
+                await conn.execute(
+                    insert(Tag.__table__).returning(
+                        Tag.id, sort_by_parameter_order=True
+                    ),
+                    [{"user_id": user_id, "name": name} for name in ("home", "work")],
+                )
+            )
+            .scalars()
+            .all()
+        )
+        await conn.execute(
+            insert(todo_tags),
+            [{"todo_id": todo_ids[0], "tag_id": tag_id} for tag_id in tag_ids],
+        )
+        await conn.execute(
+            insert(TodoEmbedding.__table__).values(
+                todo_id=todo_ids[0], model="test", vector=b"\x00\x01"
+            )
+        )
+        await conn.execute(
+            insert(ArchivedTodo.__table__).values(
+                todo_id=999,
+                title="Done",
+                user_id=user_id,
+                tags=["home"],
+                completed_at=datetime(2024, 1, 1),
+            )
+        )
+
+
+async def user_rows(shard_engine, user_id):
+    """A user's rows on a shard, without the IDs that a copy changes"""
+    async with shard_engine.connect() as conn:
+        users = (
+            await conn.execute(select(func.count()).filter(User.id == user_id))
+        ).scalar()
+        todos = (
+            await conn.execute(
+                select(Todo.title, Todo.rank)
+                .filter(Todo.user_id == user_id)
+                .order_by(Todo.rank)
+            )
+        ).all()
+        links = (
+            await conn.execute(
+                select(Todo.title, Tag.name)
+                .join(todo_tags, todo_tags.c.todo_id == Todo.id)
+                .join(Tag, Tag.id == todo_tags.c.tag_id)
+                .filter(Todo.user_id == user_id)
+                .order_by(Tag.name)
+            )
+        ).all()
+        embeddings = (
+            (
+                await conn.execute(
+                    select(TodoEmbedding.vector)
+                    .join(Todo, Todo.id == TodoEmbedding.todo_id)
+                    .filter(Todo.user_id == user_id)
+                )
+            )
+            .scalars()
+            .all()
+        )
+        archived = (
+            (
+                await conn.execute(
+                    select(ArchivedTodo.title).filter(ArchivedTodo.user_id == user_id)
+                )
+            )
+            .scalars()
+            .all()
+        )
+    return {
+        "users": users,
+        "todos": [tuple(row) for row in todos],
+        "links": [tuple(row) for row in links],
+        "embeddings": embeddings,
+        "archived": archived,
+    }
+
+
+async def dispose(router):
+    for shard_engine in router.engines.values():
+        await shard_engine.dispose()
+
+
+def test_ring_is_deterministic():
+    first, second = HashRing(["s0", "s1", "s2"]), HashRing(["s2", "s0", "s1"])
+    assert [first.get(user_id) for user_id in USERS] == [
+        second.get(user_id) for user_id in USERS
+    ]
+    assert set(first.get(user_id) for user_id in USERS) == {"s0", "s1", "s2"}
+
+
+@pytest.mark.parametrize("shards", [1, 2, 3, 5])
+def test_adding_a_shard_only_moves_keys_to_it(shards):
+    names = [f"s{index}" for index in range(shards)]
+    before, after = HashRing(names), HashRing(names + ["new"])
+    moved = [user_id for user_id in USERS if before.get(user_id) != after.get(user_id)]
+    assert all(after.get(user_id) == "new" for user_id in moved)
+    # About 1/N of the keys move, where N is the new number of shards
+    assert abs(len(moved) / len(USERS) - 1 / (shards + 1)) < 0.1
+
+
+def test_pinned_users_stay_put(router):
+    user_id = next(user_id for user_id in USERS if router.ring.get(user_id) == "s0")
+    assert router.shard_for(user_id) == "s0"
+    ShardMap(users={user_id: "s1"}).save(router.map_file)
+    assert router.shard_for(user_id) == "s1"
+    ShardMap().save(router.map_file)
+    assert router.shard_for(user_id) == "s0"
+
+
+def test_unsharded_router_has_one_shard(tmp_path):
+    router = ShardRouter({}, str(tmp_path / "shard_map.json"), reload_seconds=0)
+    assert list(router.engines) == ["default"]
+    assert router.shard_for(12345) == "default"
+    assert router.moving_users() == []
+
+
+def test_writes_are_refused_while_moving(router):
+    user_id = next(user_id for user_id in USERS if router.ring.get(user_id) == "s0")
+
+    async def run():
+        await create_schema(router)
+        await add_user(router.engines["s0"], user_id, todos=1)
+        ShardMap(moving={user_id: "s1"}).save(router.map_file)
+        assert router.moving_users() == [user_id]
+
+        async with router.session(user_id) as session:
+            todo = (
+                await session.execute(select(Todo).filter_by(user_id=user_id))
+            ).scalar_one()
+            todo.title = "Renamed"
+            with pytest.raises(UserMovingError):
+                await session.flush()
+            await session.rollback()
+        async with router.session(user_id) as session:
+            with pytest.raises(UserMovingError):
+                await session.execute(
+                    Todo.__table__.update()
+                    .filter_by(user_id=user_id)
+                    .values(title="Renamed")
+                )
+
+        # Writes resume once the move is over
+        ShardMap().save(router.map_file)
+        async with router.session(user_id) as session:
+            todo = (
+                await session.execute(select(Todo).filter_by(user_id=user_id))
+            ).scalar_one()
+            todo.title = "Renamed"
+            await session.commit()
+        await dispose(router)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 500])
+def test_copy_and_purge_user(router, batch_size):
+    async def run():
+        await create_schema(router)
+        source, target = router.engines["s0"], router.engines["s1"]
+        await add_user(source, 1, todos=5)
+        await add_user(source, 2, todos=2)
+        expected = await user_rows(source, 1)
+
+        copied = await copy_user(source, target, 1, batch_size)
+        assert copied == {"tags": 2, "todos": 5, "archived todos": 1}
+        assert await user_rows(target, 1) == expected
+        assert (await user_rows(target, 2))["users"] == 0
+
+        assert await purge_user(source, 1, batch_size) == 5
+        assert await user_rows(source, 1) == {
+            "users": 0,
+            "todos": [],
+            "links": [],
+            "embeddings": [],
+            "archived": [],
+        }
+        # Other users' rows are left alone
+        assert len((await user_rows(source, 2))["todos"]) == 2
+        await dispose(router)
+
+    asyncio.run(run())
+
+
+def test_move_user(router, monkeypatch):
+    user_id = next(user_id for user_id in USERS if router.ring.get(user_id) == "s0")
+    monkeypatch.setattr(rebalance, "shards", router)
+    monkeypatch.setattr(settings, "SHARD_MAP_RELOAD_SECONDS", 0)
+
+    async def run():
+        await create_schema(router)
+        await add_user(router.engines["s0"], user_id)
+        expected = await user_rows(router.engines["s0"], user_id)
+
+        await move_user(user_id, "s1", batch_size=2, grace_seconds=0)
+        assert ShardMap.load(router.map_file) == ShardMap(users={user_id: "s1"})
+        assert router.shard_for(user_id) == "s1"
+        assert await user_rows(router.engines["s1"], user_id) == expected
+        assert (await user_rows(router.engines["s0"], user_id))["users"] == 0
+
+        # And back to where the ring places the user, unpinning them
+        await move_user(user_id, "s0", batch_size=2, grace_seconds=0)
+        assert ShardMap.load(router.map_file) == ShardMap()
+        assert await user_rows(router.engines["s0"], user_id) == expected
+        await dispose(router)
+
+    asyncio.run(run())
@@ -0,0 +1,130 @@
+"""
+Tags through TodoService: normalization, deduplication, filtering todos
+by any or all of their tags, and tags created by concurrent requests
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+from app.db.models import Tag
+from app.services.todo import TodoService, normalize_tag_names
+
+
+def run(sessionmaker, scenario):
+    """Run a coroutine function with a TodoService on a new session"""
+
+    async def main():
+        async with sessionmaker() as session:
+            return await scenario(TodoService(session))
+
+    return asyncio.run(main())
+
+
+async def tag_names(service, user_id=1):
+    return [tag.name for tag in await service.get_tags(user_id)]
+
+
+@pytest.mark.parametrize(
+    "names, normalized",
+    [
+        (["Work", "#work", " WORK ", "# work"], ["work"]),
+        (["#Home", "errands", "", "  ", "#"], ["home", "errands"]),
+        (["b", "a", "B"], ["b", "a"]),
+    ],
+)
+def test_normalize_tag_names(names, normalized):
+    assert normalize_tag_names(names) == normalized
+
+
+def test_tag_names_are_limited():
+    with pytest.raises(ValueError):
+        normalize_tag_names(["x" * 51])
+
+
+def test_create_and_update_dedupe_tags(sessionmaker):
+    async def scenario(service):
+        todo = await service.create_todo(
+            1, "Plan trip", tags=["Travel", "#travel", "Home"]
+        )
+        assert [tag.name for tag in todo.tags] == ["home", "travel"]
+
+        todo = await service.update_todo(todo.id, 1, tags=["#TRAVEL", "Visa", "visa"])
+        assert [tag.name for tag in todo.tags] == ["travel", "visa"]
+        # Tags are kept once created, and are per user
+        assert await tag_names(service) == ["home", "travel", "visa"]
+        other = await service.create_todo(2, "Pack", tags=["travel"])
+        assert other.tags[0].id not in {tag.id for tag in todo.tags}
+
+        todo = await service.update_todo(todo.id, 1, tags=[])
+        assert todo.tags == []
+
+    run(sessionmaker, scenario)
+
+
+def test_filter_by_any_or_all_tags(sessionmaker):
+    async def scenario(service):
+        both = await service.create_todo(1, "Both", tags=["work", "urgent"])
+        work = await service.create_todo(1, "Work", tags=["work"])
+        urgent = await service.create_todo(1, "Urgent", tags=["urgent"])
+        await service.create_todo(1, "Untagged")
+        await service.create_todo(2, "Someone else's", tags=["work", "urgent"])
+
+        async def titles(tags, match_all):
+            todos = await service.get_todos(1, tags=tags, match_all=match_all)
+            return sorted(todo.title for todo in todos)
+
+        assert await titles(["work", "urgent"], True) == [both.title]
+        assert await titles(["#Work", "URGENT", "work"], True) == [both.title]
+        assert await titles(["work", "urgent"], False) == sorted(
+            [both.title, work.title, urgent.title]
+        )
+        assert await titles(["work"], True) == sorted([both.title, work.title])
+        assert await titles(["work", "missing"], True) == []
+        assert await titles(["work", "missing"], False) == sorted(
+            [both.title, work.title]
+        )
+        assert len(await titles([], True)) == 4
+
+    run(sessionmaker, scenario)
+
+
+@pytest.mark.parametrize("operation", ["create", "update"])
+def test_tag_created_concurrently(sessionmaker, operation):
+    async def main():
+        async with sessionmaker() as setup:
+            existing = await TodoService(setup).create_todo(1, "Existing")
+
+        async with sessionmaker() as other, sessionmaker() as session:
+            execute = session.execute
+            lookups = []
+
+            async def execute_then_race(statement, *args, **kwargs):
+                result = await execute(statement, *args, **kwargs)
+                # The other request creates a tag right after this one
+                # looked it up
+                selects_tags = getattr(statement, "is_select", False) and any(
+                    column["entity"] is Tag for column in statement.column_descriptions
+                )
+                if selects_tags and not lookups:
+                    lookups.append(statement)
+                    other.add(Tag(user_id=1, name="urgent"))
+                    await other.commit()
+                return result
+
+            session.execute = execute_then_race
+            service = TodoService(session)
+            if operation == "create":
+                todo = await service.create_todo(1, "Call", tags=["Urgent", "home"])
+            else:
+                todo = await service.update_todo(
+                    existing.id, 1, tags=["Urgent", "home"]
+                )
+            assert [tag.name for tag in todo.tags] == ["home", "urgent"]
+
+            count = await session.execute(
+                select(func.count()).select_from(Tag).filter(Tag.name == "urgent")
+            )
+            assert count.scalar() == 1
+
+    asyncio.run(main())
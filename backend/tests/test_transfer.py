@@ -0,0 +1,206 @@
+"""
+Exporting and importing todos as NDJSON and CSV through the transfer
+routes, on a database of the test's own
+"""
+import asyncio
+import csv
+import io
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import func, select
+
+from app.api import transfer
+from app.db.models import Todo
+
+TODOS_URL = "http://test/api/v1/todos"
+
+
+class SingleShard:
+    """Routes every user to the test's database"""
+
+    def __init__(self, sessionmaker):
+        self.sessionmaker = sessionmaker
+
+    def session(self, user_id):
+        return self.sessionmaker()
+
+
+@pytest.fixture
+def client(sessionmaker, monkeypatch):
+    """Call the transfer routes in-process, as the default user"""
+    monkeypatch.setattr(transfer, "shards", SingleShard(sessionmaker))
+    app = FastAPI()
+    app.include_router(transfer.router, prefix="/api/v1")
+
+    def request(method, path, **kwargs):
+        async def send():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport) as http:
+                return await http.request(method, f"{TODOS_URL}{path}", **kwargs)
+
+        return asyncio.run(send())
+
+    return request
+
+
+def import_body(client, body, format):
+    response = client("POST", f"/import?format={format}", content=body.encode())
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def export_ndjson(client):
+    response = client("GET", "/export?format=ndjson")
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def ndjson(*rows):
+    return "".join(json.dumps(row) + "\n" for row in rows)
+
+
+def test_ndjson_round_trip(client):
+    rows = [
+        {"title": "Write report", "priority": 3, "tags": ["Work", "#urgent"]},
+        {
+            "title": "Pay rent",
+            "description": "Before the 1st",
+            "status": "completed",
+            "created_at": "2024-01-01T09:00:00",
+            "due_date": "2024-02-01T00:00:00",
+            "is_ai_generated": True,
+            "tags": "home, bills",
+        },
+        {"title": "Untagged"},
+    ]
+    assert import_body(client, ndjson(*rows), "ndjson") == {
+        "imported": 3,
+        "failed": 0,
+        "errors": [],
+    }
+
+    exported = export_ndjson(client)
+    assert [todo["title"] for todo in exported] == [row["title"] for row in rows]
+    assert [todo["tags"] for todo in exported] == [
+        ["urgent", "work"],
+        ["bills", "home"],
+        [],
+    ]
+    assert exported[0]["priority"] == 3 and exported[2]["priority"] == 1
+    rent = exported[1]
+    assert rent["status"] == "COMPLETED"
+    assert rent["completed_at"] == rent["created_at"] == "2024-01-01T09:00:00"
+    assert rent["due_date"] == "2024-02-01T00:00:00"
+    assert rent["is_ai_generated"] is True
+
+    # Exported todos import again as they were, tags included
+    assert import_body(client, ndjson(*exported), "ndjson")["imported"] == 3
+    again = export_ndjson(client)[3:]
+    for field in ("title", "description", "status", "priority", "due_date", "tags"):
+        assert [todo[field] for todo in again] == [todo[field] for todo in exported]
+
+
+def test_csv_round_trip_with_multi_line_fields(client):
+    description = 'First line\nSecond line, with a comma\nand "quotes"'
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["title", "description", "priority", "tags"])
+    writer.writerow(["Multi-line", description, "2", "work,home"])
+    writer.writerow(["Quoted, title", "", "1", ""])
+    writer.writerow(["Blank lines\n\nin between", "x", "1", "work"])
+
+    result = import_body(client, buffer.getvalue(), "csv")
+    assert result == {"imported": 3, "failed": 0, "errors": []}
+
+    response = client("GET", "/export?format=csv")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["title"] for row in rows] == [
+        "Multi-line",
+        "Quoted, title",
+        "Blank lines\n\nin between",
+    ]
+    assert rows[0]["description"] == description
+    assert rows[0]["tags"] == "home,work"
+    assert rows[1]["description"] == "" and rows[1]["tags"] == ""
+
+    assert import_body(client, response.text, "csv")["imported"] == 3
+    exported = export_ndjson(client)
+    assert [todo["description"] for todo in exported[3:]] == [description, None, "x"]
+    assert [todo["tags"] for todo in exported[3:]] == [["home", "work"], [], ["work"]]
+
+
+def test_invalid_rows_are_reported_by_number(client):
+    body = "\n".join(
+        [
+            json.dumps({"title": "Valid"}),
+            json.dumps({"title": ""}),
+            "",
+            json.dumps({"title": "Priority zero", "priority": 0}),
+            json.dumps({"title": "Blank priority", "priority": ""}),
+            "not json",
+            json.dumps(["a", "list"]),
+            json.dumps({"title": "Bad status", "status": "DONE"}),
+            json.dumps({"title": 42}),
+            json.dumps({"title": "Bad tags", "tags": [1, 2]}),
+            json.dumps({"title": "Bad date", "due_date": "tomorrow"}),
+            json.dumps({"title": "Also valid", "priority": "2"}),
+        ]
+    )
+    result = import_body(client, body, "ndjson")
+    assert result["imported"] == 2
+    assert result["failed"] == 9
+    # The blank line is not a row
+    assert [error["row"] for error in result["errors"]] == list(range(2, 11))
+    assert [todo["title"] for todo in export_ndjson(client)] == ["Valid", "Also valid"]
+
+
+def test_csv_row_numbers_count_records_not_lines(client):
+    body = 'title,priority\n"Two\nlines",1\nBad,7\nGood,2\n'
+    result = import_body(client, body, "csv")
+    assert result["imported"] == 2
+    assert result["errors"] == [{"row": 2, "error": result["errors"][0]["error"]}]
+
+
+def test_batches_cross_the_batch_size(client, sessionmaker, monkeypatch):
+    monkeypatch.setattr(transfer, "IMPORT_BATCH_SIZE", 4)
+    monkeypatch.setattr(transfer, "MAX_REPORTED_ERRORS", 1)
+    rows = []
+    for index in range(11):
+        rows.append({"title": f"Todo {index}", "tags": [f"tag{index % 3}"]})
+        if index % 5 == 4:
+            rows.append({"title": ""})
+
+    result = import_body(client, ndjson(*rows), "ndjson")
+    assert result["imported"] == 11
+    assert result["failed"] == 2
+    # Both are counted, only the first is reported
+    assert [error["row"] for error in result["errors"]] == [6]
+
+    exported = export_ndjson(client)
+    assert [todo["title"] for todo in exported] == [f"Todo {i}" for i in range(11)]
+    assert [todo["tags"] for todo in exported] == [[f"tag{i % 3}"] for i in range(11)]
+
+    async def ranks():
+        async with sessionmaker() as session:
+            result = await session.execute(
+                select(Todo.title).filter(Todo.user_id == 1).order_by(Todo.rank)
+            )
+            titles = result.scalars().all()
+            count = await session.execute(
+                select(func.count(func.distinct(Todo.rank))).filter(Todo.user_id == 1)
+            )
+            return titles, count.scalar()
+
+    titles, distinct_ranks = asyncio.run(ranks())
+    # Imported in order, after any existing todos, each with its own key
+    assert titles == [f"Todo {i}" for i in range(11)]
+    assert distinct_ranks == 11
+
+    # A second import goes after the first
+    import_body(client, ndjson({"title": "Later"}), "ndjson")
+    assert asyncio.run(ranks())[0][-1] == "Later"
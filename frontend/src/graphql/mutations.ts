@@ -53,6 +53,10 @@ export const GENERATE_TODO_SUGGESTION = gql`
   mutation GenerateTodoSuggestion {
     generateTodoSuggestion {
       suggestion
+      error {
+        code
+        message
+      }
     }
   }
 `;
@@ -100,8 +104,14 @@ export interface DeleteTodoResponse {
   };
 }
 
+export interface SuggestionError {
+  code: 'TIMEOUT' | 'CIRCUIT_OPEN' | 'RATE_LIMITED' | 'UPSTREAM_ERROR' | 'INVALID_RESPONSE' | 'INTERNAL_ERROR';
+  message: string;
+}
+
 export interface GenerateTodoSuggestionResponse {
   generateTodoSuggestion: {
-    suggestion: string;
+    suggestion: string | null;
+    error: SuggestionError | null;
   };
 }
\ No newline at end of file
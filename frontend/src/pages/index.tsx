@@ -62,6 +62,8 @@ const Home: React.FC = () => {
       onCompleted: (data) => {
         if (data?.generateTodoSuggestion?.suggestion) {
           setGeneratedText(data.generateTodoSuggestion.suggestion);
+        } else if (data?.generateTodoSuggestion?.error) {
+          console.error("Error generating todo:", data.generateTodoSuggestion.error.message);
         }
         setIsGenerating(false);
         clearSpinnerState();
@@ -7,15 +7,15 @@ from pathlib import Path
 # Add the parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from backend.app.db.session import initialize_database
+from backend.app.db.migrations import migrate
 from backend.app.db.seed import seed_database
 
 
 async def init():
-    """Initialize the database and seed it with sample data."""
-    print("Initializing database...")
-    await initialize_database()
-    print("Database tables created!")
+    """Migrate the database and seed it with sample data."""
+    print("Migrating database...")
+    version = await migrate()
+    print(f"Database schema is at version {version}!")
 
     print("Seeding database with sample data...")
     await seed_database()